@@ -0,0 +1,19 @@
+"""Fuel's benchmark suite.
+
+The benchmarks are written for `airspeed velocity`_ (asv), which keeps
+track of their results across commits. From the root of the repository,
+run e.g.
+
+.. code-block:: bash
+
+   $ asv run                            # benchmark the latest commit
+   $ asv continuous master HEAD         # compare HEAD with master
+   $ asv publish && asv preview         # browse the results over time
+
+All data is synthetic: HDF5 files are created in a temporary directory
+using :func:`~fuel.converters.base.fill_hdf5_file`, so no dataset needs to
+be downloaded.
+
+.. _airspeed velocity: https://asv.readthedocs.io/
+
+"""
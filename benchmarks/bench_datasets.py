@@ -0,0 +1,116 @@
+"""Benchmarks of :class:`~fuel.datasets.H5PYDataset` access patterns."""
+from fuel.datasets import H5PYDataset
+from fuel.schemes import (SequentialExampleScheme, SequentialScheme,
+                          ShuffledScheme)
+from fuel.streams import DataStream
+
+from .common import (TemporaryDirectoryMixin, create_hdf5_file,
+                     create_vlen_hdf5_file, NUM_EXAMPLES)
+
+BATCH_SIZE = 128
+
+
+def read_epoch(data_stream):
+    for _ in data_stream.get_epoch_iterator():
+        pass
+
+
+class H5PYDatasetAccess(TemporaryDirectoryMixin):
+    """Reading one epoch of fixed-size examples."""
+    params = [[True, False]]
+    param_names = ['load_in_memory']
+
+    def setup(self, load_in_memory):
+        self.make_temporary_directory()
+        create_hdf5_file(self.path('data.hdf5'))
+        self.dataset = H5PYDataset(self.path('data.hdf5'), ('train',),
+                                   load_in_memory=load_in_memory)
+        self.unsorted_dataset = H5PYDataset(
+            self.path('data.hdf5'), ('train',), sort_indices=False,
+            load_in_memory=load_in_memory)
+        self.coalescing_dataset = H5PYDataset(
+            self.path('data.hdf5'), ('train',), coalesce_gap=16,
+            load_in_memory=load_in_memory)
+        self.h5py_dataset = H5PYDataset(
+            self.path('data.hdf5'), ('train',), memory_map=False,
+            load_in_memory=load_in_memory)
+
+    def teardown(self, load_in_memory):
+        self.remove_temporary_directory()
+
+    def time_sequential(self, load_in_memory):
+        read_epoch(DataStream(
+            self.dataset,
+            iteration_scheme=SequentialScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+    def time_shuffled(self, load_in_memory):
+        # Unsorted requests, sorted and reshuffled by the dataset.
+        read_epoch(DataStream(
+            self.dataset,
+            iteration_scheme=ShuffledScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+    def time_shuffled_sorted_indices(self, load_in_memory):
+        # Sorted requests, passed as-is to h5py.
+        read_epoch(DataStream(
+            self.unsorted_dataset,
+            iteration_scheme=ShuffledScheme(NUM_EXAMPLES, BATCH_SIZE,
+                                            sorted_indices=True)))
+
+    def time_shuffled_coalesced(self, load_in_memory):
+        # Nearby indices read together, discarding the ones in between.
+        read_epoch(DataStream(
+            self.coalescing_dataset,
+            iteration_scheme=ShuffledScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+    def time_shuffled_without_memory_map(self, load_in_memory):
+        # Every read goes through h5py, even for contiguous sources.
+        read_epoch(DataStream(
+            self.h5py_dataset,
+            iteration_scheme=ShuffledScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+    def time_single_examples(self, load_in_memory):
+        read_epoch(DataStream(
+            self.dataset, iteration_scheme=SequentialExampleScheme(1000)))
+
+
+class H5PYDatasetVlenAccess(TemporaryDirectoryMixin):
+    """Reading one epoch of variable-length examples."""
+    params = [[True, False]]
+    param_names = ['load_in_memory']
+
+    def setup(self, load_in_memory):
+        self.make_temporary_directory()
+        create_vlen_hdf5_file(self.path('vlen.hdf5'))
+        self.dataset = H5PYDataset(self.path('vlen.hdf5'), ('train',),
+                                   load_in_memory=load_in_memory)
+
+    def teardown(self, load_in_memory):
+        self.remove_temporary_directory()
+
+    def time_sequential(self, load_in_memory):
+        read_epoch(DataStream(
+            self.dataset,
+            iteration_scheme=SequentialScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+    def time_shuffled(self, load_in_memory):
+        read_epoch(DataStream(
+            self.dataset,
+            iteration_scheme=ShuffledScheme(NUM_EXAMPLES, BATCH_SIZE)))
+
+
+class H5PYDatasetOpen(TemporaryDirectoryMixin):
+    """Instantiating a dataset, which parses the file's metadata."""
+    params = [[True, False]]
+    param_names = ['load_in_memory']
+
+    def setup(self, load_in_memory):
+        self.make_temporary_directory()
+        create_hdf5_file(self.path('data.hdf5'))
+
+    def teardown(self, load_in_memory):
+        self.remove_temporary_directory()
+
+    def time_open(self, load_in_memory):
+        dataset = H5PYDataset(self.path('data.hdf5'), ('train',),
+                              load_in_memory=load_in_memory)
+        dataset.close(dataset.open())
@@ -0,0 +1,31 @@
+"""Benchmarks of iteration schemes."""
+from fuel.schemes import (SequentialScheme, ShuffledScheme,
+                          ShuffledExampleScheme)
+
+NUM_EXAMPLES = 1000000
+
+
+def exhaust(scheme):
+    for _ in scheme.get_request_iterator():
+        pass
+
+
+class BatchSchemes(object):
+    """Producing all the requests of an epoch."""
+    params = [[1, 128]]
+    param_names = ['batch_size']
+
+    def time_sequential(self, batch_size):
+        exhaust(SequentialScheme(NUM_EXAMPLES, batch_size))
+
+    def time_shuffled(self, batch_size):
+        exhaust(ShuffledScheme(NUM_EXAMPLES, batch_size))
+
+    def time_shuffled_sorted_indices(self, batch_size):
+        exhaust(ShuffledScheme(NUM_EXAMPLES, batch_size,
+                               sorted_indices=True))
+
+
+class ExampleSchemes(object):
+    def time_shuffled(self):
+        exhaust(ShuffledExampleScheme(NUM_EXAMPLES))
@@ -0,0 +1,50 @@
+"""Benchmarks of the data server."""
+import socket
+from multiprocessing import Process
+
+from fuel.datasets import H5PYDataset
+from fuel.schemes import SequentialScheme
+from fuel.server import start_server
+from fuel.streams import DataStream, ServerDataStream
+
+from .common import TemporaryDirectoryMixin, create_hdf5_file, NUM_EXAMPLES
+
+BATCH_SIZE = 128
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+class ServerRoundTrip(TemporaryDirectoryMixin):
+    """Reading one epoch through :class:`.ServerDataStream`."""
+    # Every repeat reads a full epoch from the same server
+    number = 1
+
+    def setup(self):
+        self.make_temporary_directory()
+        create_hdf5_file(self.path('data.hdf5'))
+        dataset = H5PYDataset(self.path('data.hdf5'), ('train',),
+                              load_in_memory=True)
+        data_stream = DataStream(
+            dataset,
+            iteration_scheme=SequentialScheme(NUM_EXAMPLES, BATCH_SIZE))
+        port = free_port()
+        self.server_process = Process(target=start_server,
+                                      args=(data_stream, port))
+        self.server_process.start()
+        self.stream = ServerDataStream(dataset.sources, False, port=port)
+
+    def teardown(self):
+        self.server_process.terminate()
+        self.server_process.join()
+        self.remove_temporary_directory()
+
+    def time_round_trip(self):
+        for _ in self.stream.get_epoch_iterator():
+            pass
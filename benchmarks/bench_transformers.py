@@ -0,0 +1,108 @@
+"""Benchmarks of transformers."""
+import math
+from collections import OrderedDict
+
+import numpy
+
+from fuel.datasets import IndexableDataset
+from fuel.schemes import (ConstantScheme, SequentialExampleScheme,
+                          SequentialScheme)
+from fuel.streams import DataStream
+from fuel.transformers import Batch, Cache, Padding
+from fuel.transformers.image import RandomFixedSizeCrop, Random2DRotation
+
+from .common import IMAGE_SHAPE
+
+NUM_EXAMPLES = 2000
+BATCH_SIZE = 128
+
+
+def read_epoch(data_stream):
+    for _ in data_stream.get_epoch_iterator():
+        pass
+
+
+def image_dataset(num_examples=NUM_EXAMPLES, image_shape=IMAGE_SHAPE):
+    rng = numpy.random.RandomState(1)
+    features = rng.randint(
+        256, size=(num_examples,) + image_shape).astype('uint8')
+    targets = rng.randint(10, size=(num_examples, 1)).astype('uint8')
+    return IndexableDataset(
+        OrderedDict([('features', features), ('targets', targets)]),
+        axis_labels={'features': ('batch', 'channel', 'height', 'width'),
+                     'targets': ('batch', 'index')})
+
+
+def sequence_dataset(num_examples=NUM_EXAMPLES, max_length=100):
+    rng = numpy.random.RandomState(1)
+    lengths = rng.randint(1, max_length + 1, size=num_examples)
+    features = [rng.uniform(size=(length, 10)).astype('float32')
+                for length in lengths]
+    targets = [rng.randint(10, size=length) for length in lengths]
+    return IndexableDataset(
+        OrderedDict([('features', features), ('targets', targets)]))
+
+
+class BatchTransformer(object):
+    """Batching examples one by one."""
+    def setup(self):
+        self.dataset = image_dataset()
+
+    def time_batch(self):
+        read_epoch(Batch(
+            DataStream(self.dataset,
+                       iteration_scheme=SequentialExampleScheme(NUM_EXAMPLES)),
+            iteration_scheme=ConstantScheme(BATCH_SIZE)))
+
+
+class PaddingTransformer(object):
+    """Padding batches of variable-length sequences."""
+    def setup(self):
+        self.dataset = sequence_dataset()
+
+    def time_padding(self):
+        read_epoch(Padding(DataStream(
+            self.dataset,
+            iteration_scheme=SequentialScheme(NUM_EXAMPLES, BATCH_SIZE))))
+
+
+class CacheTransformer(object):
+    """Re-batching large batches into smaller ones."""
+    params = [[1, 32, 128]]
+    param_names = ['batch_size']
+
+    def setup(self, batch_size):
+        self.dataset = image_dataset()
+
+    def time_cache(self, batch_size):
+        read_epoch(Cache(
+            DataStream(self.dataset,
+                       iteration_scheme=SequentialScheme(NUM_EXAMPLES,
+                                                         1000)),
+            iteration_scheme=ConstantScheme(batch_size)))
+
+
+class ImageTransformers(object):
+    """Random crops and rotations of batches of images."""
+    params = [['array', 'list']]
+    param_names = ['batch_format']
+
+    def setup(self, batch_format):
+        dataset = image_dataset()
+        if batch_format == 'list':
+            dataset.indexables = [list(indexable)
+                                  for indexable in dataset.indexables]
+        self.dataset = dataset
+
+    def stream(self):
+        return DataStream(
+            self.dataset,
+            iteration_scheme=SequentialScheme(NUM_EXAMPLES, BATCH_SIZE))
+
+    def time_random_fixed_size_crop(self, batch_format):
+        read_epoch(RandomFixedSizeCrop(self.stream(), (24, 24),
+                                       which_sources=('features',)))
+
+    def time_random_2d_rotation(self, batch_format):
+        read_epoch(Random2DRotation(self.stream(), math.pi / 6,
+                                    which_sources=('features',)))
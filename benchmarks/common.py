@@ -0,0 +1,90 @@
+"""Synthetic data shared by the benchmarks."""
+import os
+import shutil
+import tempfile
+
+import h5py
+import numpy
+
+from fuel.converters.base import fill_hdf5_file
+from fuel.datasets import H5PYDataset
+
+NUM_EXAMPLES = 10000
+IMAGE_SHAPE = (3, 32, 32)
+
+
+def create_hdf5_file(path, num_examples=NUM_EXAMPLES,
+                     image_shape=IMAGE_SHAPE):
+    """Creates an HDF5 file with `features` and `targets` sources.
+
+    The file has a `train` split spanning all examples, with uint8
+    features of shape `image_shape` and one integer target per example.
+
+    """
+    rng = numpy.random.RandomState(1)
+    features = rng.randint(
+        256, size=(num_examples,) + image_shape).astype('uint8')
+    targets = rng.randint(10, size=(num_examples, 1)).astype('uint8')
+    with h5py.File(path, mode='w') as h5file:
+        fill_hdf5_file(h5file, (('train', 'features', features),
+                                ('train', 'targets', targets)))
+        h5file['features'].dims[0].label = 'batch'
+        h5file['targets'].dims[0].label = 'batch'
+        for i, label in enumerate(('channel', 'height', 'width')):
+            h5file['features'].dims[i + 1].label = label
+        h5file['targets'].dims[1].label = 'index'
+
+
+def create_vlen_hdf5_file(path, num_examples=NUM_EXAMPLES,
+                          max_image_shape=IMAGE_SHAPE):
+    """Creates an HDF5 file with a variable-length `features` source.
+
+    Each example is a uint8 image with `max_image_shape[0]` channels and a
+    random height and width no larger than those of `max_image_shape`.
+
+    """
+    rng = numpy.random.RandomState(1)
+    channels, max_height, max_width = max_image_shape
+    shapes = numpy.column_stack([
+        numpy.repeat(channels, num_examples),
+        rng.randint(max_height // 2, max_height + 1, size=num_examples),
+        rng.randint(max_width // 2, max_width + 1, size=num_examples)])
+    with h5py.File(path, mode='w') as h5file:
+        dtype = h5py.special_dtype(vlen=numpy.dtype('uint8'))
+        features = h5file.create_dataset('features', (num_examples,),
+                                         dtype=dtype)
+        features[...] = [rng.randint(256, size=numpy.prod(shape))
+                         .astype('uint8') for shape in shapes]
+        features.dims[0].label = 'batch'
+        features_shapes = h5file.create_dataset(
+            'features_shapes', (num_examples, 3), dtype='uint16')
+        features_shapes[...] = shapes
+        features.dims.create_scale(features_shapes, 'shapes')
+        features.dims[0].attach_scale(features_shapes)
+        features_shape_labels = h5file.create_dataset(
+            'features_shape_labels', (3,), dtype='S7')
+        features_shape_labels[...] = [
+            'channel'.encode('utf8'), 'height'.encode('utf8'),
+            'width'.encode('utf8')]
+        features.dims.create_scale(features_shape_labels, 'shape_labels')
+        features.dims[0].attach_scale(features_shape_labels)
+        targets = h5file.create_dataset('targets', (num_examples, 1),
+                                        dtype='uint8')
+        targets[...] = rng.randint(10, size=(num_examples, 1))
+        targets.dims[0].label = 'batch'
+        targets.dims[1].label = 'index'
+        split_dict = {'train': {'features': (0, num_examples),
+                                'targets': (0, num_examples)}}
+        h5file.attrs['split'] = H5PYDataset.create_split_array(split_dict)
+
+
+class TemporaryDirectoryMixin(object):
+    """Creates a temporary directory for the duration of a benchmark."""
+    def make_temporary_directory(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def path(self, filename):
+        return os.path.join(self.tempdir, filename)
+
+    def remove_temporary_directory(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
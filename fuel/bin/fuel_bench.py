@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""Fuel data loading benchmark utility."""
+from __future__ import division, print_function
+import argparse
+import importlib
+import inspect
+import itertools
+
+import numpy
+import yaml
+from six.moves import cPickle
+
+from fuel import datasets
+from fuel.datasets import Dataset
+from fuel.schemes import SequentialScheme, ShuffledScheme
+from fuel.streams import DataStream
+from fuel.utils.profiling import benchmark_stream
+
+schemes = {'sequential': SequentialScheme, 'shuffled': ShuffledScheme}
+
+columns = [('batch size', '{:>10}'), ('in memory', '{:>10}'),
+           ('sorted', '{:>10}'), ('batches', '{:>10d}'),
+           ('examples/s', '{:>10.1f}'), ('MB/s', '{:>10.2f}'),
+           ('first (ms)', '{:>10.2f}'), ('p50 (ms)', '{:>10.3f}'),
+           ('p90 (ms)', '{:>10.3f}'), ('p99 (ms)', '{:>10.3f}')]
+
+
+def boolean(value):
+    """Parses boolean command-line arguments."""
+    if value.lower() in ('yes', 'true', '1'):
+        return True
+    if value.lower() in ('no', 'false', '0'):
+        return False
+    raise argparse.ArgumentTypeError(
+        "expected 'yes' or 'no', got '{}'".format(value))
+
+
+def keyword_argument(value):
+    """Parses KEY=VALUE arguments, VALUE being parsed as YAML."""
+    key, sep, value = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(
+            "expected KEY=VALUE, got '{}'".format(key))
+    return key, yaml.safe_load(value)
+
+
+def find_dataset_class(name):
+    """Finds a dataset class given its name.
+
+    Parameters
+    ----------
+    name : str
+        Either the name of a dataset as used by ``fuel-convert`` (e.g.
+        ``binarized_mnist``), the name of a class in
+        :mod:`fuel.datasets` (case-insensitive, e.g. ``BinarizedMNIST``),
+        or the full path to a dataset class (e.g.
+        ``package.module.MyDataset``).
+
+    """
+    if '.' in name:
+        module_name, class_name = name.rsplit('.', 1)
+        return getattr(importlib.import_module(module_name), class_name)
+    normalized_name = name.replace('_', '').lower()
+    for class_name, cls in vars(datasets).items():
+        if (inspect.isclass(cls) and issubclass(cls, Dataset) and
+                class_name.lower() == normalized_name):
+            return cls
+    raise ValueError("unknown dataset '{}'".format(name))
+
+
+def format_row(values):
+    cells = []
+    for (_, fmt), value in zip(columns, values):
+        if value is None:
+            value, fmt = '-', '{:>10}'
+        elif isinstance(value, bool):
+            value = 'yes' if value else 'no'
+        cells.append(fmt.format(value))
+    return ' '.join(cells)
+
+
+def print_header():
+    print(' '.join('{:>10}'.format(name) for name, _ in columns))
+    print('-' * (11 * len(columns) - 1))
+
+
+def main(args=None):
+    """Entry point for `fuel-bench` script.
+
+    This function can also be imported and used from Python.
+
+    Parameters
+    ----------
+    args : iterable, optional (default: None)
+        A list of arguments that will be passed to Fuel's benchmarking
+        utility. If this argument is not specified, `sys.argv[1:]` will
+        be used.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Measures the data loading throughput of a dataset '
+                    'or of a pickled data stream.')
+    parser.add_argument(
+        "dataset", nargs='?',
+        help="name of the dataset to benchmark, e.g. mnist")
+    parser.add_argument(
+        "which_sets", nargs='*', default=['train'],
+        help="which split(s) of the dataset to use, default 'train'")
+    parser.add_argument(
+        "--stream", help="benchmark the data stream pickled in this file "
+                         "instead of a dataset")
+    parser.add_argument(
+        "-e", "--epochs", type=int, default=1,
+        help="number of epochs to read, default 1")
+    parser.add_argument(
+        "-n", "--batches", type=int, default=None,
+        help="number of batches to read, overrides --epochs")
+    parser.add_argument(
+        "-b", "--batch-size", type=int, nargs='+', default=[128],
+        help="batch size(s) to compare, default 128")
+    parser.add_argument(
+        "--scheme", choices=sorted(schemes), default='sequential',
+        help="iteration scheme, default sequential")
+    parser.add_argument(
+        "--load-in-memory", type=boolean, nargs='+', default=[None],
+        metavar='{yes,no}',
+        help="value(s) of load_in_memory to compare, default is the "
+             "dataset's own default")
+    parser.add_argument(
+        "--sort-indices", type=boolean, nargs='+', default=[None],
+        metavar='{yes,no}',
+        help="value(s) of sort_indices to compare, default is the "
+             "dataset's own default")
+    parser.add_argument(
+        "-k", "--kwarg", type=keyword_argument, action='append', default=[],
+        metavar='KEY=VALUE',
+        help="additional keyword argument for the dataset constructor, "
+             "e.g. which_format=2 for SVHN")
+    args = parser.parse_args(args)
+
+    if (args.dataset is None) == (args.stream is None):
+        parser.error('give either a dataset name or --stream')
+
+    if args.stream:
+        with open(args.stream, 'rb') as f:
+            data_stream = cPickle.load(f)
+        print_header()
+        report(data_stream, args, (None, None, None))
+        return
+
+    try:
+        dataset_class = find_dataset_class(args.dataset)
+    except (ValueError, ImportError, AttributeError) as e:
+        parser.error(str(e))
+    print_header()
+    for batch_size, load_in_memory, sort_indices in itertools.product(
+            args.batch_size, args.load_in_memory, args.sort_indices):
+        kwargs = dict(args.kwarg)
+        if load_in_memory is not None:
+            kwargs['load_in_memory'] = load_in_memory
+        if sort_indices is not None:
+            kwargs['sort_indices'] = sort_indices
+        dataset = dataset_class(which_sets=tuple(args.which_sets), **kwargs)
+        scheme_kwargs = {}
+        if args.scheme == 'shuffled':
+            # Without sort_indices, the dataset expects sorted requests.
+            scheme_kwargs['sorted_indices'] = sort_indices is False
+        data_stream = DataStream(
+            dataset, iteration_scheme=schemes[args.scheme](
+                dataset.num_examples, batch_size, **scheme_kwargs))
+        report(data_stream, args,
+               (batch_size, getattr(dataset, 'load_in_memory', None),
+                getattr(dataset, 'sort_indices', None)))
+
+
+def report(data_stream, args, configuration):
+    """Benchmarks a data stream and prints the results as a table row."""
+    try:
+        results = benchmark_stream(data_stream, num_epochs=args.epochs,
+                                   num_batches=args.batches)
+    finally:
+        data_stream.close()
+    latencies = 1e3 * results['latencies']
+    percentiles = (numpy.percentile(latencies, [50, 90, 99])
+                   if len(latencies) else [None] * 3)
+    time_to_first_batch = results['time_to_first_batch']
+    print(format_row(
+        list(configuration) +
+        [results['batches'],
+         results['examples'] / results['time'],
+         results['nbytes'] / 1e6 / results['time'],
+         1e3 * time_to_first_batch if time_to_first_batch else None] +
+        list(percentiles)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import numbers
+import os
+import threading
+import weakref
+from functools import partial
 from itertools import product
-from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from collections import defaultdict, OrderedDict
 
 import h5py
 import numpy
@@ -10,8 +15,10 @@ from six.moves import zip, range
 
 from fuel.datasets import Dataset
 from fuel.schemes import SequentialExampleScheme
-from fuel.utils import do_not_pickle_attributes, Subset
+from fuel.utils import (do_not_pickle_attributes, Subset, ragged_arrays,
+                        pad_ragged_arrays)
 from fuel.utils.cache import cache_file
+from fuel.utils.shared import SharedArray, shared_array_name
 
 
 @do_not_pickle_attributes('nodes', 'h5file')
@@ -90,8 +97,88 @@ class PytablesDataset(Dataset):
         return data
 
 
+def _call(function):
+    return function()
+
+
+class ChunkCache(object):
+    """A least-recently-used cache of blocks of examples read from HDF5.
+
+    Blocks are identified by the name of the HDF5 dataset they were read
+    from, the number of examples per block and their index, so that a
+    single cache can be shared by all sources of a file.
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of bytes of data to keep in the cache.
+
+    Attributes
+    ----------
+    hits : int
+        The number of blocks which were found in the cache.
+    misses : int
+        The number of blocks which had to be read from the file.
+    nbytes : int
+        The number of bytes of data currently in the cache.
+
+    Notes
+    -----
+    The size of blocks of variable-length data is estimated as the total
+    size of their examples. Blocks larger than `size` are never cached.
+
+    """
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, read):
+        """Return a cached block, reading it if needed.
+
+        Parameters
+        ----------
+        key : tuple
+            The identifier of the block.
+        read : callable
+            Called without arguments to read the block if it isn't in
+            the cache.
+
+        """
+        with self._lock:
+            if key in self._blocks:
+                self.hits += 1
+                self._blocks[key] = entry = self._blocks.pop(key)
+                return entry[0]
+            self.misses += 1
+        block = read()
+        if block.dtype == object:
+            nbytes = sum(example.nbytes for example in block) + block.nbytes
+        else:
+            nbytes = block.nbytes
+        with self._lock:
+            if nbytes <= self.size and key not in self._blocks:
+                while self.nbytes + nbytes > self.size:
+                    _, (_, evicted_nbytes) = self._blocks.popitem(last=False)
+                    self.nbytes -= evicted_nbytes
+                self._blocks[key] = (block, nbytes)
+                self.nbytes += nbytes
+        return block
+
+    def clear(self):
+        """Remove all blocks from the cache."""
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+
 @do_not_pickle_attributes('data_sources', 'external_file_handle',
-                          'source_shapes', 'in_memory_subset', 'subsets')
+                          'source_shapes', 'in_memory_subset', 'subsets',
+                          'shared_arrays', 'thread_pools',
+                          'readahead_buffers', 'chunk_cache', 'memory_maps')
 class H5PYDataset(Dataset):
     """An h5py-fueled HDF5 dataset.
 
@@ -131,8 +218,13 @@ class H5PYDataset(Dataset):
         Which subset of data to use *within the context of the split*.
         Can be either a slice or a list of indices. Defaults to `None`,
         in which case the whole split is used.
-    load_in_memory : bool, optional
-        Whether to load the data in main memory. Defaults to `False`.
+    load_in_memory : bool or iterable of strings, optional
+        Whether to load the data in main memory. Can also be the names of
+        the sources to load in memory, in which case the other sources
+        are read from the file on each request (this is useful to keep
+        small sources like targets in memory). The shapes of all
+        variable-length sources are then loaded in memory as well.
+        Defaults to `False`.
     driver : str, optional
         Low-level driver to use. Defaults to `None`. See h5py
         documentation for a complete list of available options.
@@ -145,6 +237,74 @@ class H5PYDataset(Dataset):
         performance, set this flag to `False`. Note that in that case,
         it is the user's responsibility to make sure that indices are
         ordered.
+    coalesce_gap : int, optional
+        When data isn't loaded in memory and `sort_indices` is `True`,
+        the indices of list requests are sorted and split into runs of
+        indices which are at most `coalesce_gap` examples apart, and each
+        run is read from the file as a single slice, discarding the
+        examples in between (see
+        :meth:`.Subset.coalesced_fancy_indexing`). A larger gap trades
+        reading unrequested data for fewer reads. This mostly pays off
+        with chunked (e.g. compressed) sources, for which h5py's fancy
+        indexing decompresses chunks over and over. Defaults to `None`,
+        in which case the sorted indices are passed to h5py as they are.
+    cache_size : int, optional
+        When data isn't loaded in memory, blocks of examples read from the
+        file are kept in a least-recently-used cache of at most this many
+        bytes (see :class:`ChunkCache`), which is shared by all datasets
+        reading the same file. This avoids reading and decompressing the
+        same chunks over and over, e.g. when iterating in shuffled order.
+        Defaults to `None`, in which case nothing is cached.
+    cache_block_size : int, optional
+        The number of examples per cached block. Defaults to `None`, in
+        which case each source is cached by chunk (along its first axis),
+        and sources which aren't chunked aren't cached.
+    memory_map : bool, optional
+        When data isn't loaded in memory, sources which are stored
+        contiguously and uncompressed in a file opened by the dataset are
+        read through a :class:`numpy.memmap` of the file instead of h5py.
+        This makes indexing (and especially fancy indexing) much cheaper,
+        and leaves caching to the operating system. Chunked, compressed
+        and variable-length data is still read with h5py (the shapes of
+        variable-length examples are memory-mapped if possible). Set to
+        `False` to always use h5py. Defaults to `True`.
+    shared_memory : bool, optional
+        Whether the data loaded in memory (see `load_in_memory`) should
+        be shared by the processes using the same file, subset and
+        source (e.g. workers processing the same dataset), instead of
+        each process keeping a copy. The data is read by the first
+        process and mapped read-only by the others, see
+        :class:`.SharedArray`. Variable-length data isn't shared.
+        Requires the file to be on disk. Defaults to `False`.
+    vlen_format : {'padded', 'ragged'}, optional
+        How to return batches of variable-length examples. With
+        'padded', each batch is an array padded with zeros to the
+        largest shape in the batch. With 'ragged', each batch is the flat
+        concatenation of its examples, and the dataset provides an
+        additional `<source>_offsets` source with the positions at which
+        each example starts (followed by the total length). Their axis
+        labels are ``('value',)`` and ``('offset',)`` respectively. In both
+        cases, the dataset provides an additional `<source>_shapes`
+        source with the shape of each example. Both formats are built
+        with vectorized operations, which is much faster than reshaping
+        examples one by one. Defaults to `None`, in which case batches
+        are object arrays of examples.
+    read_threads : int, optional
+        When data isn't loaded in memory, the sources (and the shapes of
+        variable-length sources) of each request are read concurrently
+        by a pool of this many threads. This hides the latency of each
+        read, e.g. on network filesystems. Note that h5py only runs one
+        HDF5 call at a time, so this mostly helps when sources are
+        memory-mapped (see `memory_map`) or cached (see `cache_size`).
+        Defaults to `None`, in which case sources are read one after
+        another.
+    readahead : int, optional
+        When data isn't loaded in memory and consecutive requests are
+        consecutive ranges of examples (e.g. from a
+        :class:`.SequentialScheme`), this
+        many batches following the last request are read in a background
+        thread, so that the next requests are served from memory.
+        Defaults to `None`, in which case nothing is read ahead.
 
     Attributes
     ----------
@@ -160,15 +320,28 @@ class H5PYDataset(Dataset):
         All sources provided by this dataset which have variable length.
     default_axis_labels : dict mapping string to tuple of strings
         Maps all sources provided by this dataset to their axis labels.
+    chunk_cache : :class:`ChunkCache` or ``None``
+        The cache shared by the datasets reading the same file, which is
+        kept as long as one of them exists. ``None`` if `cache_size`
+        isn't given.
+    memory_maps : dict
+        Maps the HDF5 names of the sources read so far to their memory
+        maps (see `memory_map`), or to ``None`` if they can't be mapped.
 
     """
     interface_version = '0.3'
     _ref_counts = defaultdict(int)
     _file_handles = {}
+    _chunk_caches = weakref.WeakValueDictionary()
+    _external_chunk_caches = weakref.WeakKeyDictionary()
+    # Pools may be requested by the main and the read-ahead threads
+    _thread_pools_lock = threading.Lock()
 
     def __init__(self, file_or_path, which_sets, subset=None,
                  load_in_memory=False, driver=None, sort_indices=True,
-                 **kwargs):
+                 coalesce_gap=None, cache_size=None, cache_block_size=None,
+                 memory_map=True, shared_memory=False, vlen_format=None,
+                 read_threads=None, readahead=None, **kwargs):
         if isinstance(file_or_path, h5py.File):
             self.path = file_or_path.filename
             self.external_file_handle = file_or_path
@@ -183,14 +356,42 @@ class H5PYDataset(Dataset):
             raise ValueError('`which_sets` should be an iterable of strings')
         self.which_sets = which_sets
         self.user_given_subset = subset if subset else slice(None)
+        if not isinstance(load_in_memory, (bool, numbers.Integral)):
+            if isinstance(load_in_memory, six.string_types):
+                raise ValueError('`load_in_memory` should be a bool or an '
+                                 'iterable of strings')
+            load_in_memory = frozenset(load_in_memory)
         self.load_in_memory = load_in_memory
         self.driver = driver
         self.sort_indices = sort_indices
+        self.coalesce_gap = coalesce_gap
+        self.cache_size = cache_size
+        self.cache_block_size = cache_block_size
+        self.memory_map = memory_map
+        if shared_memory and not os.path.isfile(self.path):
+            raise ValueError('shared memory requires a file on disk')
+        self.shared_memory = shared_memory
+        if vlen_format not in (None, 'padded', 'ragged'):
+            raise ValueError("`vlen_format` should be None, 'padded' or "
+                             "'ragged'")
+        self.vlen_format = vlen_format
+        if read_threads is not None and read_threads < 1:
+            raise ValueError('`read_threads` should be at least 1')
+        self.read_threads = read_threads
+        if readahead is not None and readahead < 1:
+            raise ValueError('`readahead` should be at least 1')
+        self.readahead = readahead
+        self._last_request_stop = None
 
         self._parse_dataset_info()
 
         kwargs.setdefault('axis_labels', self.default_axis_labels)
         super(H5PYDataset, self).__init__(**kwargs)
+        if isinstance(self.load_in_memory, frozenset):
+            unknown = self.load_in_memory - set(self.provides_sources)
+            if unknown:
+                raise ValueError('cannot load unknown sources in memory: '
+                                 '{}'.format(', '.join(sorted(unknown))))
 
         # It is really important to do it here, because self.num_examples
         # call will cause a crash if done before calling
@@ -208,6 +409,9 @@ class H5PYDataset(Dataset):
         * `vlen_sources`
         * `default_axis_labels`
 
+        If `vlen_format` is given, the sources derived from each
+        variable-length source are added to those.
+
         """
         self._out_of_memory_open()
         handle = self._file_handle
@@ -226,9 +430,28 @@ class H5PYDataset(Dataset):
                 provides_sources &= split_provides_sources
             else:
                 provides_sources = split_provides_sources
-        self.provides_sources = tuple(sorted(provides_sources))
         self.vlen_sources = self.get_vlen_sources(handle)
         self.default_axis_labels = self.get_axis_labels(handle)
+        # Maps derived sources to the variable-length source and the kind
+        # of information they provide
+        self._derived_sources = {}
+        if self.vlen_format:
+            kinds = ('shapes', 'offsets')[:2 if self.vlen_format == 'ragged'
+                                          else 1]
+            for source_name in provides_sources & set(self.vlen_sources):
+                # Ragged batches are flat arrays of values, into which the
+                # offsets point
+                if self.vlen_format == 'ragged':
+                    self.default_axis_labels[source_name] = ('value',)
+                for kind in kinds:
+                    derived = '{}_{}'.format(source_name, kind)
+                    if derived not in provides_sources:
+                        self._derived_sources[derived] = (source_name, kind)
+                        self.default_axis_labels[derived] = (
+                            ('batch', 'axis') if kind == 'shapes'
+                            else ('offset',))
+        self.provides_sources = tuple(sorted(
+            provides_sources | set(self._derived_sources)))
         self._out_of_memory_close()
 
     @staticmethod
@@ -462,9 +685,15 @@ class H5PYDataset(Dataset):
 
         self._out_of_memory_open()
         handle = self._file_handle
+        self.thread_pools = {}
+        self.readahead_buffers = []
+        self.chunk_cache = self._get_chunk_cache()
+        # Memory maps are kept when the file is closed between epochs
+        self.memory_maps = {}
 
         # Infer subsets based on `which_sets`
-        subsets = self.get_subsets(handle, self.which_sets, self.sources)
+        subsets = self.get_subsets(handle, self.which_sets,
+                                   self._file_sources)
         # Sanity check to make sure that all sources have equal length
         if any(subset.num_examples != subsets[0].num_examples for subset in
                 subsets):
@@ -475,17 +704,20 @@ class H5PYDataset(Dataset):
                         for subset in subsets]
 
         # Load data sources and source shapes (if requested)
+        self.shared_arrays = []
         if self.load_in_memory:
             data_sources = []
             source_shapes = []
-            for source_name, subset in zip(self.sources, self.subsets):
-                data_sources.append(
-                    subset.index_within_subset(
-                        handle[source_name], slice(None)))
+            for source_name, subset in zip(self._file_sources,
+                                           self.subsets):
+                if self._is_in_memory(source_name):
+                    data_sources.append(
+                        self._load_source(subset, handle[source_name]))
+                else:
+                    data_sources.append(None)
                 if source_name in self.vlen_sources:
-                    shapes = subset.index_within_subset(
-                        handle[source_name].dims[0]['shapes'],
-                        slice(None))
+                    shapes = self._load_source(
+                        subset, handle[source_name].dims[0]['shapes'])
                 else:
                     shapes = None
                 source_shapes.append(shapes)
@@ -493,7 +725,7 @@ class H5PYDataset(Dataset):
             self.source_shapes = tuple(source_shapes)
             # This exists only for request sanity checking purposes.
             self.in_memory_subset = Subset(
-                slice(None), len(self.data_sources[0]))
+                slice(None), self.subsets[0].num_examples)
         else:
             self.data_sources = None
             self.source_shapes = None
@@ -501,12 +733,72 @@ class H5PYDataset(Dataset):
 
         self._out_of_memory_close()
 
+    def _load_source(self, subset, source):
+        """Load a source in memory, sharing it if requested."""
+        def read():
+            return subset.index_within_subset(source, slice(None))
+        if not self.shared_memory or source.dtype.hasobject:
+            return read()
+        if subset.is_list:
+            request = numpy.asarray(subset.list_or_slice).tobytes()
+        else:
+            request = subset.list_or_slice
+        name = shared_array_name(
+            os.path.abspath(self.path), os.path.getmtime(self.path),
+            os.path.getsize(self.path), source.name, request)
+        shared_array = SharedArray(
+            name, (subset.num_examples,) + source.shape[1:], source.dtype,
+            read)
+        self.shared_arrays.append(shared_array)
+        return shared_array.array
+
     @property
     def num_examples(self):
         return self.subsets[0].num_examples
 
+    @property
+    def _file_sources(self):
+        """The sources to read from the file to provide `sources`."""
+        file_sources = []
+        for source_name in self.sources:
+            if source_name in self._derived_sources:
+                source_name, _ = self._derived_sources[source_name]
+            if source_name not in file_sources:
+                file_sources.append(source_name)
+        return tuple(file_sources)
+
+    def _is_in_memory(self, source_name):
+        if isinstance(self.load_in_memory, frozenset):
+            return source_name in self.load_in_memory
+        return bool(self.load_in_memory)
+
+    @property
+    def _all_in_memory(self):
+        return all(self._is_in_memory(source_name)
+                   for source_name in self._file_sources)
+
+    @property
+    def example_chunk_size(self):
+        """The largest chunk size of the sources along their first axis.
+
+        This is the number of consecutive examples stored together in the
+        file, e.g. to be used as the `block_size` of a
+        :class:`.BlockShuffledScheme`. It is `None` if no source is
+        chunked.
+
+        """
+        self._out_of_memory_open()
+        handle = self._file_handle
+        chunk_sizes = [handle[source_name].chunks[0]
+                       for source_name in self._file_sources
+                       if handle[source_name].chunks]
+        self._out_of_memory_close()
+        return max(chunk_sizes) if chunk_sizes else None
+
     def open(self):
-        return None if self.load_in_memory else self._out_of_memory_open()
+        if self._all_in_memory:
+            return None
+        return self._out_of_memory_open()
 
     def _out_of_memory_open(self):
         if not self.external_file_handle:
@@ -517,9 +809,37 @@ class H5PYDataset(Dataset):
             self._ref_counts[self.path] += 1
 
     def close(self, state):
-        if not self.load_in_memory:
+        if not self._all_in_memory:
+            self._clear_readahead_buffers()
+            self._close_thread_pools()
             self._out_of_memory_close()
 
+    def _thread_pool(self, name, processes):
+        """Return the thread pool `name` of the current process.
+
+        Pools are created when first needed, and again in processes
+        forked after that, in which the threads of the parent's pools
+        don't exist.
+
+        """
+        with self._thread_pools_lock:
+            if not self._owns_thread_pool(name):
+                self.thread_pools[name] = ThreadPool(processes), os.getpid()
+            return self.thread_pools[name][0]
+
+    def _owns_thread_pool(self, name):
+        pools = getattr(self, '_thread_pools', {})
+        return pools.get(name, (None, None))[1] == os.getpid()
+
+    def _close_thread_pools(self):
+        with self._thread_pools_lock:
+            pools = [pool for name, (pool, _) in self.thread_pools.items()
+                     if self._owns_thread_pool(name)]
+            self.thread_pools = {}
+        for pool in pools:
+            pool.close()
+            pool.join()
+
     def _out_of_memory_close(self):
         if not self.external_file_handle:
             self._ref_counts[self.path] -= 1
@@ -528,6 +848,27 @@ class H5PYDataset(Dataset):
                 self._file_handles[self.path].close()
                 del self._file_handles[self.path]
 
+    def _get_chunk_cache(self):
+        """Return the :class:`ChunkCache` shared by datasets of this file.
+
+        The cache is kept while a dataset refers to it, and hence across
+        epochs even though the file is closed in between.
+
+        """
+        if self.cache_size is None:
+            return None
+        # Caches of files opened by the user are dropped along with them
+        if self.external_file_handle:
+            caches, key = (self._external_chunk_caches,
+                           self.external_file_handle)
+        else:
+            caches, key = self._chunk_caches, self.path
+        cache = caches.get(key)
+        if cache is None:
+            cache = caches[key] = ChunkCache(self.cache_size)
+        cache.size = max(cache.size, self.cache_size)
+        return cache
+
     @property
     def _file_handle(self):
         if self.external_file_handle:
@@ -538,10 +879,12 @@ class H5PYDataset(Dataset):
             raise IOError('no open handle for file {}'.format(self.path))
 
     def get_data(self, state=None, request=None):
-        if self.load_in_memory:
+        if self._all_in_memory:
             data, shapes = self._in_memory_get_data(state, request)
         else:
             data, shapes = self._out_of_memory_get_data(state, request)
+        if self.vlen_format:
+            return self._format_vlen_data(data, shapes, request)
         for i in range(len(data)):
             if shapes[i] is not None:
                 if isinstance(request, numbers.Integral):
@@ -551,6 +894,33 @@ class H5PYDataset(Dataset):
                         data[i][j] = data[i][j].reshape(shapes[i][j])
         return tuple(data)
 
+    def _format_vlen_data(self, data, shapes, request):
+        """Format variable-length data according to `vlen_format`."""
+        provided = {}
+        for source_name, source_data, source_shapes in zip(
+                self._file_sources, data, shapes):
+            if source_shapes is None:
+                provided[source_name] = source_data
+                continue
+            if isinstance(request, numbers.Integral):
+                values = source_data
+                offsets = numpy.array([0, len(values)])
+            else:
+                values, offsets = ragged_arrays(source_data)
+            if self.vlen_format == 'padded':
+                if isinstance(request, numbers.Integral):
+                    values = values.reshape(source_shapes)
+                else:
+                    values = pad_ragged_arrays(values, offsets,
+                                               source_shapes)
+            provided[source_name] = values
+            for kind, value in (('shapes', source_shapes),
+                                ('offsets', offsets)):
+                derived = '{}_{}'.format(source_name, kind)
+                if derived in self._derived_sources:
+                    provided[derived] = value
+        return tuple(provided[source_name] for source_name in self.sources)
+
     def _in_memory_get_data(self, state=None, request=None):
         if state is not None or request is None:
             raise ValueError
@@ -564,6 +934,65 @@ class H5PYDataset(Dataset):
     def _out_of_memory_get_data(self, state=None, request=None):
         if not isinstance(request, (numbers.Integral, slice, list)):
             raise ValueError()
+        if self.readahead:
+            # Lists of consecutive indices (e.g. from a SequentialScheme)
+            # are read like the equivalent slice
+            if (isinstance(request, list) and request and
+                    request == list(range(request[0], request[-1] + 1))):
+                return self._read_ahead(slice(request[0], request[-1] + 1))
+            if isinstance(request, slice) and request.step in (None, 1):
+                return self._read_ahead(request)
+        return self._read_sources(request)
+
+    def _read_ahead(self, request):
+        """Serve a slice request, reading the following ones ahead.
+
+        Each buffer holds the data and shapes of a range of examples,
+        as returned by a background call to :meth:`_read_sources`.
+
+        """
+        start, stop, _ = request.indices(self.num_examples)
+        # Sequential epochs start from the first example
+        sequential = start in (0, self._last_request_stop)
+        self._last_request_stop = stop
+        # Reads started before a fork are lost in the forked process
+        if not sequential or not self._owns_thread_pool('readahead'):
+            self._clear_readahead_buffers()
+        # Buffers which were entirely served aren't needed anymore
+        buffers = [buffer_ for buffer_ in self.readahead_buffers
+                   if buffer_[1] > start]
+        covering = [buffer_ for buffer_ in buffers
+                    if buffer_[0] <= start and stop <= buffer_[1]]
+        if covering:
+            buffer_start, _, result = covering[0]
+            data, shapes = result.get()
+            rows = slice(start - buffer_start, stop - buffer_start)
+            data = [source_data[rows] for source_data in data]
+            shapes = [source_shapes[rows] if source_shapes is not None
+                      else None for source_shapes in shapes]
+        else:
+            data, shapes = self._read_sources(request)
+        # Keep the next `readahead` batches buffered
+        end = max([stop] + [buffer_[1] for buffer_ in buffers])
+        if sequential and end < min(stop + self.readahead * (stop - start),
+                                    self.num_examples):
+            next_stop = min(end + self.readahead * (stop - start),
+                            self.num_examples)
+            readahead_pool = self._thread_pool('readahead', 1)
+            buffers.append((end, next_stop, readahead_pool.apply_async(
+                self._read_sources, (slice(end, next_stop),))))
+        self.readahead_buffers = buffers
+        return data, shapes
+
+    def _clear_readahead_buffers(self):
+        # Reads in progress need the file to be open, but those started
+        # by another process never finish
+        if self._owns_thread_pool('readahead'):
+            for _, _, result in getattr(self, '_readahead_buffers', []):
+                result.wait()
+        self.readahead_buffers = []
+
+    def _read_sources(self, request):
         data = []
         shapes = []
         # TODO: This is not an ideal solution, really unpickling should be
@@ -575,19 +1004,110 @@ class H5PYDataset(Dataset):
         except IOError:
             self._out_of_memory_open()
             handle = self._file_handle
-        for source_name, subset in zip(self.sources, self.subsets):
+        # Sources (and shapes) which are loaded in memory aren't None
+        file_sources = self._file_sources
+        data_sources = self.data_sources or (None,) * len(file_sources)
+        source_shapes = self.source_shapes or (None,) * len(file_sources)
+        if self.in_memory_subset is not None:
+            index_in_memory = partial(
+                self.in_memory_subset.index_within_subset,
+                subset_request=request)
+        for source_name, subset, data_source, source_shape in zip(
+                file_sources, self.subsets, data_sources, source_shapes):
             # Process the data request within the context of the data source
             # subset
-            data.append(
-                subset.index_within_subset(
-                    handle[source_name], request,
-                    sort_indices=self.sort_indices))
+            if data_source is not None:
+                data.append(partial(index_in_memory, data_source))
+            else:
+                data.append(partial(self._index_source, subset,
+                                    handle[source_name], request))
             # If this source has variable length, get the shapes as well
-            if source_name in self.vlen_sources:
-                shapes.append(
-                    subset.index_within_subset(
-                        handle[source_name].dims[0]['shapes'], request,
-                        sort_indices=self.sort_indices))
+            if source_shape is not None:
+                shapes.append(partial(index_in_memory, source_shape))
+            elif source_name in self.vlen_sources:
+                shapes.append(partial(
+                    self._index_source, subset,
+                    handle[source_name].dims[0]['shapes'], request))
             else:
                 shapes.append(None)
-        return data, shapes
+        reads = data + [read for read in shapes if read is not None]
+        if self.read_threads:
+            read_pool = self._thread_pool('read', self.read_threads)
+            results = iter(read_pool.map(_call, reads))
+        else:
+            results = (read() for read in reads)
+        return ([next(results) for _ in data],
+                [next(results) if read is not None else None
+                 for read in shapes])
+
+    def _index_source(self, subset, source, request):
+        memory_map = self._get_memory_map(source)
+        if memory_map is not None:
+            data = subset.index_within_subset(memory_map, request)
+            # Slices of the memory map are read lazily from the file
+            if numpy.may_share_memory(data, memory_map):
+                return numpy.array(data)
+            if isinstance(data, numpy.memmap):
+                return data.view(numpy.ndarray)
+            return data
+        block_size = self.cache_block_size
+        if block_size is None and source.chunks:
+            block_size = source.chunks[0]
+        if self.cache_size is None or block_size is None:
+            return subset.index_within_subset(
+                source, request, sort_indices=self.sort_indices,
+                coalesce_gap=self.coalesce_gap)
+        if isinstance(request, numbers.Integral):
+            request, = subset[[request]]
+        else:
+            request = subset[request]
+        if isinstance(request, numbers.Integral):
+            return self._read_cached(source, block_size, [request])[0]
+        if hasattr(request, 'step'):
+            request = range(*request.indices(len(source)))
+        return self._read_cached(source, block_size, request)
+
+    def _get_memory_map(self, source):
+        """Return a memory map of a source, or `None` if it can't be mapped.
+
+        Only contiguous, uncompressed sources of fixed-size data in files
+        opened by the dataset itself with the default driver are mapped.
+
+        """
+        if (not self.memory_map or self.external_file_handle or
+                self.driver not in (None, 'sec2', 'stdio')):
+            return None
+        memory_maps = self.memory_maps
+        if source.name not in memory_maps:
+            offset = None
+            if (source.chunks is None and not source.external and
+                    source.dtype.kind != 'O' and source.size):
+                offset = source.id.get_offset()
+            memory_map = None
+            if offset is not None:
+                memory_map = numpy.memmap(
+                    self.path, dtype=source.dtype, mode='r', offset=offset,
+                    shape=source.shape)
+            # The read-ahead thread may have mapped the source meanwhile
+            return memory_maps.setdefault(source.name, memory_map)
+        return memory_maps[source.name]
+
+    def _read_cached(self, source, block_size, indices):
+        """Read examples from a source through the chunk cache."""
+        indices = numpy.asarray(indices, dtype='int64')
+        blocks, block_of_index, counts = numpy.unique(
+            indices // block_size, return_inverse=True, return_counts=True)
+        # Positions in the request of the examples of each block
+        positions = numpy.split(
+            numpy.argsort(block_of_index.ravel(), kind='mergesort'),
+            numpy.cumsum(counts)[:-1])
+        data = numpy.empty((len(indices),) + source.shape[1:],
+                           dtype=source.dtype)
+        cache = self.chunk_cache
+        for block, block_positions in zip(blocks, positions):
+            start = block * block_size
+            cached = cache.get(
+                (source.name, block_size, block),
+                lambda: source[start:start + block_size])
+            data[block_positions] = cached[indices[block_positions] - start]
+        return data
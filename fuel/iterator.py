@@ -15,12 +15,24 @@ class DataIterator(six.Iterator):
         If `True`, return dictionaries mapping source names to data
         from each source. If `False` (default), return tuples in the
         same order as `data_stream.sources`.
+    scheme_state : object, optional
+        The state of the iteration scheme before `request_iterator` was
+        requested from it (see :meth:`.IterationScheme.get_state`), which
+        is part of the position returned by :meth:`get_position`.
+
+    Attributes
+    ----------
+    num_requests : int
+        The number of times data has been returned so far.
 
     """
-    def __init__(self, data_stream, request_iterator=None, as_dict=False):
+    def __init__(self, data_stream, request_iterator=None, as_dict=False,
+                 scheme_state=None):
         self.data_stream = data_stream
         self.request_iterator = request_iterator
         self.as_dict = as_dict
+        self.scheme_state = scheme_state
+        self.num_requests = 0
 
     def __iter__(self):
         return self
@@ -30,7 +42,30 @@ class DataIterator(six.Iterator):
             data = self.data_stream.get_data(next(self.request_iterator))
         else:
             data = self.data_stream.get_data()
+        self.num_requests += 1
         if self.as_dict:
             return dict(zip(self.data_stream.sources, data))
         else:
             return data
+
+    def get_position(self):
+        """Return a snapshot of the position in this epoch.
+
+        The position can be passed to the `get_epoch_iterator` method of
+        the data stream (e.g. after unpickling the data stream in a new
+        process) to resume the epoch from this point, see
+        :meth:`.AbstractDataStream.get_epoch_iterator`.
+
+        Returns
+        -------
+        position : dict
+            A picklable dictionary with the number of requests made so
+            far (``num_requests``), the state of the iteration scheme at
+            the start of the epoch (``scheme_state``) and the state of the
+            data stream (``stream_state``, see
+            :meth:`.AbstractDataStream.get_epoch_state`).
+
+        """
+        return {'num_requests': self.num_requests,
+                'scheme_state': self.scheme_state,
+                'stream_state': self.data_stream.get_epoch_state()}
@@ -2,7 +2,7 @@ from abc import ABCMeta, abstractmethod
 from collections import Iterable
 
 import numpy
-from picklable_itertools import chain, repeat, imap, iter_
+from picklable_itertools import chain, repeat, imap, iter_, islice
 from picklable_itertools.extras import partition_all
 from six import add_metaclass
 from six.moves import xrange
@@ -42,6 +42,42 @@ class IterationScheme(object):
     def get_request_iterator(self):
         """Returns an iterator type."""
 
+    def get_state(self):
+        """Return the state on which the next request iterator depends.
+
+        Stochastic schemes return the state of their random number
+        generator, which :meth:`set_state` restores so that the same
+        requests are produced again. Deterministic schemes return `None`.
+
+        """
+        return None
+
+    def set_state(self, state):
+        """Restore a state returned by :meth:`get_state`."""
+
+    def resume_request_iterator(self, num_requests):
+        """Return a request iterator without its first requests.
+
+        Parameters
+        ----------
+        num_requests : int
+            The number of requests to skip.
+
+        Notes
+        -----
+        This default implementation requests and discards the skipped
+        requests. Schemes which can start iterating from any request
+        override it to skip them without producing them.
+
+        """
+        request_iterator = self.get_request_iterator()
+        for _ in xrange(num_requests):
+            try:
+                next(request_iterator)
+            except StopIteration:
+                break
+        return request_iterator
+
 
 @add_metaclass(ABCMeta)
 class BatchSizeScheme(IterationScheme):
@@ -119,6 +155,13 @@ class ConcatenatedScheme(IterationScheme):
     def get_request_iterator(self):
         return chain(*[sch.get_request_iterator() for sch in self.schemes])
 
+    def get_state(self):
+        return [scheme.get_state() for scheme in self.schemes]
+
+    def set_state(self, state):
+        for scheme, scheme_state in zip(self.schemes, state):
+            scheme.set_state(scheme_state)
+
     @property
     def requests_examples(self):
         return self.schemes[0].requests_examples
@@ -169,11 +212,15 @@ class ConstantScheme(BatchSizeScheme):
         self.times = times
 
     def get_request_iterator(self):
+        return self.resume_request_iterator(0)
+
+    def resume_request_iterator(self, num_requests):
         if self.times:
-            return repeat(self.batch_size, self.times)
+            return repeat(self.batch_size, max(self.times - num_requests, 0))
         if self.num_examples:
             d, r = divmod(self.num_examples, self.batch_size)
-            return chain(repeat(self.batch_size, d), [r] if r else [])
+            return chain(repeat(self.batch_size, max(d - num_requests, 0)),
+                         [r] if r and num_requests <= d else [])
         return repeat(self.batch_size)
 
 
@@ -189,7 +236,12 @@ class SequentialScheme(BatchScheme):
 
     """
     def get_request_iterator(self):
-        return imap(list, partition_all(self.batch_size, self.indices))
+        return self.resume_request_iterator(0)
+
+    def resume_request_iterator(self, num_requests):
+        return imap(list, partition_all(
+            self.batch_size,
+            _drop(self.indices, num_requests * self.batch_size)))
 
 
 class ShuffledScheme(BatchScheme):
@@ -221,13 +273,91 @@ class ShuffledScheme(BatchScheme):
         super(ShuffledScheme, self).__init__(*args, **kwargs)
 
     def get_request_iterator(self):
-        indices = list(self.indices)
-        self.rng.shuffle(indices)
+        return self.resume_request_iterator(0)
+
+    def resume_request_iterator(self, num_requests):
+        indices = self._shuffled_indices()
+        indices = indices[num_requests * self.batch_size:]
         if self.sorted_indices:
             return imap(sorted, partition_all(self.batch_size, indices))
         else:
             return imap(list, partition_all(self.batch_size, indices))
 
+    def _shuffled_indices(self):
+        indices = list(self.indices)
+        self.rng.shuffle(indices)
+        return indices
+
+    def get_state(self):
+        return self.rng.get_state()
+
+    def set_state(self, state):
+        self.rng.set_state(state)
+
+
+class BlockShuffledScheme(ShuffledScheme):
+    """Shuffled batches iterator which reads few blocks at a time.
+
+    Examples are grouped in blocks of consecutive indices (e.g. the chunks
+    of an HDF5 dataset), which are shuffled in two levels: the order of
+    the blocks is shuffled, and then the examples are shuffled within
+    windows of a few consecutive blocks of this order. Each batch hence
+    only contains examples of a few blocks, which allows reading data
+    almost sequentially from disk, while still shuffling the examples
+    well enough for stochastic gradient descent.
+
+    Parameters
+    ----------
+    examples : int or list
+        See :class:`BatchScheme`.
+    batch_size : int
+        See :class:`BatchScheme`.
+    block_size : int
+        The number of examples per block. Example index ``i`` belongs to
+        block ``i // block_size``. For an :class:`.H5PYDataset`, this
+        should be the size of its chunks along the first axis, see
+        :attr:`.H5PYDataset.example_chunk_size`.
+    window_size : int, optional
+        The number of blocks whose examples are shuffled together.
+        Larger windows give more randomness, but batches then span more
+        blocks. Defaults to 4.
+    rng : :class:`numpy.random.RandomState`, optional
+        See :class:`ShuffledScheme`.
+    sorted_indices : bool, optional
+        See :class:`ShuffledScheme`.
+
+    Notes
+    -----
+    If the batch size is larger than the number of examples in a window,
+    each batch contains examples from several windows.
+
+    """
+    def __init__(self, examples, batch_size, block_size, window_size=4,
+                 **kwargs):
+        if block_size < 1 or window_size < 1:
+            raise ValueError('block_size and window_size must be positive '
+                             'integers')
+        self.block_size = block_size
+        self.window_size = window_size
+        super(BlockShuffledScheme, self).__init__(
+            examples, batch_size, **kwargs)
+
+    def _shuffled_indices(self):
+        indices = numpy.asarray(list(self.indices), dtype='int64')
+        blocks, block_of_index = numpy.unique(indices // self.block_size,
+                                              return_inverse=True)
+        block_order = numpy.empty(len(blocks), dtype='int64')
+        block_order[self.rng.permutation(len(blocks))] = numpy.arange(
+            len(blocks))
+        window_of_index = block_order[block_of_index.ravel()] // \
+            self.window_size
+        # Shuffle all examples, then group them by window (the sort is
+        # stable, so examples stay shuffled within each window)
+        permutation = self.rng.permutation(len(indices))
+        permutation = permutation[numpy.argsort(
+            window_of_index[permutation], kind='mergesort')]
+        return indices[permutation].tolist()
+
 
 class SequentialExampleScheme(IndexScheme):
     """Sequential examples iterator.
@@ -236,7 +366,10 @@ class SequentialExampleScheme(IndexScheme):
 
     """
     def get_request_iterator(self):
-        return iter_(self.indices)
+        return self.resume_request_iterator(0)
+
+    def resume_request_iterator(self, num_requests):
+        return iter_(_drop(self.indices, num_requests))
 
 
 class ShuffledExampleScheme(IndexScheme):
@@ -252,9 +385,29 @@ class ShuffledExampleScheme(IndexScheme):
         super(ShuffledExampleScheme, self).__init__(*args, **kwargs)
 
     def get_request_iterator(self):
+        return self.resume_request_iterator(0)
+
+    def resume_request_iterator(self, num_requests):
         indices = list(self.indices)
         self.rng.shuffle(indices)
-        return iter_(indices)
+        return iter_(indices[num_requests:])
+
+    def get_state(self):
+        return self.rng.get_state()
+
+    def set_state(self, state):
+        self.rng.set_state(state)
+
+
+def _drop(indices, num_indices):
+    """Drop the first indices, without iterating over them if possible."""
+    if not num_indices:
+        return indices
+    try:
+        return indices[num_indices:]
+    except TypeError:
+        # e.g. iterators, or Python 2's xrange
+        return islice(indices, num_indices, None)
 
 
 def cross_validation(scheme_class, num_examples, num_folds, strict=True,
@@ -42,6 +42,11 @@ class AbstractDataStream(object):
         of examples).
 
     """
+    # Whether a position without a stream state is resumed by replaying
+    # the epoch even if there is an iteration scheme, i.e. whether `None`
+    # means that the state is unknown rather than that there is none
+    _replay_without_state = False
+
     def __init__(self, iteration_scheme=None, axis_labels=None):
         self.iteration_scheme = iteration_scheme
         self.axis_labels = axis_labels
@@ -93,11 +98,75 @@ class AbstractDataStream(object):
     def next_epoch(self):
         """Switch the data stream to the next epoch."""
 
+    def get_epoch_state(self):
+        """Return the state needed to resume the current epoch.
+
+        Returns
+        -------
+        state : object
+            A picklable object, which is part of the position returned by
+            :meth:`.DataIterator.get_position`. `None` (the default) means
+            that, apart from the requests of the iteration scheme, this
+            data stream holds no state, and that it can only be resumed
+            by replaying the epoch if it has no iteration scheme.
+            Transformers which return `None` are always resumed by
+            replaying the epoch, see :meth:`.Transformer.get_epoch_state`.
+
+        """
+        return None
+
+    def set_epoch_state(self, state):
+        """Restore a state returned by :meth:`get_epoch_state`.
+
+        This is called by :meth:`get_epoch_iterator` when resuming an
+        epoch, after the epoch iterator has been created.
+
+        """
+
     @abstractmethod
-    def get_epoch_iterator(self, as_dict=False):
-        return DataIterator(self, self.iteration_scheme.get_request_iterator()
-                            if self.iteration_scheme else None,
-                            as_dict=as_dict)
+    def get_epoch_iterator(self, as_dict=False, position=None):
+        """Get an epoch iterator for the data stream.
+
+        Parameters
+        ----------
+        as_dict : bool, optional
+            See :class:`.DataIterator`.
+        position : dict, optional
+            A position returned by :meth:`.DataIterator.get_position`. If
+            given, the iterator resumes the epoch from this position,
+            instead of starting a new one. The requests of the iteration
+            scheme are skipped without reading any data, and so are the
+            data of the wrapped data streams which support it (see
+            :meth:`get_epoch_state`). Data streams which don't are
+            resumed by replaying their epoch up to this position.
+
+        """
+        replay = (position is not None and
+                  position['stream_state'] is None and
+                  (not self.iteration_scheme or self._replay_without_state))
+        scheme_state = None
+        request_iterator = None
+        if self.iteration_scheme:
+            if position is not None:
+                self.iteration_scheme.set_state(position['scheme_state'])
+            scheme_state = self.iteration_scheme.get_state()
+            if position is not None and not replay:
+                request_iterator = \
+                    self.iteration_scheme.resume_request_iterator(
+                        position['num_requests'])
+            else:
+                request_iterator = \
+                    self.iteration_scheme.get_request_iterator()
+        epoch_iterator = DataIterator(self, request_iterator, as_dict=as_dict,
+                                      scheme_state=scheme_state)
+        if replay:
+            for _ in range(position['num_requests']):
+                next(epoch_iterator)
+        elif position is not None:
+            epoch_iterator.num_requests = position['num_requests']
+            if position['stream_state'] is not None:
+                self.set_epoch_state(position['stream_state'])
+        return epoch_iterator
 
     def iterate_epochs(self, as_dict=False):
         """Allow iteration through all epochs.
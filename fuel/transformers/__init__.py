@@ -1,14 +1,23 @@
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict, OrderedDict
+import json
 import logging
 from multiprocessing import Process, Queue
+from multiprocessing.pool import ThreadPool
+import os
+import sys
+import tempfile
+import threading
 
 import numpy
+from numpy.lib.format import dtype_to_descr, open_memmap
 from picklable_itertools import chain, ifilter, izip
 from picklable_itertools.extras import equizip
-from six import add_metaclass, iteritems
+from six import add_metaclass, iteritems, reraise
+from six.moves import queue
 
 from fuel import config
+from fuel.iterator import DataIterator
 from fuel.streams import AbstractDataStream
 from fuel.schemes import BatchSizeScheme
 from ..exceptions import AxisLabelsMismatchError
@@ -94,6 +103,9 @@ class Transformer(AbstractDataStream):
         of examples).
 
     """
+    # Without a state, the position of the wrapped data stream is unknown
+    _replay_without_state = True
+
     def __init__(self, data_stream, produces_examples=None, **kwargs):
         super(Transformer, self).__init__(**kwargs)
         if produces_examples is not None:
@@ -129,10 +141,34 @@ class Transformer(AbstractDataStream):
         stream. Implementations for which this is not true should request
         new epoch iterators from the child data set when necessary.
 
+        When resuming an epoch from a position, the epoch of the wrapped
+        data stream is resumed from the position it had then.
+
         """
-        self.child_epoch_iterator = self.data_stream.get_epoch_iterator()
+        position = kwargs.get('position')
+        if position is not None and position['stream_state'] is not None:
+            self.child_epoch_iterator = self.data_stream.get_epoch_iterator(
+                position=position['stream_state']['child'])
+        else:
+            self.child_epoch_iterator = self.data_stream.get_epoch_iterator()
         return super(Transformer, self).get_epoch_iterator(**kwargs)
 
+    def get_epoch_state(self):
+        """Return the position of the wrapped data stream.
+
+        Transformers which hold data between calls to :meth:`get_data`
+        must add it to this state, and restore it in
+        :meth:`set_epoch_state`, or return `None` to be resumed by
+        replaying the epoch. This is also the case if the epoch iterator
+        of the wrapped data stream isn't a :class:`.DataIterator`, e.g.
+        when it is filtered.
+
+        """
+        if not isinstance(getattr(self, 'child_epoch_iterator', None),
+                          DataIterator):
+            return None
+        return {'child': self.child_epoch_iterator.get_position()}
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
@@ -202,12 +238,46 @@ class Mapping(Transformer):
     mapping_accepts : type, optional
         Input and output type of the mapping function `list` by default,
         can be changed to `dict`.
+    cache_size : int, optional
+        When given, the mapped data of each example is memoized, keyed by
+        the example's index, in a least-recently-used cache of at most
+        `cache_size` bytes. This requires an `iteration_scheme` (see
+        below), whose requests are example indices (e.g.
+        :class:`.ShuffledExampleScheme`) or lists of example indices (e.g.
+        :class:`.ShuffledScheme`). The mapping is then only applied to the
+        examples which aren't cached, so it should be deterministic.
+        Defaults to `None`, in which case nothing is cached.
+    iteration_scheme : :class:`.IterationScheme`, optional
+        When given, its requests are passed on to the `get_data` method of
+        the wrapped data stream, e.g. a :class:`.DataStream` over an
+        :class:`.IndexableDataset` or an :class:`.H5PYDataset`, instead
+        of iterating over it. Required if `cache_size` is given.
+
+    Attributes
+    ----------
+    cache_hits : int
+        The number of examples which were read from the cache.
+    cache_misses : int
+        The number of examples to which the mapping was applied while
+        caching.
+
+    Notes
+    -----
+    The size of an example is estimated as the sum of the ``nbytes``
+    attributes of its NumPy arrays, and of the sizes reported by
+    :func:`sys.getsizeof` for other objects. Examples larger than
+    `cache_size` are never cached. Cached data is returned as is, and
+    shouldn't be modified in place.
 
     """
     def __init__(self, data_stream, mapping, add_sources=None,
-                 mapping_accepts=list, **kwargs):
-        super(Mapping, self).__init__(
-            data_stream, data_stream.produces_examples, **kwargs)
+                 mapping_accepts=list, cache_size=None, **kwargs):
+        if cache_size is not None and not kwargs.get('iteration_scheme'):
+            raise ValueError('caching requires an iteration scheme which '
+                             'requests examples by index')
+        if not kwargs.get('iteration_scheme'):
+            kwargs['produces_examples'] = data_stream.produces_examples
+        super(Mapping, self).__init__(data_stream, **kwargs)
         if mapping_accepts not in [list, dict]:
             raise ValueError('`Mapping` can accept `list` or `dict`, not `{}`'
                              .format(mapping_accepts))
@@ -215,6 +285,11 @@ class Mapping(Transformer):
         self.mapping_accepts = mapping_accepts
         self.mapping = mapping
         self.add_sources = add_sources
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
 
     @property
     def sources(self):
@@ -222,9 +297,63 @@ class Mapping(Transformer):
                                            if self.add_sources else ())
 
     def get_data(self, request=None):
-        if request is not None:
+        if self.iteration_scheme is None:
+            if request is not None:
+                raise ValueError
+            return self._map(next(self.child_epoch_iterator))
+        if request is None:
             raise ValueError
-        data = next(self.child_epoch_iterator)
+        if self.cache_size is None:
+            return self._map(self.data_stream.get_data(request))
+        if self.produces_examples:
+            if request in self._cache:
+                return self._lookup(request)
+            example = self._map(self.data_stream.get_data(request))
+            self._store(request, example)
+            return example
+        request = list(request)
+        examples = dict((index, self._lookup(index)) for index in
+                        OrderedDict.fromkeys(request) if index in self._cache)
+        misses = [index for index in OrderedDict.fromkeys(request)
+                  if index not in examples]
+        if misses:
+            data = self._map(self.data_stream.get_data(misses))
+            for i, index in enumerate(misses):
+                examples[index] = tuple(source_data[i]
+                                        for source_data in data)
+                self._store(index, examples[index])
+        return tuple(self._collate(source_data) for source_data in
+                     zip(*[examples[index] for index in request]))
+
+    def _lookup(self, index):
+        """Return a cached example, marking it as the most recently used."""
+        self.cache_hits += 1
+        self._cache[index] = entry = self._cache.pop(index)
+        return entry[0]
+
+    def _store(self, index, example):
+        """Cache a mapped example, evicting the least recently used ones."""
+        self.cache_misses += 1
+        size = sum(source_data.nbytes if hasattr(source_data, 'nbytes')
+                   else sys.getsizeof(source_data) for source_data in example)
+        if size > self.cache_size:
+            return
+        while self._cached_bytes + size > self.cache_size:
+            _, (_, evicted_size) = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted_size
+        self._cache[index] = (example, size)
+        self._cached_bytes += size
+
+    @staticmethod
+    def _collate(examples):
+        """Batch examples as an array when they allow it, else a list."""
+        if (all(isinstance(example, (numpy.ndarray, numpy.generic))
+                for example in examples) and
+                len(set(example.shape for example in examples)) == 1):
+            return numpy.array(examples)
+        return list(examples)
+
+    def _map(self, data):
         mapping_input = data
         if self.mapping_accepts == dict:
             mapping_input = OrderedDict(equizip(self.data_stream.sources,
@@ -460,19 +589,106 @@ class Filter(Transformer):
         The filtered data stream.
     predicate : callable
         Should return ``True`` for the samples to be kept.
+    mask : bool, optional
+        If `True`, the wrapped data stream must produce batches, and
+        `predicate` is called on an entire batch. It should then return a
+        boolean array with one element per example, which is `True` for
+        the examples to be kept. The examples are selected from each
+        source in one go (using fancy indexing for numpy arrays). Batches
+        in which no example is kept are skipped. Defaults to `False`, in
+        which case `predicate` decides whether to keep each item (example
+        or entire batch) of the wrapped data stream.
+    batch_size : int, optional
+        Only used if `mask` is `True`. If given, the examples that are
+        kept are re-batched so that every batch is of size `batch_size`,
+        except possibly for the last batch of each epoch. Defaults to
+        `None`, in which case the filtered batches are returned as they
+        are, and will generally be of varying size.
 
     """
-    def __init__(self, data_stream, predicate, **kwargs):
+    def __init__(self, data_stream, predicate, mask=False, batch_size=None,
+                 **kwargs):
+        if mask and data_stream.produces_examples:
+            raise ValueError('mask filtering requires the wrapped data '
+                             'stream to produce batches, not examples.')
+        if batch_size is not None and not mask:
+            raise ValueError('batch_size can only be given when filtering '
+                             'with a mask')
         if data_stream.axis_labels:
             kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
         super(Filter, self).__init__(
             data_stream, data_stream.produces_examples, **kwargs)
         self.predicate = predicate
+        self.mask = mask
+        self.batch_size = batch_size
+        self._buffer = None
 
     def get_epoch_iterator(self, **kwargs):
+        if self.mask:
+            self._buffer = [[] for _ in self.sources]
+            return super(Filter, self).get_epoch_iterator(**kwargs)
         super(Filter, self).get_epoch_iterator(**kwargs)
         return ifilter(self.predicate, self.child_epoch_iterator)
 
+    def get_epoch_state(self):
+        state = super(Filter, self).get_epoch_state()
+        if state is not None and self._buffer is not None:
+            state['buffer'] = [list(chunks) for chunks in self._buffer]
+        return state
+
+    def set_epoch_state(self, state):
+        if 'buffer' in state:
+            self._buffer = [list(chunks) for chunks in state['buffer']]
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if self.batch_size is None:
+            while True:
+                batch = self._next_filtered_batch()
+                if len(batch[0]):
+                    return batch
+        buffered = sum(len(chunk) for chunk in self._buffer[0])
+        while buffered < self.batch_size:
+            try:
+                batch = self._next_filtered_batch()
+            except StopIteration:
+                if not buffered:
+                    raise
+                break
+            if len(batch[0]):
+                for chunks, source_data in zip(self._buffer, batch):
+                    chunks.append(source_data)
+                buffered += len(batch[0])
+        data = []
+        for i, chunks in enumerate(self._buffer):
+            source_data = self._concatenate(chunks)
+            data.append(source_data[:self.batch_size])
+            remainder = source_data[self.batch_size:]
+            self._buffer[i] = [remainder] if len(remainder) else []
+        return tuple(data)
+
+    def _next_filtered_batch(self):
+        batch = next(self.child_epoch_iterator)
+        mask = numpy.asarray(self.predicate(batch), dtype=bool)
+        if mask.shape != (len(batch[0]),):
+            raise ValueError('predicate returned a mask of shape {} for a '
+                             'batch of size {}'.format(mask.shape,
+                                                       len(batch[0])))
+        return tuple(
+            source_data[mask] if isinstance(source_data, numpy.ndarray)
+            else [example for example, keep in zip(source_data, mask)
+                  if keep]
+            for source_data in batch)
+
+    @staticmethod
+    def _concatenate(chunks):
+        if len(chunks) == 1:
+            return chunks[0]
+        if all(isinstance(chunk, numpy.ndarray) for chunk in chunks):
+            return numpy.concatenate(chunks)
+        return list(chain(*chunks))
+
 
 class Cache(Transformer):
     """Cache examples when sequentially reading a dataset.
@@ -526,6 +742,15 @@ class Cache(Transformer):
         self.cache = [[] for _ in self.sources]
         return super(Cache, self).get_epoch_iterator(**kwargs)
 
+    def get_epoch_state(self):
+        state = super(Cache, self).get_epoch_state()
+        if state is not None:
+            state['cache'] = [list(cache) for cache in self.cache]
+        return state
+
+    def set_epoch_state(self, state):
+        self.cache = [list(cache) for cache in state['cache']]
+
     def _cache(self):
         try:
             for cache, data in zip(self.cache,
@@ -536,6 +761,207 @@ class Cache(Transformer):
                 raise
 
 
+class DiskCache(Transformer):
+    """Cache the examples of a data stream in memory-mapped files.
+
+    The examples produced by the wrapped data stream are written to
+    disk, in one memory-mapped ``.npy`` file per source, the first time
+    they are requested, and are read back from these files afterwards.
+    This avoids recomputing expensive but deterministic preprocessing
+    (e.g. decoding and resizing images) every epoch; random data
+    augmentation should be applied on top of this transformer.
+
+    Examples are identified by their index, i.e. their position in an
+    epoch of the wrapped data stream, and are requested by
+    `iteration_scheme`, which can e.g. shuffle them. The wrapped data
+    stream is read at most once, even across epochs: whenever an example
+    which isn't cached yet is requested, examples are read from it until
+    the requested one has been cached.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream` instance
+        The wrapped data stream, which must produce the same examples in
+        the same order every epoch. It can produce examples or batches,
+        but the examples of each source must be arrays of a fixed shape
+        and dtype.
+    iteration_scheme : :class:`.IterationScheme`
+        The iteration scheme requesting examples (integer requests) or
+        batches (lists of indices) from the cache.
+    num_examples : int
+        The number of examples in an epoch of the wrapped data stream.
+    path : str, optional
+        The directory in which the cache is stored, which is created if
+        needed. If it already holds a complete cache of `num_examples`
+        examples of the same sources, this cache is used. Only the first
+        batch of the wrapped data stream is then read, to check that its
+        dtypes, shapes and values match those of the cache, which is
+        rebuilt otherwise. Defaults to a new temporary directory, which isn't
+        removed automatically.
+
+    Notes
+    -----
+    The data returned is copied out of the memory-mapped files, so that
+    modifying it in place doesn't corrupt the cache.
+
+    """
+    def __init__(self, data_stream, iteration_scheme, num_examples,
+                 path=None, **kwargs):
+        if (data_stream.axis_labels and data_stream.produces_examples ==
+                iteration_scheme.requests_examples):
+            kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
+        super(DiskCache, self).__init__(
+            data_stream, iteration_scheme=iteration_scheme, **kwargs)
+        if path is None:
+            path = tempfile.mkdtemp(prefix='fuel_cache_')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.num_examples = num_examples
+        self.num_cached = 0
+        self.child_epoch_iterator = None
+        self._caches = None
+        # The layout of a complete cache found on disk, which is checked
+        # against the wrapped data stream before being used
+        self._unchecked_layout = None
+        if (os.path.exists(self._layout_path) and
+                all(os.path.exists(self._cache_path(source))
+                    for source in self.sources)):
+            with open(self._layout_path) as f:
+                layout = json.load(f)
+            if (layout['num_examples'] == num_examples and
+                    layout['sources'] == list(self.sources)):
+                self.num_cached = num_examples
+                self._unchecked_layout = layout
+
+    @property
+    def _layout_path(self):
+        return os.path.join(self.path, 'layout.json')
+
+    def _layout(self, data):
+        """Describe the cache of the examples in a batch of data."""
+        examples = [numpy.asarray(batch[0]) for batch in data]
+        # Tuples are turned into lists, as when reading the file back
+        return json.loads(json.dumps({
+            'num_examples': self.num_examples,
+            'sources': list(self.sources),
+            'dtypes': [dtype_to_descr(example.dtype) for example in examples],
+            'shapes': [example.shape for example in examples]}))
+
+    def _cache_path(self, source):
+        return os.path.join(self.path, '{}.npy'.format(source))
+
+    @property
+    def caches(self):
+        """The memory-mapped arrays, one per source."""
+        if self._caches is None and self.num_cached:
+            self._caches = [open_memmap(self._cache_path(source), mode='r+')
+                            for source in self.sources]
+        return self._caches
+
+    def get_epoch_iterator(self, **kwargs):
+        # The epoch iterator of the wrapped data stream is only requested
+        # when it needs to be read, and it is kept across epochs.
+        return super(Transformer, self).get_epoch_iterator(**kwargs)
+
+    # Examples are read from the cache by index, and it is filled as
+    # needed, so only the requests need to be skipped when resuming.
+    _replay_without_state = False
+
+    def get_epoch_state(self):
+        return None
+
+    def get_data(self, request=None):
+        if request is None:
+            raise ValueError
+        if self.produces_examples:
+            last = request
+        else:
+            request = list(request)
+            last = max(request) if request else -1
+        if last >= self.num_examples:
+            raise ValueError('requested example {}, but the cache holds {} '
+                             'examples'.format(last, self.num_examples))
+        if self._unchecked_layout is not None:
+            self._check_layout()
+        self._fill(last)
+        if self.produces_examples:
+            return tuple(numpy.array(cache[request]) for cache in self.caches)
+        return tuple(numpy.asarray(cache[request]) for cache in self.caches)
+
+    def _check_layout(self):
+        """Rebuild the cache found on disk if it doesn't match the stream.
+
+        The cache of a changed pipeline could otherwise hold stale data.
+        Changes which keep dtypes and shapes the same (e.g. a different
+        normalization) are detected by comparing the first batch.
+
+        """
+        layout, self._unchecked_layout = self._unchecked_layout, None
+        data = self._next_batch()
+        batch_size = len(data[0])
+        if (self._layout(data) == layout and
+                all(numpy.array_equal(cache[:batch_size], batch)
+                    for cache, batch in zip(self.caches, data))):
+            self.child_epoch_iterator = None
+            return
+        log.warning('the cache in {} doesn\'t match the data stream, '
+                    'rebuilding it'.format(self.path))
+        os.remove(self._layout_path)
+        self.num_cached = 0
+        self._caches = None
+        self._cache_batch(data)
+
+    def _fill(self, last):
+        """Cache examples until the one with index `last` is cached."""
+        while self.num_cached <= last:
+            self._cache_batch(self._next_batch())
+
+    def _next_batch(self):
+        """Read the next batch of examples from the wrapped stream."""
+        if self.child_epoch_iterator is None:
+            self.child_epoch_iterator = self.data_stream.get_epoch_iterator()
+        try:
+            data = next(self.child_epoch_iterator)
+        except StopIteration:
+            raise ValueError('the wrapped data stream produced {} '
+                             'examples, expected {}'.format(
+                                 self.num_cached, self.num_examples))
+        if self.data_stream.produces_examples:
+            data = [[example] for example in data]
+        return data
+
+    def _cache_batch(self, data):
+        """Write a batch of examples after those which are cached."""
+        batch_size = len(data[0])
+        if self.num_cached + batch_size > self.num_examples:
+            raise ValueError('the wrapped data stream produced more '
+                             'than {} examples'.format(self.num_examples))
+        if self.caches is None:
+            self._caches = [
+                open_memmap(self._cache_path(source), mode='w+',
+                            dtype=numpy.asarray(batch[0]).dtype,
+                            shape=((self.num_examples,) +
+                                   numpy.asarray(batch[0]).shape))
+                for source, batch in zip(self.sources, data)]
+        for cache, batch in zip(self.caches, data):
+            cache[self.num_cached:self.num_cached + batch_size] = batch
+        self.num_cached += batch_size
+        if self.num_cached == self.num_examples:
+            for cache in self.caches:
+                cache.flush()
+            # The layout is written last, to mark the cache as complete
+            with open(self._layout_path, 'w') as f:
+                json.dump(self._layout(data), f)
+            self.child_epoch_iterator = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The memory-mapped files are opened again when needed.
+        state['_caches'] = None
+        return state
+
+
 class SortMapping(object):
     """Callable class for creating sorting mappings.
 
@@ -549,19 +975,48 @@ class SortMapping(object):
         a tuple that contains a single data point for each source.
     reverse : boolean value that indicates whether the sort order should
         be reversed.
+    batch_key : bool, optional
+        If `True`, `key` is called once on the entire batch (a tuple with
+        the batch of each source) and should return an array containing
+        the value to sort on for each example, e.g. the sequence lengths.
+        A single permutation is then computed with :func:`numpy.argsort`
+        and applied to each source, avoiding the construction of a tuple
+        per example. Defaults to `False`.
+
+    Notes
+    -----
+    In both modes the sort is stable, i.e. examples with equal keys keep
+    their original order.
 
     """
-    def __init__(self, key, reverse=False):
+    def __init__(self, key, reverse=False, batch_key=False):
         self.key = key
         self.reverse = reverse
+        self.batch_key = batch_key
 
     def __call__(self, batch):
+        if self.batch_key:
+            return self._batch_sort(batch)
         output = sorted(zip(*batch), key=self.key, reverse=self.reverse)
         output = tuple(numpy.asarray(i) if isinstance(j, numpy.ndarray)
                        else list(i)
                        for i, j in zip(zip(*output), batch))
         return output
 
+    def _batch_sort(self, batch):
+        keys = numpy.asarray(self.key(batch))
+        if self.reverse:
+            # Sorting the reversed keys and reversing the result keeps the
+            # sort stable, like `sorted(..., reverse=True)`.
+            permutation = numpy.argsort(keys[::-1], kind='mergesort')[::-1]
+            permutation = len(keys) - 1 - permutation
+        else:
+            permutation = numpy.argsort(keys, kind='mergesort')
+        return tuple(source[permutation]
+                     if isinstance(source, numpy.ndarray)
+                     else [source[i] for i in permutation]
+                     for source in batch)
+
 
 class Batch(Transformer):
     """Creates minibatches from data streams providing single examples.
@@ -651,6 +1106,15 @@ class Unpack(Transformer):
             data_stream, produces_examples=True, **kwargs)
         self.data = None
 
+    def get_epoch_iterator(self, **kwargs):
+        self.data = None
+        return super(Unpack, self).get_epoch_iterator(**kwargs)
+
+    def get_epoch_state(self):
+        # The examples left in the current batch can't be copied without
+        # consuming them, so the epoch is replayed instead
+        return None
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
@@ -753,6 +1217,14 @@ class Merge(AbstractDataStream):
         The data streams to merge.
     sources : iterable
         A collection of strings, determining what sources should be called.
+    num_threads : int, optional
+        If given, the epoch iterators of the merged data streams are
+        advanced concurrently on a pool of this many threads, so that the
+        time taken by a single step is the maximum of the time taken by
+        the data streams rather than their sum. This is only worthwhile
+        when the data streams are independent and I/O-bound (e.g. read
+        from different HDF5 files). Defaults to `None`, in which case the
+        data streams are advanced one after the other.
 
     Examples
     --------
@@ -769,9 +1241,12 @@ class Merge(AbstractDataStream):
     ('Hello world!', 'Bonjour le monde!')
 
     """
-    def __init__(self, data_streams, sources, axis_labels=None):
+    def __init__(self, data_streams, sources, axis_labels=None,
+                 num_threads=None):
         super(Merge, self).__init__(
             iteration_scheme=None, axis_labels=axis_labels)
+        if num_threads is not None and num_threads < 1:
+            raise ValueError('num_threads must be a positive integer')
         if not all(data_stream.produces_examples ==
                    data_streams[0].produces_examples
                    for data_stream in data_streams):
@@ -784,10 +1259,16 @@ class Merge(AbstractDataStream):
                             in data_streams]))) != len(sources):
             raise ValueError("wrong number of sources given")
         self.sources = sources
+        self.num_threads = num_threads
+        self._pool = None
 
     def close(self):
         for data_stream in self.data_streams:
             data_stream.close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
 
     def reset(self):
         for data_stream in self.data_streams:
@@ -798,18 +1279,54 @@ class Merge(AbstractDataStream):
             data_stream.next_epoch()
 
     def get_epoch_iterator(self, **kwargs):
-        self.child_epoch_iterators = [data_stream.get_epoch_iterator()
-                                      for data_stream in self.data_streams]
+        position = kwargs.get('position')
+        if position is not None and position['stream_state'] is not None:
+            self.child_epoch_iterators = [
+                data_stream.get_epoch_iterator(position=child_position)
+                for data_stream, child_position in
+                zip(self.data_streams, position['stream_state']['children'])]
+        else:
+            self.child_epoch_iterators = [
+                data_stream.get_epoch_iterator()
+                for data_stream in self.data_streams]
+        if self.num_threads and self._pool is None:
+            self._pool = ThreadPool(self.num_threads)
         return super(Merge, self).get_epoch_iterator(**kwargs)
 
+    def get_epoch_state(self):
+        iterators = getattr(self, 'child_epoch_iterators', [None])
+        if not all(isinstance(iterator, DataIterator)
+                   for iterator in iterators):
+            return None
+        return {'children': [iterator.get_position()
+                             for iterator in iterators]}
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
+        if self._pool is not None:
+            # Exceptions raised in the worker threads (including the
+            # StopIteration signalling the end of the epoch) are re-raised
+            # by `get`. Note that `ThreadPool.map` can't be used, because it
+            # would silently swallow the StopIteration.
+            child_data = [result.get() for result in
+                          [self._pool.apply_async(next, (iterator,))
+                           for iterator in self.child_epoch_iterators]]
+        else:
+            child_data = [next(child_epoch_iterator) for child_epoch_iterator
+                          in self.child_epoch_iterators]
         result = []
-        for child_epoch_iterator in self.child_epoch_iterators:
-            result.extend(next(child_epoch_iterator))
+        for data in child_data:
+            result.extend(data)
         return tuple(result)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Thread pools can't be pickled; a new one is created when the
+        # next epoch iterator is requested.
+        state['_pool'] = None
+        return state
+
 
 class BackgroundProcess(object):
     """A background process that reads batches and stores them in a queue.
@@ -878,6 +1395,10 @@ class MultiProcessing(Transformer):
         self.proc.daemon = True
         self.proc.start()
 
+    def get_epoch_state(self):
+        # The wrapped data stream is read ahead in another process
+        return None
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
@@ -887,6 +1408,165 @@ class MultiProcessing(Transformer):
         return data
 
 
+class ThreadedPrefetch(Transformer):
+    """Prefetch data from the stream in a background thread.
+
+    A lightweight alternative to :class:`MultiProcessing` for pipelines
+    that are dominated by I/O (e.g. reading from HDF5 files) or by numpy
+    operations that release the GIL. Data is read from the wrapped data
+    stream in a separate thread and stored in a bounded queue, so reading
+    the next batch overlaps with whatever the main thread is doing.
+    Unlike :class:`MultiProcessing`, no data needs to be serialized.
+
+    Parameters
+    ----------
+    data_stream : :class:`DataStream` or :class:`Transformer`
+        The data stream to read data from in the background thread.
+    max_store : int, optional
+        The maximum number of batches (or examples) to keep in the queue.
+        If reached, the background thread blocks until data is consumed.
+        Defaults to 10.
+
+    Notes
+    -----
+    Each epoch iterator is served by its own background thread, which is
+    stopped when a new epoch iterator is requested or when :meth:`close`
+    is called. Exceptions raised by the wrapped data stream are re-raised
+    in the main thread.
+
+    The wrapped data stream is only ever accessed by one thread at a
+    time, but it is accessed from a thread other than the main one, so it
+    shouldn't rely on thread-local state.
+
+    Pickling stops the background thread. Data that has been prefetched
+    but not consumed yet is pickled along with the wrapped data stream,
+    so an unpickled epoch iterator resumes where the original one was.
+
+    """
+    def __init__(self, data_stream, max_store=10, **kwargs):
+        if max_store < 1:
+            raise ValueError('max_store must be a positive integer')
+        if data_stream.axis_labels:
+            kwargs.setdefault('axis_labels', data_stream.axis_labels.copy())
+        super(ThreadedPrefetch, self).__init__(
+            data_stream, data_stream.produces_examples, **kwargs)
+        self.max_store = max_store
+        self._thread = None
+        self._queue = None
+        self._stop = None
+        self._unsent = None
+        self._prefetched = []
+        self._exhausted = False
+
+    def get_epoch_iterator(self, **kwargs):
+        # The wrapped data stream must not be touched while the thread
+        # serving the previous epoch is still reading from it.
+        self._stop_prefetching()
+        epoch_iterator = super(ThreadedPrefetch, self).get_epoch_iterator(
+            **kwargs)
+        self._prefetched = []
+        self._exhausted = False
+        self._start_prefetching()
+        return epoch_iterator
+
+    def get_data(self, request=None):
+        if request is not None:
+            raise ValueError
+        if self._exhausted:
+            raise StopIteration
+        if self._prefetched:
+            data, exc_info = self._prefetched.pop(0)
+        else:
+            if self._thread is None:
+                self._start_prefetching()
+            data, exc_info = self._queue.get()
+        if exc_info is not None:
+            self._exhausted = True
+            self._stop_prefetching()
+            reraise(*exc_info)
+        return data
+
+    def get_epoch_state(self):
+        # The wrapped data stream is read ahead by the background thread
+        return None
+
+    def close(self):
+        self._stop_prefetching()
+        self._prefetched = []
+        super(ThreadedPrefetch, self).close()
+
+    def _start_prefetching(self):
+        self._queue = queue.Queue(self.max_store)
+        self._stop = threading.Event()
+        self._unsent = []
+        self._thread = threading.Thread(
+            target=self._prefetch,
+            args=(self.child_epoch_iterator, self._queue, self._stop,
+                  self._unsent))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stop_prefetching(self):
+        """Stop the background thread.
+
+        Returns
+        -------
+        list
+            The ``(data, exc_info)`` pairs which the thread read from
+            the wrapped data stream but which weren't consumed, in order.
+
+        """
+        fetched = []
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            while not self._queue.empty():
+                fetched.append(self._queue.get())
+            fetched.extend(self._unsent)
+        self._thread = None
+        self._queue = None
+        self._stop = None
+        self._unsent = None
+        return fetched
+
+    @classmethod
+    def _prefetch(cls, iterator, queue_, stop, unsent):
+        try:
+            for data in iterator:
+                if not cls._put(queue_, stop, (data, None), unsent):
+                    return
+                if stop.is_set():
+                    return
+            raise StopIteration
+        except Exception:
+            cls._put(queue_, stop, (None, sys.exc_info()), unsent)
+
+    @staticmethod
+    def _put(queue_, stop, item, unsent):
+        # Time out regularly so that a full queue doesn't prevent the
+        # thread from noticing that it should stop.
+        while not stop.is_set():
+            try:
+                queue_.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        unsent.append(item)
+        return False
+
+    def __getstate__(self):
+        # The wrapped data stream can't be pickled while the thread reads
+        # from it. The thread is restarted once the data it read has been
+        # consumed.
+        self._prefetched.extend(self._stop_prefetching())
+        state = self.__dict__.copy()
+        # Tracebacks can't be pickled
+        state['_prefetched'] = [
+            (data, exc_info[:2] + (None,) if exc_info is not None else None)
+            for data, exc_info in self._prefetched]
+        return state
+
+
 class Rename(AgnosticTransformer):
     """Renames the sources of the stream.
 
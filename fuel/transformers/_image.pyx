@@ -1,5 +1,9 @@
 cimport cython
 from cython.parallel cimport prange
+from libc.math cimport cos, floor, sin
+from libc.string cimport memcpy
+
+import numpy
 
 
 ctypedef long Py_intptr_t
@@ -9,6 +13,10 @@ ctypedef fused image_dtype:
     double
     unsigned char
 
+ctypedef fused normalized_dtype:
+    float
+    double
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -58,3 +66,289 @@ cpdef window_batch_bchw(image_dtype[:, :, :, :] batch,
             h_extent = h_off + window_height
             w_extent = w_off + window_width
             out[index] = batch[index, :, h_off:h_extent, w_off:w_extent]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef window_list_bchw(list batch, const long[:] height_offsets,
+                       const long[:] width_offsets,
+                       image_dtype[:, :, :, ::1] out):
+    """window_list_bchw(batch, height_offsets, width_offsets, out)
+
+    Perform windowing on a list of (channels, height, width) images.
+
+    Parameters
+    ----------
+    batch : list of memoryviews, 3-dimensional
+        A list of images in the expected format above, possibly of
+        different heights and widths, but all with `out.shape[1]`
+        channels and the same dtype as `out`.
+    height_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the height dimension of each image.
+        Assumed that len(batch) <= height_offsets.shape[0].
+    width_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the width dimension of each image.
+        Assumed that len(batch) <= width_offsets.shape[0].
+    out : memoryview, C-contiguous
+        The array to which to write output. It is assumed that
+        `out.shape[2] + height_offsets[i] <= batch[i].shape[1]` and
+        `out.shape[3] + width_offsets[i] <= batch[i].shape[2]`, for
+        all values of `i`.
+
+    Notes
+    -----
+    The buffers of the images are gathered while holding the GIL, after
+    which the windows are copied in parallel via OpenMP. Set
+    `OMP_NUM_THREADS` to benefit from this parallelism.
+
+    This is a low-level utility that, for the sake of speed, does
+    not check that the windows fit within the images. Some amount of
+    protection is provided by Cython memoryview objects.
+
+    """
+    cdef Py_intptr_t index, channel, row, column
+    cdef Py_intptr_t num_images = len(batch)
+    cdef Py_intptr_t num_channels = out.shape[1]
+    cdef Py_intptr_t window_height = out.shape[2]
+    cdef Py_intptr_t window_width = out.shape[3]
+    # Images may be read-only, e.g. memory-mapped files
+    cdef const image_dtype[:, :, :] image
+    cdef char *source
+    # The address of each window followed by the strides of its image
+    cdef Py_intptr_t[:, :] layout = numpy.empty((num_images, 4), dtype='l')
+    for index in range(num_images):
+        image = batch[index]
+        if image.shape[0] != num_channels:
+            raise ValueError('expected {} channels, got {}'.format(
+                num_channels, image.shape[0]))
+        layout[index, 0] = <Py_intptr_t> &image[0, height_offsets[index],
+                                                width_offsets[index]]
+        layout[index, 1] = image.strides[0]
+        layout[index, 2] = image.strides[1]
+        layout[index, 3] = image.strides[2]
+    with nogil:
+        for index in prange(num_images):
+            for channel in range(num_channels):
+                for row in range(window_height):
+                    source = (<char *> layout[index, 0] +
+                              channel * layout[index, 1] +
+                              row * layout[index, 2])
+                    if layout[index, 3] == sizeof(image_dtype):
+                        memcpy(&out[index, channel, row, 0], source,
+                               window_width * sizeof(image_dtype))
+                    else:
+                        for column in range(window_width):
+                            out[index, channel, row, column] = (
+                                <image_dtype *> source)[0]
+                            source = source + layout[index, 3]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef window_flip_normalize_bchw(const image_dtype[:, :, :, :] batch,
+                                 const long[:] height_offsets,
+                                 const long[:] width_offsets,
+                                 const unsigned char[:] flips,
+                                 const normalized_dtype[:] scale,
+                                 const normalized_dtype[:] shift,
+                                 normalized_dtype[:, :, :, :] out):
+    """window_flip_normalize_bchw(batch, height_offsets, width_offsets,
+                                  flips, scale, shift, out)
+
+    Crop, flip and normalize a (batch, channels, height, width) tensor.
+
+    Each window is optionally flipped horizontally, and each of its
+    channels is scaled and shifted, i.e. `out[i, c] = scale[c] *
+    window[c] + shift[c]`, in a single pass.
+
+    Parameters
+    ----------
+    batch : memoryview, 4-dimensional
+        A 4-d tensor containing a batch of images in the expected
+        format above.
+    height_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the height dimension of each image.
+        Assumed that batch.shape[0] <= height_offsets.shape[0].
+    width_offsets : memoryview, integer, 1-dimensional
+        An array of offsets for the width dimension of each image.
+        Assumed that batch.shape[0] <= width_offsets.shape[0].
+    flips : memoryview, unsigned char, 1-dimensional
+        Whether to flip each window horizontally (non-zero) or not.
+        Assumed that batch.shape[0] <= flips.shape[0].
+    scale : memoryview, floating point, 1-dimensional
+        The factor by which each channel is multiplied. Assumed that
+        batch.shape[1] <= scale.shape[0].
+    shift : memoryview, floating point, 1-dimensional
+        The value added to each channel after scaling. Assumed that
+        batch.shape[1] <= shift.shape[0].
+    out : memoryview
+        The array to which to write output. It is assumed that
+        `out.shape[2] + height_offsets[i] <= batch.shape[2]` and
+        `out.shape[3] + width_offsets[i] <= batch.shape[3]`, for
+        all values of `i`.
+
+    Notes
+    -----
+    Operates on a batch in parallel via OpenMP. Set `OMP_NUM_THREADS`
+    to benefit from this parallelism.
+
+    This is a low-level utility that, for the sake of speed, does
+    not check its input for validity. Some amount of protection is
+    provided by Cython memoryview objects.
+
+    """
+    cdef Py_intptr_t index, channel, row, column, h_off, w_off
+    cdef Py_intptr_t num_channels = out.shape[1]
+    cdef Py_intptr_t window_height = out.shape[2]
+    cdef Py_intptr_t window_width = out.shape[3]
+    with nogil:
+        for index in prange(batch.shape[0]):
+            h_off = height_offsets[index]
+            w_off = width_offsets[index]
+            for channel in range(num_channels):
+                for row in range(window_height):
+                    if flips[index]:
+                        for column in range(window_width):
+                            out[index, channel, row, column] = (
+                                scale[channel] *
+                                batch[index, channel, h_off + row,
+                                      w_off + window_width - 1 - column] +
+                                shift[channel])
+                    else:
+                        for column in range(window_width):
+                            out[index, channel, row, column] = (
+                                scale[channel] *
+                                batch[index, channel, h_off + row,
+                                      w_off + column] +
+                                shift[channel])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef rotate_batch_bchw(const image_dtype[:, :, :, :] batch,
+                        const double[:] angles, bint bilinear,
+                        image_dtype[:, :, :, :] out):
+    """rotate_batch_bchw(batch, angles, bilinear, out)
+
+    Rotate a (batch, channels, height, width) image tensor.
+
+    Each image is rotated counter-clockwise around its center, in the
+    same way as :meth:`PIL.Image.Image.rotate`. Pixels which fall
+    outside of the original image are set to zero.
+
+    Parameters
+    ----------
+    batch : memoryview, 4-dimensional
+        A 4-d tensor containing a batch of images in the expected
+        format above.
+    angles : memoryview, double, 1-dimensional
+        The rotation angle of each image, in radians. Assumed that
+        batch.shape[0] <= angles.shape[0].
+    bilinear : bool
+        If `True`, use bilinear interpolation, otherwise use the nearest
+        pixel.
+    out : memoryview
+        The array to which to write output, of the same shape as
+        `batch`.
+
+    Notes
+    -----
+    Operates on a batch in parallel via OpenMP. Set `OMP_NUM_THREADS`
+    to benefit from this parallelism.
+
+    Like PIL, nearest pixels are looked up using 16.16 fixed point
+    arithmetic, so that both give identical results. Interpolated
+    values of integer images are rounded, whereas PIL truncates them.
+
+    This is a low-level utility that, for the sake of speed, does
+    not check its input for validity. Some amount of protection is
+    provided by Cython memoryview objects.
+
+    """
+    cdef Py_intptr_t index, channel, row, column, x0, x1, y0, y1
+    cdef Py_intptr_t num_channels = batch.shape[1]
+    cdef Py_intptr_t height = batch.shape[2]
+    cdef Py_intptr_t width = batch.shape[3]
+    cdef long long fixed_x, fixed_y
+    cdef double x, y, dx, dy, value, top, bottom
+    cdef double center_x = width / 2.0
+    cdef double center_y = height / 2.0
+    # The affine transformations mapping output pixels to input pixels,
+    # computed as PIL does
+    cdef double[:, :] matrices = numpy.empty((batch.shape[0], 6))
+    cdef long long[:, :] fixed_matrices = numpy.empty((batch.shape[0], 6),
+                                                      dtype='int64')
+    for index in range(batch.shape[0]):
+        matrices[index, 0] = round(cos(-angles[index]), 15)
+        matrices[index, 1] = round(sin(-angles[index]), 15)
+        matrices[index, 2] = (matrices[index, 0] * -center_x +
+                              matrices[index, 1] * -center_y + center_x)
+        matrices[index, 3] = round(-sin(-angles[index]), 15)
+        matrices[index, 4] = round(cos(-angles[index]), 15)
+        matrices[index, 5] = (matrices[index, 3] * -center_x +
+                              matrices[index, 4] * -center_y + center_y)
+        for channel in range(6):
+            fixed_matrices[index, channel] = <long long> floor(
+                matrices[index, channel] * 65536.0 + 0.5)
+        # Offsets of the center of the first pixel
+        fixed_matrices[index, 2] = <long long> floor(
+            (matrices[index, 2] + matrices[index, 0] * 0.5 +
+             matrices[index, 1] * 0.5) * 65536.0 + 0.5)
+        fixed_matrices[index, 5] = <long long> floor(
+            (matrices[index, 5] + matrices[index, 3] * 0.5 +
+             matrices[index, 4] * 0.5) * 65536.0 + 0.5)
+    with nogil:
+        for index in prange(batch.shape[0]):
+            for row in range(height):
+                for column in range(width):
+                    if not bilinear:
+                        fixed_x = (fixed_matrices[index, 2] +
+                                   row * fixed_matrices[index, 1] +
+                                   column * fixed_matrices[index, 0])
+                        fixed_y = (fixed_matrices[index, 5] +
+                                   row * fixed_matrices[index, 4] +
+                                   column * fixed_matrices[index, 3])
+                        x0 = fixed_x >> 16
+                        y0 = fixed_y >> 16
+                        if x0 < 0 or x0 >= width or y0 < 0 or y0 >= height:
+                            for channel in range(num_channels):
+                                out[index, channel, row, column] = 0
+                        else:
+                            for channel in range(num_channels):
+                                out[index, channel, row, column] = \
+                                    batch[index, channel, y0, x0]
+                        continue
+                    x = (matrices[index, 0] * (column + 0.5) +
+                         matrices[index, 1] * (row + 0.5) + matrices[index, 2])
+                    y = (matrices[index, 3] * (column + 0.5) +
+                         matrices[index, 4] * (row + 0.5) + matrices[index, 5])
+                    if x < 0 or x >= width or y < 0 or y >= height:
+                        for channel in range(num_channels):
+                            out[index, channel, row, column] = 0
+                        continue
+                    # Neighbours beyond the edges are clamped to them
+                    x = x - 0.5
+                    y = y - 0.5
+                    x0 = <Py_intptr_t> floor(x)
+                    y0 = <Py_intptr_t> floor(y)
+                    dx = x - x0
+                    dy = y - y0
+                    x1 = min(x0 + 1, width - 1)
+                    y1 = min(y0 + 1, height - 1)
+                    x0 = max(x0, 0)
+                    y0 = max(y0, 0)
+                    for channel in range(num_channels):
+                        top = (batch[index, channel, y0, x0] +
+                               dx * (batch[index, channel, y0, x1] -
+                                     batch[index, channel, y0, x0]))
+                        bottom = (batch[index, channel, y1, x0] +
+                                  dx * (batch[index, channel, y1, x1] -
+                                        batch[index, channel, y1, x0]))
+                        value = top + dy * (bottom - top)
+                        # Integers are rounded rather than truncated, so
+                        # that they aren't biased downwards (the values
+                        # are non-negative)
+                        if image_dtype is not float and \
+                                image_dtype is not double:
+                            value = value + 0.5
+                        out[index, channel, row, column] = <image_dtype> value
@@ -1,13 +1,15 @@
 from __future__ import division
 from io import BytesIO
 import math
+from multiprocessing.pool import ThreadPool
 
 import numpy
 from PIL import Image
 from six import PY3
 
 try:
-    from ._image import window_batch_bchw
+    from ._image import (rotate_batch_bchw, window_batch_bchw,
+                         window_flip_normalize_bchw, window_list_bchw)
     window_batch_bchw_available = True
 except ImportError:
     window_batch_bchw_available = False
@@ -102,7 +104,159 @@ class ImagesFromBytes(SourcewiseTransformer):
         return labels
 
 
-class MinimumImageDimensions(SourcewiseTransformer, ExpectsAxisLabels):
+def resize_image(image, shape, resample=Image.NEAREST):
+    """Resize an image using PIL.
+
+    Parameters
+    ----------
+    image : :class:`~numpy.ndarray`
+        An image with layout `(height, width)` or `(channel, height,
+        width)`.
+    shape : 2-tuple
+        The `(height, width)` of the resized image.
+    resample : int, optional
+        The PIL resampling filter to use, e.g. ``PIL.Image.BILINEAR``.
+        Defaults to ``PIL.Image.NEAREST``.
+
+    Returns
+    -------
+    :class:`~numpy.ndarray`
+        The resized image, with the same layout and dtype as `image`.
+
+    """
+    dt = image.dtype
+    # If we're dealing with a colour image, swap around the axes
+    # to be in the format that PIL needs.
+    if image.ndim == 3:
+        im = image.transpose(1, 2, 0)
+    else:
+        im = image
+    height, width = shape
+    im = numpy.array(Image.fromarray(im).resize((width, height),
+                                                resample=resample)).astype(dt)
+    # If necessary, undo the axis swap from earlier.
+    if im.ndim == 3:
+        return im.transpose(2, 0, 1)
+    return im
+
+
+class ResizingTransformer(SourcewiseTransformer, ExpectsAxisLabels):
+    """Base class for transformers resizing images.
+
+    Subclasses decide which size each image should have by implementing
+    :meth:`target_shape`. Only the images which need it are resized, and
+    a batch of images can be resized on a pool of threads; PIL releases
+    the GIL while resizing, so that the threads run concurrently.
+
+    Parameters
+    ----------
+    data_stream : instance of :class:`AbstractDataStream`
+        The data stream to wrap.
+    resample : str, optional
+        Resampling filter for PIL to use to resize any images requiring
+        it. Options include 'nearest' (default), 'bilinear', and 'bicubic'.
+        See the PIL documentation for more detailed information.
+    num_threads : int, optional
+        If given, the images of a batch are resized on a pool of this many
+        threads. Defaults to `None`, in which case they are resized one
+        after the other.
+
+    """
+    def __init__(self, data_stream, resample='nearest', num_threads=None,
+                 **kwargs):
+        try:
+            self.resample = getattr(Image, resample.upper())
+        except AttributeError:
+            raise ValueError("unknown resampling filter '{}'".format(resample))
+        if num_threads is not None and num_threads < 1:
+            raise ValueError('num_threads must be a positive integer')
+        self.num_threads = num_threads
+        self._pool = None
+        kwargs.setdefault('produces_examples', data_stream.produces_examples)
+        kwargs.setdefault('axis_labels', data_stream.axis_labels)
+        super(ResizingTransformer, self).__init__(data_stream, **kwargs)
+
+    def target_shape(self, image_shape):
+        """The `(height, width)` an image of a given shape is resized to.
+
+        Parameters
+        ----------
+        image_shape : 2-tuple
+            The `(height, width)` of the image.
+
+        Returns
+        -------
+        tuple or None
+            The `(height, width)` to resize the image to, or `None` if
+            the image should be left as-is.
+
+        """
+        raise NotImplementedError
+
+    def transform_source_example(self, example, source_name):
+        self.verify_axis_labels(('channel', 'height', 'width'),
+                                self.data_stream.axis_labels[source_name],
+                                source_name)
+        return self._resize_images([example])[0]
+
+    def _resize_images(self, images, out=None):
+        """Resize the images which need it, leaving the others as-is.
+
+        If `out` is given, every image is written to it instead, the
+        copies being made in the worker threads as well.
+
+        """
+        images = list(images)
+        shapes = []
+        for image in images:
+            if image.ndim > 3 or image.ndim < 2:
+                raise NotImplementedError
+            # Only the shape is looked at, the image is not converted.
+            shape = self.target_shape(image.shape[-2:])
+            if shape is not None and tuple(shape) == image.shape[-2:]:
+                shape = None
+            shapes.append(shape)
+
+        def resize(i):
+            image = images[i]
+            if shapes[i] is not None:
+                image = resize_image(image, shapes[i], self.resample)
+            if out is not None:
+                out[i] = image
+            return image
+        if out is None:
+            indices = [i for i, shape in enumerate(shapes)
+                       if shape is not None]
+        else:
+            indices = range(len(images))
+        if self.num_threads and len(indices) > 1:
+            if self._pool is None:
+                self._pool = ThreadPool(self.num_threads)
+            resized = self._pool.map(resize, indices)
+        else:
+            resized = [resize(i) for i in indices]
+        if out is not None:
+            return out
+        for i, image in zip(indices, resized):
+            images[i] = image
+        return images
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        super(ResizingTransformer, self).close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Thread pools can't be pickled; a new one is created when the
+        # next batch is resized.
+        state['_pool'] = None
+        return state
+
+
+class MinimumImageDimensions(ResizingTransformer):
     """Resize (lists of) images to minimum dimensions.
 
     Parameters
@@ -117,6 +271,9 @@ class MinimumImageDimensions(SourcewiseTransformer, ExpectsAxisLabels):
         Resampling filter for PIL to use to upsample any images requiring
         it. Options include 'nearest' (default), 'bilinear', and 'bicubic'.
         See the PIL documentation for more detailed information.
+    num_threads : int, optional
+        If given, the images of a batch which need to be upsampled are
+        resized on a pool of this many threads. Defaults to `None`.
 
     Notes
     -----
@@ -126,53 +283,77 @@ class MinimumImageDimensions(SourcewiseTransformer, ExpectsAxisLabels):
 
     """
     def __init__(self, data_stream, minimum_shape, resample='nearest',
-                 **kwargs):
+                 num_threads=None, **kwargs):
         self.minimum_shape = minimum_shape
-        try:
-            self.resample = getattr(Image, resample.upper())
-        except AttributeError:
-            raise ValueError("unknown resampling filter '{}'".format(resample))
-        kwargs.setdefault('produces_examples', data_stream.produces_examples)
-        kwargs.setdefault('axis_labels', data_stream.axis_labels)
-        super(MinimumImageDimensions, self).__init__(data_stream, **kwargs)
+        super(MinimumImageDimensions, self).__init__(
+            data_stream, resample=resample, num_threads=num_threads,
+            **kwargs)
+
+    def target_shape(self, image_shape):
+        min_height, min_width = self.minimum_shape
+        original_height, original_width = image_shape
+        if original_height < min_height or original_width < min_width:
+            multiplier = max(1, min_width / original_width,
+                             min_height / original_height)
+            return (int(math.ceil(original_height * multiplier)),
+                    int(math.ceil(original_width * multiplier)))
 
     def transform_source_batch(self, batch, source_name):
         self.verify_axis_labels(('batch', 'channel', 'height', 'width'),
                                 self.data_stream.axis_labels[source_name],
                                 source_name)
-        return [self._example_transform(im, source_name) for im in batch]
+        return self._resize_images(batch)
 
-    def transform_source_example(self, example, source_name):
-        self.verify_axis_labels(('channel', 'height', 'width'),
+
+class Resize(ResizingTransformer):
+    """Resize images to a fixed size.
+
+    Parameters
+    ----------
+    data_stream : instance of :class:`AbstractDataStream`
+        The data stream to wrap.
+    shape : 2-tuple
+        The `(height, width)` every image is resized to, regardless of its
+        aspect ratio.
+    resample : str, optional
+        Resampling filter for PIL to use to resize the images. Options
+        include 'nearest' (default), 'bilinear', and 'bicubic'. See the
+        PIL documentation for more detailed information.
+    num_threads : int, optional
+        If given, the images of a batch are resized on a pool of this many
+        threads. Defaults to `None`.
+
+    Notes
+    -----
+    This transformer expects stream sources returning individual images,
+    represented as 2- or 3-dimensional arrays, or batches of them as lists
+    or 3- or 4-dimensional arrays. Since all images end up with the same
+    shape, batches are returned as a single array of layout `(batch,
+    height, width)` or `(batch, channel, height, width)`. Images which
+    already have the requested size are copied as-is.
+
+    """
+    def __init__(self, data_stream, shape, resample='nearest',
+                 num_threads=None, **kwargs):
+        self.shape = tuple(shape)
+        super(Resize, self).__init__(
+            data_stream, resample=resample, num_threads=num_threads,
+            **kwargs)
+
+    def target_shape(self, image_shape):
+        return self.shape
+
+    def transform_source_batch(self, batch, source_name):
+        self.verify_axis_labels(('batch', 'channel', 'height', 'width'),
                                 self.data_stream.axis_labels[source_name],
                                 source_name)
-        return self._example_transform(example, source_name)
-
-    def _example_transform(self, example, _):
-        if example.ndim > 3 or example.ndim < 2:
-            raise NotImplementedError
-        min_height, min_width = self.minimum_shape
-        original_height, original_width = example.shape[-2:]
-        if original_height < min_height or original_width < min_width:
-            dt = example.dtype
-            # If we're dealing with a colour image, swap around the axes
-            # to be in the format that PIL needs.
-            if example.ndim == 3:
-                im = example.transpose(1, 2, 0)
-            else:
-                im = example
-            im = Image.fromarray(im)
-            width, height = im.size
-            multiplier = max(1, min_width / width, min_height / height)
-            width = int(math.ceil(width * multiplier))
-            height = int(math.ceil(height * multiplier))
-            im = numpy.array(im.resize((width, height))).astype(dt)
-            # If necessary, undo the axis swap from earlier.
-            if im.ndim == 3:
-                example = im.transpose(2, 0, 1)
-            else:
-                example = im
-        return example
+        images = list(batch)
+        if len(set((image.shape[:-2], image.dtype) for image in images)) > 1:
+            raise ValueError('images in a batch must have the same number '
+                             'of channels and dtype')
+        out = numpy.empty((len(images),) + images[0].shape[:-2] + self.shape,
+                          dtype=images[0].dtype)
+        return self._resize_images(images, out)
 
 
 class RandomFixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
@@ -202,6 +383,12 @@ class RandomFixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
     yielded by `data_stream` then lists will be yielded by this
     transformer.
 
+    Batches are cropped in parallel by compiled code, including lists of
+    images of different shapes as long as they share the same number of
+    channels and the same dtype (one of `float32`, `float64` or
+    `uint8`). The images of such a list are then views of a single
+    4-dimensional array.
+
     """
     def __init__(self, data_stream, window_shape, **kwargs):
         if not window_batch_bchw_available:
@@ -238,6 +425,12 @@ class RandomFixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
             window_batch_bchw(source, offsets_h, offsets_w, out)
             return out
         elif all(isinstance(b, numpy.ndarray) and b.ndim == 3 for b in source):
+            if (len(source) and
+                    len(set(im.shape[0] for im in source)) == 1 and
+                    len(set(im.dtype for im in source)) == 1 and
+                    source[0].dtype in (numpy.float32, numpy.float64,
+                                        numpy.uint8)):
+                return list(self._window_list(list(source)))
             return [self.transform_source_example(im, source_name)
                     for im in source]
         else:
@@ -245,6 +438,32 @@ class RandomFixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
                              "of arrays with ndim = 3, or an array with "
                              "ndim = 4")
 
+    def _window_list(self, source):
+        # Images of different sizes, but with the same number of channels
+        # and dtype, are all cropped at once by the Cython code.
+        offsets_h, offsets_w = self._window_offsets(
+            [im.shape[1:] for im in source])
+        out = numpy.empty((len(source), source[0].shape[0]) +
+                          tuple(self.window_shape), dtype=source[0].dtype)
+        window_list_bchw(source, offsets_h, offsets_w, out)
+        return out
+
+    def _window_offsets(self, shapes):
+        """Draw the height and width offsets of windows in images."""
+        windowed_height, windowed_width = self.window_shape
+        shapes = numpy.array(shapes).reshape((-1, 2))
+        max_offsets = shapes - self.window_shape
+        if (max_offsets < 0).any():
+            index = numpy.nonzero((max_offsets < 0).any(axis=1))[0][0]
+            raise ValueError("can't obtain ({}, {}) window from image "
+                             "dimensions ({}, {})".format(
+                                 windowed_height, windowed_width,
+                                 *shapes[index]))
+        offsets = (self.rng.uniform(size=max_offsets.shape) *
+                   (max_offsets + 1)).astype('l')
+        return (numpy.ascontiguousarray(offsets[:, 0]),
+                numpy.ascontiguousarray(offsets[:, 1]))
+
     def transform_source_example(self, example, source_name):
         self.verify_axis_labels(('channel', 'height', 'width'),
                                 self.data_stream.axis_labels[source_name],
@@ -271,6 +490,116 @@ class RandomFixedSizeCrop(SourcewiseTransformer, ExpectsAxisLabels):
                        off_w:off_w + windowed_width]
 
 
+class RandomCropFlipNormalize(RandomFixedSizeCrop):
+    """Randomly crop and flip images, and normalize them.
+
+    Images are cropped to a fixed window size at a random position,
+    flipped horizontally at random, cast to a floating point dtype and
+    normalized per channel, i.e. ``(image - mean) / std``. A batch of
+    images is processed in a single parallel pass by compiled code,
+    instead of one pass (and one temporary array) per operation.
+
+    Parameters
+    ----------
+    data_stream : :class:`AbstractDataStream`
+        The data stream to wrap.
+    window_shape : tuple
+        The `(height, width)` tuple representing the size of the output
+        window.
+    flip_probability : float, optional
+        The probability with which each image is flipped horizontally.
+        Defaults to 0.5, use 0 to disable flipping.
+    mean : float or sequence of floats, optional
+        The value subtracted from each channel, either a single value
+        for all channels or one per channel. Defaults to 0.
+    std : float or sequence of floats, optional
+        The value by which each channel is divided, either a single
+        value for all channels or one per channel. Defaults to 1.
+    dtype : str, optional
+        The dtype of the output, either `float32` or `float64`. Defaults
+        to ``config.floatX``.
+
+    Notes
+    -----
+    This transformer accepts the same formats as
+    :class:`RandomFixedSizeCrop`, and leaves them un-altered. Batches
+    given as lists of images of different shapes are cropped first, and
+    then flipped and normalized in a second pass.
+
+    """
+    def __init__(self, data_stream, window_shape, flip_probability=0.5,
+                 mean=0., std=1., dtype=None, **kwargs):
+        if not 0 <= flip_probability <= 1:
+            raise ValueError('flip_probability ({}) must be in the range '
+                             '[0, 1]'.format(flip_probability))
+        if dtype is None:
+            dtype = config.floatX
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype not in (numpy.float32, numpy.float64):
+            raise ValueError("dtype must be 'float32' or 'float64', got "
+                             "'{}'".format(dtype))
+        self.flip_probability = flip_probability
+        self.mean = numpy.asarray(mean, dtype=self.dtype).ravel()
+        self.std = numpy.asarray(std, dtype=self.dtype).ravel()
+        super(RandomCropFlipNormalize, self).__init__(
+            data_stream, window_shape, **kwargs)
+
+    def transform_source_batch(self, source, source_name):
+        self.verify_axis_labels(('batch', 'channel', 'height', 'width'),
+                                self.data_stream.axis_labels[source_name],
+                                source_name)
+        if isinstance(source, numpy.ndarray) and source.ndim == 4:
+            return self._window_flip_normalize(
+                source, *self._window_offsets([source.shape[2:]] *
+                                              len(source)))
+        elif all(isinstance(b, numpy.ndarray) and b.ndim == 3 for b in source):
+            if (len(source) and
+                    len(set(im.shape[0] for im in source)) == 1 and
+                    len(set(im.dtype for im in source)) == 1 and
+                    source[0].dtype in (numpy.float32, numpy.float64,
+                                        numpy.uint8)):
+                windows = self._window_list(list(source))
+                offsets = numpy.zeros(len(windows), dtype='l')
+                return list(self._window_flip_normalize(windows, offsets,
+                                                        offsets))
+            return [self.transform_source_example(im, source_name)
+                    for im in source]
+        else:
+            raise ValueError("uninterpretable batch format; expected a list "
+                             "of arrays with ndim = 3, or an array with "
+                             "ndim = 4")
+
+    def transform_source_example(self, example, source_name):
+        self.verify_axis_labels(('channel', 'height', 'width'),
+                                self.data_stream.axis_labels[source_name],
+                                source_name)
+        if not isinstance(example, numpy.ndarray) or example.ndim != 3:
+            raise ValueError("uninterpretable example format; expected "
+                             "ndarray with ndim = 3")
+        return self._window_flip_normalize(
+            example[numpy.newaxis],
+            *self._window_offsets(example.shape[1:]))[0]
+
+    def _window_flip_normalize(self, batch, offsets_h, offsets_w):
+        if batch.dtype not in (numpy.float32, numpy.float64, numpy.uint8):
+            batch = batch.astype(self.dtype)
+        num_channels = batch.shape[1]
+        for name, value in (('mean', self.mean), ('std', self.std)):
+            if len(value) not in (1, num_channels):
+                raise ValueError('got {} values for {}, but images have {} '
+                                 'channels'.format(len(value), name,
+                                                   num_channels))
+        scale = numpy.ones(num_channels, dtype=self.dtype) / self.std
+        shift = -self.mean * scale
+        flips = (self.rng.uniform(size=len(batch)) <
+                 self.flip_probability).astype('uint8')
+        out = numpy.empty(batch.shape[:2] + tuple(self.window_shape),
+                          dtype=self.dtype)
+        window_flip_normalize_bchw(batch, offsets_h, offsets_w, flips,
+                                   scale, shift, out)
+        return out
+
+
 class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
     """Randomly rotate 2D images in the spatial plane.
 
@@ -288,6 +617,13 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
 
     Notes
     -----
+    With the 'nearest' and 'bilinear' filters, images of dtype `uint8`,
+    `float32` or `float64` are rotated by compiled code instead of PIL,
+    in parallel for 4-dimensional batches. This gives the same results
+    as PIL for `uint8` images, except that bilinear interpolation rounds
+    pixel values where PIL truncates them (i.e. they can differ by one),
+    and doesn't lose the precision of floating point images.
+
     This transformer expects to act on stream sources which provide one of
 
      * Single images represented as 3-dimensional ndarrays, with layout
@@ -341,6 +677,8 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
                 out[im_idx] = self._example_transform(im, angle)
             return out
         elif isinstance(source, numpy.ndarray) and source.ndim == 4:
+            if self._rotate_natively(source):
+                return self._rotate_batch(source, rotation_angles)
             return numpy.array([self._example_transform(im, angle)
                                 for im, angle in zip(source, rotation_angles)],
                                dtype=source.dtype)
@@ -360,7 +698,21 @@ class Random2DRotation(SourcewiseTransformer, ExpectsAxisLabels):
                                           self.maximum_rotation)
         return self._example_transform(example, rotation_angle)
 
+    def _rotate_natively(self, images):
+        return (window_batch_bchw_available and
+                self.resample in (Image.NEAREST, Image.BILINEAR) and
+                images.dtype in (numpy.float32, numpy.float64, numpy.uint8))
+
+    def _rotate_batch(self, batch, rotation_angles):
+        out = numpy.empty_like(batch)
+        rotate_batch_bchw(batch, numpy.deg2rad(rotation_angles),
+                          self.resample == Image.BILINEAR, out)
+        return out
+
     def _example_transform(self, example, rotation_angle):
+        if self._rotate_natively(example):
+            return self._rotate_batch(example[numpy.newaxis],
+                                      [rotation_angle])[0]
         dt = example.dtype
         im = Image.fromarray(example.transpose(1, 2, 0))
         example = numpy.array(im.rotate(rotation_angle,
@@ -1,3 +1,6 @@
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
 from fuel.transformers import Transformer
 
 
@@ -34,19 +37,34 @@ class Window(Transformer):
     target_source : str, optional
         This data stream adds a new source for the target words. By default
         this source is 'targets'.
+    produces_examples : bool, optional
+        If `True` (default), a single pair of windows is returned at a
+        time. If `False`, every pair of windows of a sequence (or, if the
+        wrapped data stream produces batches, of a batch of sequences) is
+        returned at once as two arrays with one window per row, which
+        avoids a Python-level call per window. Sequences too short to
+        contain a single pair of windows are skipped.
+
+    Notes
+    -----
+    When producing batches, sequences are converted to numpy arrays and
+    their windows are extracted as strided views (see
+    :func:`numpy.lib.stride_tricks.as_strided`), which are then copied
+    into the returned arrays.
 
     """
     def __init__(self, offset, source_window, target_window,
-                 overlapping, data_stream, target_source='targets', **kwargs):
-        if not data_stream.produces_examples:
+                 overlapping, data_stream, target_source='targets',
+                 produces_examples=True, **kwargs):
+        if produces_examples and not data_stream.produces_examples:
             raise ValueError('the wrapped data stream must produce examples, '
                              'not batches of examples.')
         if len(data_stream.sources) > 1:
             raise ValueError('{} expects only one source'
                              .format(self.__class__.__name__))
 
-        super(Window, self).__init__(data_stream, produces_examples=True,
-                                     **kwargs)
+        super(Window, self).__init__(
+            data_stream, produces_examples=produces_examples, **kwargs)
         self.sources = self.sources + (target_source,)
 
         self.offset = offset
@@ -73,9 +91,47 @@ class Window(Transformer):
         return max(self.index + self.source_window,
                    self._get_target_index() + self.target_window)
 
+    def _get_windows(self, sequence):
+        """Return all the source and target windows of a sequence."""
+        sequence = numpy.asarray(sequence)
+        # Mirrors _set_index, _get_target_index and _get_end_index
+        target_offset = self.source_window * (not self.overlapping) + \
+            self.offset
+        start = -min(0, target_offset)
+        span = max(self.source_window, target_offset + self.target_window)
+        num_windows = max(0, len(sequence) - start - span + 1)
+        return tuple(self._strided_windows(sequence, index, size,
+                                           num_windows)
+                     for index, size in
+                     [(start, self.source_window),
+                      (start + target_offset, self.target_window)])
+
+    @staticmethod
+    def _strided_windows(sequence, start, size, num_windows):
+        if not num_windows:
+            return numpy.empty((0, size) + sequence.shape[1:],
+                               dtype=sequence.dtype)
+        return as_strided(sequence[start:],
+                          shape=(num_windows, size) + sequence.shape[1:],
+                          strides=sequence.strides[:1] + sequence.strides)
+
+    def get_epoch_state(self):
+        state = super(Window, self).get_epoch_state()
+        if state is not None and self.produces_examples:
+            state['sentence'] = self.sentence
+            state['index'] = self.index
+        return state
+
+    def set_epoch_state(self, state):
+        if 'sentence' in state:
+            self.sentence = state['sentence']
+            self.index = state['index']
+
     def get_data(self, request=None):
         if request is not None:
             raise ValueError
+        if not self.produces_examples:
+            return self._get_batch()
         while not self._get_end_index() <= len(self.sentence):
             self.sentence, = next(self.child_epoch_iterator)
             self._set_index()
@@ -85,6 +141,17 @@ class Window(Transformer):
         self.index += 1
         return (source, target)
 
+    def _get_batch(self):
+        while True:
+            data, = next(self.child_epoch_iterator)
+            if self.data_stream.produces_examples:
+                data = [data]
+            windows = [pair for pair in map(self._get_windows, data)
+                       if len(pair[0])]
+            if windows:
+                return tuple(numpy.concatenate(source_data)
+                             for source_data in zip(*windows))
+
 
 class NGrams(Window):
     """Return n-grams from a stream.
@@ -112,6 +179,10 @@ class NGrams(Window):
     target_source : str, optional
         This data stream adds a new source for the target words. By default
         this source is 'targets'.
+    produces_examples : bool, optional
+        If `False`, every n-gram of a sentence (or of a batch of sentences)
+        is returned at once, see :class:`Window`. The targets are then a
+        1-D array. Defaults to `True`.
 
     """
     def __init__(self, ngram_order, *args, **kwargs):
@@ -120,4 +191,6 @@ class NGrams(Window):
 
     def get_data(self, *args, **kwargs):
         source, target = super(NGrams, self).get_data(*args, **kwargs)
+        if not self.produces_examples:
+            return (source, target[:, 0])
         return (source, target[0])
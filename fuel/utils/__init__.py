@@ -32,7 +32,7 @@ class Subset(object):
 
     Parameters
     ----------
-    list_or_slice : :class:`list` or :class:`slice`
+    list_or_slice : :class:`list`, :class:`numpy.ndarray` or :class:`slice`
         List of positive integer indices or slice that describes which
         examples are part of the subset.
     original_num_examples: int
@@ -40,6 +40,9 @@ class Subset(object):
 
     Attributes
     ----------
+    list_or_slice : :class:`numpy.ndarray` or :class:`slice`
+        The sorted and unique indices of the examples in this subset as
+        an int64 array, or a slice if they are contiguous.
     is_list : bool
         Whether the Subset is a list-based subset (as opposed to a
         slice-based subset).
@@ -79,13 +82,14 @@ class Subset(object):
         # conversion
         if self.is_list != other.is_list:
             return self.__class__(
-                self.get_list_representation() +
-                other.get_list_representation(),
+                numpy.concatenate([self.get_list_representation(),
+                                   other.get_list_representation()]),
                 self.original_num_examples)
         # List-based subsets are merged by concatenating their indices.
         if self.is_list:
-            return self.__class__(self.list_or_slice + other.list_or_slice,
-                                  self.original_num_examples)
+            return self.__class__(
+                numpy.concatenate([self.list_or_slice, other.list_or_slice]),
+                self.original_num_examples)
         # Slice-based subsets are merged into a slice-based subset if they
         # overlap, otherwise they're converted to a list-based subset.
         self_sss = self.slice_to_numerical_args(
@@ -103,7 +107,8 @@ class Subset(object):
                                   self.original_num_examples)
         # Everything else is transformed into lists before merging.
         return self.__class__(
-            self.get_list_representation() + other.get_list_representation(),
+            numpy.concatenate([self.get_list_representation(),
+                               other.get_list_representation()]),
             self.original_num_examples)
 
     def __getitem__(self, key):
@@ -114,26 +119,29 @@ class Subset(object):
 
         Parameters
         ----------
-        key : :class:`list` or :class:`slice`
+        key : :class:`list`, :class:`numpy.ndarray` or :class:`slice`
             A request made *within the context of this subset*.
 
         Returns
         -------
-        :class:`list` or :class:`slice`
-            The translated request to be used on the dataset.
+        :class:`numpy.ndarray` or :class:`slice`
+            The translated request to be used on the dataset. List-based
+            requests are translated to int64 arrays.
 
         """
+        if self._is_list(key):
+            key = numpy.asarray(key, dtype=numpy.int64)
         self._request_sanity_check(key, self.num_examples)
         # slice(None, None, None) selects the whole subset, no need to index
         # anything
-        if key == slice(None, None, None):
+        if not self._is_list(key) and key == slice(None, None, None):
             return self.list_or_slice
         if self._is_list(key):
             if self.is_list:
-                return [self.list_or_slice[index] for index in key]
+                return self.list_or_slice[key]
             start, stop, step = self.slice_to_numerical_args(
                 self.list_or_slice, self.original_num_examples)
-            return [start + (index * step) for index in key]
+            return start + key * step
         if self.is_list:
             return self.list_or_slice[key]
         start, stop, step = self.slice_to_numerical_args(
@@ -199,6 +207,62 @@ class Subset(object):
             data = indexable[request]
         return data
 
+    @staticmethod
+    def coalesced_fancy_indexing(indexable, request, coalesce_gap=0):
+        """Fancy indexing with as few contiguous reads as possible.
+
+        Fancy indexing of h5py datasets selects the requested examples
+        one by one, which is slow. Instead, the requested indices are
+        sorted and split into runs of indices which are at most
+        `coalesce_gap` examples apart. Each run is read as a single slice
+        (discarding the examples in the gaps), and the indices which
+        don't belong to any run are read with a single fancy indexing
+        call. The result is then put back in the requested order, so
+        unsorted requests and repeated indices are supported.
+
+        Parameters
+        ----------
+        indexable : :class:`h5py.Dataset` or :class:`numpy.ndarray`
+            Indexable we'd like to do fancy indexing on.
+        request : list of int
+            List of example indices.
+        coalesce_gap : int, optional
+            The maximum number of unrequested examples between two
+            requested ones for them to be read together. Defaults to 0,
+            in which case only contiguous indices are read together, and
+            no unrequested data is read.
+
+        """
+        indices, inverse = numpy.unique(request, return_inverse=True)
+        inverse = inverse.ravel()
+        # Boundaries of the runs, as positions in `indices`
+        breaks = numpy.flatnonzero(
+            numpy.diff(indices) > coalesce_gap + 1) + 1
+        starts = numpy.concatenate([[0], breaks])
+        stops = numpy.concatenate([breaks, [len(indices)]])
+        if len(starts) == 1:
+            data = indexable[indices[0]:indices[-1] + 1]
+            if len(data) != len(indices):
+                data = data[indices - indices[0]]
+        elif len(starts) == len(indices):
+            data = indexable[indices, ...]
+        else:
+            data = numpy.empty(shape=(len(indices),) + indexable.shape[1:],
+                               dtype=indexable.dtype)
+            isolated = stops - starts == 1
+            if isolated.any():
+                positions = starts[isolated]
+                data[positions] = indexable[indices[positions], ...]
+            for start, stop in zip(starts[~isolated], stops[~isolated]):
+                first = indices[start]
+                run = indexable[first:indices[stop - 1] + 1]
+                if len(run) != stop - start:
+                    run = run[indices[start:stop] - first]
+                data[start:stop] = run
+        if len(indices) == len(inverse) and (inverse[:-1] < inverse[1:]).all():
+            return data
+        return data[inverse]
+
     @staticmethod
     def slice_to_numerical_args(slice_, num_examples):
         """Translate a slice's attributes into numerical attributes.
@@ -219,14 +283,15 @@ class Subset(object):
         return start, stop, step
 
     def get_list_representation(self):
-        """Returns this subset's representation as a list of indices."""
+        """Returns this subset's indices as an int64 array."""
         if self.is_list:
             return self.list_or_slice
-        else:
-            return self[list(range(self.num_examples))]
+        start, stop, _ = self.slice_to_numerical_args(
+            self.list_or_slice, self.original_num_examples)
+        return numpy.arange(start, stop, dtype=numpy.int64)
 
     def index_within_subset(self, indexable, subset_request,
-                            sort_indices=False):
+                            sort_indices=False, coalesce_gap=None):
         """Index an indexable object within the context of this subset.
 
         Parameters
@@ -242,6 +307,10 @@ class Subset(object):
             If the request is a list of indices, indexes in sorted order
             and reshuffles the result in the original order. Defaults to
             `False`.
+        coalesce_gap : int, optional
+            If given, `sort_indices` is `True` and `indexable` is an HDF5
+            dataset, the indices are read in contiguous runs, see
+            :meth:`coalesced_fancy_indexing`. Defaults to `None`.
 
         """
         # Translate the request within the context of this subset to a
@@ -254,7 +323,12 @@ class Subset(object):
         if isinstance(request, numbers.Integral) or hasattr(request, 'step'):
             return indexable[request]
         # If requested, we do fancy indexing in sorted order and reshuffle the
-        # result back in the original order.
+        # result back in the original order. HDF5 datasets are then read in
+        # as few contiguous runs as possible.
+        if (sort_indices and coalesce_gap is not None and
+                isinstance(indexable, h5py.Dataset)):
+            return self.coalesced_fancy_indexing(indexable, request,
+                                                 coalesce_gap)
         if sort_indices:
             return self.sorted_fancy_indexing(indexable, request)
         # If the indexable supports fancy indexing (numpy array, HDF5 dataset),
@@ -313,10 +387,11 @@ class Subset(object):
             self._slice_subset_sanity_check(list_or_slice, num_examples)
 
     def _list_subset_sanity_check(self, indices, num_examples):
-        if indices and min(indices) < 0:
+        indices = numpy.asarray(indices)
+        if len(indices) and indices.min() < 0:
             raise ValueError('Subset instances cannot be defined by a list '
                              'containing negative indices')
-        if indices and max(indices) >= num_examples:
+        if len(indices) and indices.max() >= num_examples:
             raise ValueError('Subset instances cannot be defined by a list '
                              'containing indices greater than or equal to the '
                              'original number of examples')
@@ -354,10 +429,11 @@ class Subset(object):
         if len(indices) == 0:
             raise ValueError('list-based requests cannot be empty (this would '
                              'produce an empty return value)')
-        if any(index < 0 for index in indices):
+        indices = numpy.asarray(indices)
+        if indices.min() < 0:
             raise ValueError('Subset does not support list-based requests '
                              'with negative indices')
-        if max(indices) >= num_examples:
+        if indices.max() >= num_examples:
             raise ValueError('list-based requests cannot contain indices '
                              'greater than or equal to the number of examples '
                              'the subset spans')
@@ -386,12 +462,12 @@ class Subset(object):
 
     def _beautify_list(self, indices):
         # List elements should be unique and sorted
-        indices = list(sorted(set(indices)))
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        if not (indices[1:] > indices[:-1]).all():
+            indices = numpy.unique(indices)
         # If indices are contiguous, convert them into a slice
-        contiguous_indices = all(
-            indices[i] + 1 == indices[i + 1] for i in range(len(indices) - 1))
-        if indices and contiguous_indices:
-            return slice(indices[0], indices[-1] + 1, None)
+        if len(indices) and indices[-1] - indices[0] + 1 == len(indices):
+            return slice(int(indices[0]), int(indices[-1]) + 1, None)
         else:
             return indices
 
@@ -403,6 +479,88 @@ def iterable_fancy_indexing(iterable, request):
         return [iterable[r] for r in request]
 
 
+def ragged_arrays(arrays):
+    """Concatenate arrays into flat values and offsets.
+
+    Parameters
+    ----------
+    arrays : sequence of :class:`numpy.ndarray`
+        The arrays, e.g. a batch of variable-length examples.
+
+    Returns
+    -------
+    values : :class:`numpy.ndarray`
+        The concatenation of the flattened arrays.
+    offsets : :class:`numpy.ndarray`
+        The position in `values` at which each array starts, followed by
+        the length of `values`.
+
+    """
+    arrays = [numpy.ravel(array) for array in arrays]
+    offsets = numpy.zeros(len(arrays) + 1, dtype='int64')
+    numpy.cumsum([len(array) for array in arrays], out=offsets[1:])
+    return numpy.concatenate(arrays), offsets
+
+
+def pad_ragged_arrays(values, offsets, shapes):
+    """Reshape flat arrays into a single array padded with zeros.
+
+    Parameters
+    ----------
+    values : :class:`numpy.ndarray`
+        The concatenation of the flattened arrays, see
+        :func:`ragged_arrays`.
+    offsets : :class:`numpy.ndarray`
+        The position in `values` at which each array starts, followed by
+        the length of `values`.
+    shapes : :class:`numpy.ndarray`
+        The shape of each array.
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        An array of shape ``(len(shapes),) + max_shape``, where
+        `max_shape` is the largest shape along each axis. Each array is
+        stored at the beginning of each axis, followed by zeros.
+
+    """
+    shapes = numpy.asarray(shapes, dtype='int64')
+    max_shape = tuple(shapes.max(axis=0))
+    if (shapes == max_shape).all():
+        return values.reshape((len(shapes),) + max_shape)
+    padded = numpy.zeros((len(shapes),) + max_shape, dtype=values.dtype)
+    # Large arrays are cheaper to copy one by one than to compute the
+    # position of each of their values
+    if len(values) > 256 * len(shapes):
+        for array, start, stop, shape in zip(padded, offsets[:-1],
+                                             offsets[1:], shapes):
+            array[tuple(slice(0, length) for length in shape)] = (
+                values[start:stop].reshape(shape))
+        return padded
+    # Values are copied row by row (along the last axis). The position of
+    # each row in the padded array is found by unravelling its position
+    # within its array, and ravelling it in the padded one.
+    num_rows = numpy.prod(shapes[:, :-1], axis=1)
+    rows = numpy.repeat(numpy.arange(len(shapes)), num_rows)
+    position = numpy.arange(len(rows)) - numpy.repeat(
+        numpy.cumsum(num_rows) - num_rows, num_rows)
+    row_shapes = shapes[rows]
+    destination = numpy.zeros(len(rows), dtype='int64')
+    stride = 1
+    for axis in reversed(range(shapes.shape[1] - 1)):
+        position, coordinate = divmod(position, row_shapes[:, axis])
+        destination += coordinate * stride
+        stride *= max_shape[axis]
+    destination += rows * stride
+    # Each value is then offset by the start of its row in both arrays
+    row_lengths = row_shapes[:, -1]
+    starts = numpy.cumsum(row_lengths) - row_lengths
+    index = numpy.repeat(destination * max_shape[-1] - starts, row_lengths)
+    index += numpy.arange(len(index))
+    padded.reshape(-1)[index] = values
+    return padded
+
+
 def find_in_data_path(filename):
     """Searches for a file within Fuel's data path.
 
@@ -0,0 +1,373 @@
+"""Profiling and benchmarking of data pipelines.
+
+Currently including:
+
+* Per-stage profiling of a pipeline, see :class:`PipelineProfiler`.
+* Throughput and latency measurements of a data stream, see
+  :func:`benchmark_stream`.
+
+"""
+from __future__ import print_function
+import sys
+import threading
+from timeit import default_timer
+
+import numpy
+import six
+
+try:
+    import tracemalloc
+    tracemalloc_available = True
+except ImportError:
+    tracemalloc_available = False
+
+
+def child_streams(data_stream):
+    """Returns the data streams directly wrapped by a data stream.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The data stream whose children are requested.
+
+    Returns
+    -------
+    list
+        The data streams wrapped by `data_stream` (one for a
+        :class:`.Transformer`, several for a :class:`.Merge`, none for a
+        :class:`.DataStream`).
+
+    """
+    if hasattr(data_stream, 'data_streams'):
+        return list(data_stream.data_streams)
+    if hasattr(data_stream, 'data_stream'):
+        return [data_stream.data_stream]
+    return []
+
+
+def data_nbytes(data):
+    """Returns the number of bytes in (nested sequences of) arrays.
+
+    Parameters
+    ----------
+    data : object
+        A numpy array, a bytes object, or a (nested) list or tuple of
+        these. Anything else is counted as zero bytes.
+
+    """
+    if isinstance(data, numpy.ndarray):
+        if data.dtype == object:
+            return sum(data_nbytes(element) for element in data.flat)
+        return data.nbytes
+    if isinstance(data, six.binary_type):
+        return len(data)
+    if isinstance(data, (list, tuple)):
+        return sum(data_nbytes(element) for element in data)
+    return 0
+
+
+def benchmark_stream(data_stream, num_epochs=1, num_batches=None):
+    """Measures the throughput and latency of a data stream.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The data stream to read from.
+    num_epochs : int, optional
+        The number of epochs to read. Defaults to 1.
+    num_batches : int, optional
+        If given, stop after reading this many batches (or examples, for
+        data streams producing examples), starting new epochs as needed.
+        Overrides `num_epochs`.
+
+    Returns
+    -------
+    dict
+        With the following keys:
+
+        * ``batches`` : the number of batches read
+        * ``examples`` : the number of examples read
+        * ``nbytes`` : the number of bytes read, see :func:`data_nbytes`
+        * ``time`` : the total time spent reading, in seconds
+        * ``time_to_first_batch`` : the time between the request of the
+          first epoch iterator and the reception of the first batch, in
+          seconds
+        * ``latencies`` : an array with the time spent waiting for each
+          batch, in seconds
+
+    """
+    latencies = []
+    examples = 0
+    nbytes = 0
+    time_to_first_batch = None
+    epoch = 0
+    start = default_timer()
+    while num_batches is not None or epoch < num_epochs:
+        epoch_start = default_timer()
+        iterator = data_stream.get_epoch_iterator()
+        epoch_start_latency = default_timer() - epoch_start
+        read_any = False
+        while num_batches is None or len(latencies) < num_batches:
+            batch_start = default_timer()
+            try:
+                data = next(iterator)
+            except StopIteration:
+                break
+            latency = default_timer() - batch_start
+            if not read_any:
+                latency += epoch_start_latency
+                read_any = True
+            if time_to_first_batch is None:
+                time_to_first_batch = latency
+            latencies.append(latency)
+            if data_stream.produces_examples:
+                examples += 1
+            else:
+                examples += len(data[0])
+            nbytes += data_nbytes(data)
+        epoch += 1
+        if not read_any or (num_batches is not None and
+                            len(latencies) >= num_batches):
+            break
+    return {'batches': len(latencies),
+            'examples': examples,
+            'nbytes': nbytes,
+            'time': default_timer() - start,
+            'time_to_first_batch': time_to_first_batch,
+            'latencies': numpy.array(latencies)}
+
+
+class StageStatistics(object):
+    """Statistics gathered for a single stage of a pipeline.
+
+    Attributes
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The profiled data stream.
+    depth : int
+        Depth of the data stream in the pipeline, 0 being the outermost
+        data stream.
+    calls : int
+        The number of calls to `get_data`.
+    total_time : float
+        The wall time spent in `get_data`, in seconds.
+    self_time : float
+        The wall time spent in `get_data`, excluding the time spent in
+        `get_data` of the wrapped data streams, in seconds.
+    nbytes : int
+        The number of bytes produced, see :func:`data_nbytes`.
+    allocated : int
+        The net number of bytes allocated by `get_data`, excluding the
+        allocations of the wrapped data streams. Only recorded if
+        allocations are traced.
+
+    """
+    def __init__(self, data_stream, depth):
+        self.data_stream = data_stream
+        self.depth = depth
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.total_time = 0.
+        self.self_time = 0.
+        self.nbytes = 0
+        self.allocated = 0
+
+    @property
+    def name(self):
+        return '  ' * self.depth + self.data_stream.__class__.__name__
+
+
+class PipelineProfiler(object):
+    """Profiles every stage of a pipeline of data streams.
+
+    Every data stream in the pipeline (the given data stream, the data
+    streams it wraps, and so on) is instrumented so that the wall time
+    spent in each call to its `get_data` method, the number of bytes it
+    produces and, optionally, the memory it allocates are recorded. Time
+    and allocations are attributed exclusively, i.e. the time a
+    transformer spends waiting for the data streams it wraps is not
+    counted towards the transformer itself.
+
+    Parameters
+    ----------
+    data_stream : :class:`.AbstractDataStream`
+        The outermost data stream of the pipeline.
+    trace_allocations : bool, optional
+        Whether to record memory allocations using :mod:`tracemalloc`,
+        which slows down the pipeline considerably. Defaults to `False`.
+    report_on_epoch_end : bool, optional
+        If `True` (default), a report is printed and the statistics are
+        reset each time the outermost data stream reaches the end of an
+        epoch.
+    file : file-like object, optional
+        Where to print the reports. Defaults to ``sys.stdout``.
+
+    Notes
+    -----
+    The profiler instruments the data streams in place; call
+    :meth:`disable` (or use the profiler as a context manager) to restore
+    them, e.g. before pickling the pipeline.
+
+    Only data produced through `get_data` is accounted for; a transformer
+    which bypasses it in its epoch iterator (e.g. :class:`.Filter` with a
+    per-item predicate) has its cost attributed to the data stream that
+    wraps it. Time spent in background threads is accounted for in those
+    threads, so a stage such as :class:`.ThreadedPrefetch` only reports
+    the time the main thread spends waiting for it.
+
+    Examples
+    --------
+    >>> from fuel.datasets import IterableDataset
+    >>> from fuel.streams import DataStream
+    >>> from fuel.transformers import Mapping
+    >>> stream = Mapping(DataStream(IterableDataset([1, 2, 3])),
+    ...                  lambda data: (data[0] * 2,))
+    >>> with PipelineProfiler(stream, report_on_epoch_end=False) as profiler:
+    ...     epoch = list(stream.get_epoch_iterator())
+    >>> [(stage.name, stage.calls) for stage in profiler.stages]
+    [('Mapping', 4), ('  DataStream', 4)]
+
+    """
+    def __init__(self, data_stream, trace_allocations=False,
+                 report_on_epoch_end=True, file=None):
+        if trace_allocations and not tracemalloc_available:
+            raise ValueError('tracing allocations requires tracemalloc')
+        self.data_stream = data_stream
+        self.trace_allocations = trace_allocations
+        self.report_on_epoch_end = report_on_epoch_end
+        self.file = file
+        self.stages = []
+        self._local = threading.local()
+        self._started_tracemalloc = False
+        self.enabled = False
+
+    def enable(self):
+        """Instrument the data streams of the pipeline."""
+        if self.enabled:
+            return
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.stages = []
+        seen = set()
+        to_visit = [(self.data_stream, 0)]
+        while to_visit:
+            data_stream, depth = to_visit.pop()
+            if id(data_stream) in seen:
+                continue
+            seen.add(id(data_stream))
+            stage = StageStatistics(data_stream, depth)
+            self.stages.append(stage)
+            data_stream.get_data = self._instrument(
+                stage, data_stream.get_data, data_stream is self.data_stream)
+            to_visit.extend((child, depth + 1) for child
+                            in reversed(child_streams(data_stream)))
+        self.enabled = True
+
+    def disable(self):
+        """Restore the data streams of the pipeline."""
+        if not self.enabled:
+            return
+        for stage in self.stages:
+            del stage.data_stream.get_data
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self.enabled = False
+
+    def reset(self):
+        """Reset the statistics of all stages."""
+        for stage in self.stages:
+            stage.reset()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def _instrument(self, stage, get_data, outermost):
+        def profiled_get_data(*args, **kwargs):
+            local = self._local
+            if not hasattr(local, 'children'):
+                local.children = []
+            # Time and allocations of the wrapped data streams are
+            # accumulated in this frame, so that they can be subtracted.
+            local.children.append([0., 0])
+            data = None
+            end_of_epoch = False
+            allocated = self._traced_memory()
+            start = default_timer()
+            try:
+                data = get_data(*args, **kwargs)
+            except StopIteration:
+                end_of_epoch = True
+                raise
+            finally:
+                elapsed = default_timer() - start
+                allocated = self._traced_memory() - allocated
+                children_time, children_allocated = local.children.pop()
+                stage.calls += 1
+                stage.total_time += elapsed
+                stage.self_time += elapsed - children_time
+                stage.allocated += allocated - children_allocated
+                if local.children:
+                    local.children[-1][0] += elapsed
+                    local.children[-1][1] += allocated
+                stage.nbytes += data_nbytes(data)
+                if end_of_epoch and outermost and self.report_on_epoch_end:
+                    self._end_of_epoch()
+            return data
+        return profiled_get_data
+
+    def _traced_memory(self):
+        if self.trace_allocations:
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def _end_of_epoch(self):
+        self.print_report()
+        self.reset()
+
+    def report(self):
+        """Returns a table with the statistics of all stages.
+
+        Returns
+        -------
+        str
+            A table with one row per stage, in the order of the pipeline
+            (outermost data stream first).
+
+        """
+        total_self_time = sum(stage.self_time for stage in self.stages)
+        name_width = max([len('stage')] +
+                         [len(stage.name) for stage in self.stages])
+        columns = ['calls', 'total (s)', 'self (s)', 'self (%)',
+                   'ms/call', 'MB out']
+        if self.trace_allocations:
+            columns.append('MB alloc')
+        header = ' '.join(['{:<{}}'.format('stage', name_width)] +
+                          ['{:>10}'.format(column) for column in columns])
+        lines = [header, '-' * len(header)]
+        for stage in self.stages:
+            values = [
+                '{:>10d}'.format(stage.calls),
+                '{:>10.3f}'.format(stage.total_time),
+                '{:>10.3f}'.format(stage.self_time),
+                '{:>10.1f}'.format(100. * stage.self_time / total_self_time
+                                   if total_self_time else 0.),
+                '{:>10.3f}'.format(1e3 * stage.total_time / stage.calls
+                                   if stage.calls else 0.),
+                '{:>10.2f}'.format(stage.nbytes / 1e6)]
+            if self.trace_allocations:
+                values.append('{:>10.2f}'.format(stage.allocated / 1e6))
+            lines.append(' '.join(['{:<{}}'.format(stage.name, name_width)] +
+                                  values))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        """Prints the table returned by :meth:`report`."""
+        print(self.report(), file=self.file or sys.stdout)
@@ -0,0 +1,163 @@
+"""Read-only arrays shared by processes through memory-mapped files.
+
+An array is identified by a name. The first process to ask for it reads
+the data and writes it to a file in shared memory (``/dev/shm`` where
+available), which all processes then map read-only. The file keeps a
+count of the processes using it, and is deleted by the last one.
+
+"""
+import errno
+import hashlib
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+
+import numpy
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+if os.path.isdir('/dev/shm'):
+    SHARED_MEMORY_DIR = '/dev/shm'
+else:
+    SHARED_MEMORY_DIR = tempfile.gettempdir()
+# The reference count is stored after the data
+COUNT_FORMAT = '<q'
+COUNT_SIZE = struct.calcsize(COUNT_FORMAT)
+
+
+def shared_array_name(*key):
+    r"""Return a file name identifying an array.
+
+    Parameters
+    ----------
+    \*key
+        Objects whose representation identifies the array.
+
+    """
+    digest = hashlib.sha1(repr(key).encode('utf8')).hexdigest()
+    return 'fuel-{}'.format(digest)
+
+
+class SharedArray(object):
+    """A read-only array shared by the processes which ask for it.
+
+    Parameters
+    ----------
+    name : str
+        The name of the array, see :func:`shared_array_name`.
+    shape : tuple of int
+        The shape of the array.
+    dtype : :class:`numpy.dtype`
+        The data type of the array. Object arrays can't be shared.
+    read : callable
+        Called without arguments to read the array, if no other process
+        shares it yet.
+    directory : str, optional
+        The directory in which to store shared arrays. Defaults to
+        ``/dev/shm`` if it exists, and the temporary directory otherwise.
+
+    Attributes
+    ----------
+    array : :class:`numpy.ndarray`
+        The shared data, which is read-only.
+
+    Notes
+    -----
+    The array stops being shared when :meth:`release` is called or this
+    object is garbage collected. Processes forked after the array was
+    shared use it without sharing it themselves. Files of processes
+    which were killed before releasing their arrays aren't deleted.
+
+    """
+    def __init__(self, name, shape, dtype, read, directory=None):
+        self.fd = None
+        self.pid = os.getpid()
+        if not FCNTL_AVAILABLE:
+            raise ImportError('sharing arrays requires the fcntl module')
+        dtype = numpy.dtype(dtype)
+        if dtype.hasobject:
+            raise ValueError('object arrays cannot be shared')
+        self.path = os.path.join(directory or SHARED_MEMORY_DIR, name)
+        self.nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        # Keep pointers to modules, otherwise they may not be accessible
+        # anymore in the __del__ method.
+        self.os = os
+        self.fcntl = fcntl
+        self.struct = struct
+        while self.fd is None:
+            try:
+                fd = os.open(self.path, os.O_RDWR)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                self._create(shape, dtype, read)
+                continue
+            with self._locked(fd):
+                # The last process using the file may have deleted it
+                # before it could be locked
+                if os.fstat(fd).st_nlink:
+                    self._add_to_count(fd, 1)
+                    self.fd = fd
+            if self.fd is None:
+                os.close(fd)
+        if self.nbytes:
+            self.array = numpy.memmap(self.path, dtype=dtype, mode='r',
+                                      shape=tuple(shape)).view(numpy.ndarray)
+        else:
+            self.array = numpy.empty(shape, dtype=dtype)
+
+    def _create(self, shape, dtype, read):
+        data = numpy.ascontiguousarray(read(), dtype=dtype)
+        if data.shape != tuple(shape):
+            raise ValueError('expected an array of shape {}, got {}'.format(
+                tuple(shape), data.shape))
+        # The file is written under a temporary name and then linked, so
+        # that other processes never see incomplete data
+        fd, temporary_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.path),
+            dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                data.tofile(f)
+                f.write(struct.pack(COUNT_FORMAT, 0))
+            os.link(temporary_path, self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        finally:
+            os.remove(temporary_path)
+
+    @contextmanager
+    def _locked(self, fd):
+        self.fcntl.flock(fd, self.fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            self.fcntl.flock(fd, self.fcntl.LOCK_UN)
+
+    def _add_to_count(self, fd, value):
+        self.os.lseek(fd, self.nbytes, self.os.SEEK_SET)
+        count, = self.struct.unpack(COUNT_FORMAT,
+                                    self.os.read(fd, COUNT_SIZE))
+        count += value
+        self.os.lseek(fd, self.nbytes, self.os.SEEK_SET)
+        self.os.write(fd, self.struct.pack(COUNT_FORMAT, count))
+        return count
+
+    def release(self):
+        """Stop using the array, deleting the file if no one else does."""
+        # Forked processes don't hold a reference
+        if self.fd is None or self.os.getpid() != self.pid:
+            return
+        with self._locked(self.fd):
+            if not self._add_to_count(self.fd, -1):
+                self.os.remove(self.path)
+        self.os.close(self.fd)
+        self.fd = None
+
+    def __del__(self):
+        self.release()
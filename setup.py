@@ -54,7 +54,8 @@ setup(
         'docs': ['sphinx', 'sphinx-rtd-theme']
     },
     entry_points={
-        'console_scripts': ['fuel-convert = fuel.bin.fuel_convert:main',
+        'console_scripts': ['fuel-bench = fuel.bin.fuel_bench:main',
+                            'fuel-convert = fuel.bin.fuel_convert:main',
                             'fuel-download = fuel.bin.fuel_download:main',
                             'fuel-info = fuel.bin.fuel_info:main']
     },
@@ -1,5 +1,6 @@
 import os
 import tables
+import threading
 
 import h5py
 import numpy
@@ -9,6 +10,7 @@ from six.moves import range, cPickle
 from fuel.datasets.hdf5 import PytablesDataset, H5PYDataset
 from fuel.streams import DataStream
 from fuel.schemes import SequentialScheme
+from fuel.transformers import MultiProcessing
 
 
 class TestPytablesDataset(object):
@@ -214,6 +216,62 @@ class TestH5PYDataset(object):
                      (self.features[request], self.targets[request]))
         dataset.close(handle)
 
+    def test_partially_in_memory(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              subset=slice(2, 20), load_in_memory=['targets'])
+        assert dataset.data_sources[0] is None
+        assert_equal(dataset.data_sources[1], self.targets[2:20])
+        handle = dataset.open()
+        for request in ([7, 4, 6, 2, 5], slice(3, 9), 17):
+            assert_equal(dataset.get_data(handle, request),
+                         (self.features[2:20][request],
+                          self.targets[2:20][request]))
+        dataset.close(handle)
+
+    def test_partially_in_memory_all_sources(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',),
+                              sources=('targets',),
+                              load_in_memory=['targets'])
+        assert dataset.open() is None
+        assert_equal(dataset.get_data(None, [1, 3]), (self.targets[[1, 3]],))
+
+    def test_partially_in_memory_value_error(self):
+        assert_raises(ValueError, H5PYDataset, self.h5file, ('train',),
+                      load_in_memory=['labels'])
+        assert_raises(ValueError, H5PYDataset, self.h5file, ('train',),
+                      load_in_memory='targets')
+
+    def test_shared_memory(self):
+        try:
+            h5file = h5py.File('shared.hdf5', mode='w')
+            h5file['features'] = self.features
+            h5file['targets'] = self.targets
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20), 'targets': (0, 20)}})
+            h5file.close()
+            datasets = [H5PYDataset('shared.hdf5', which_sets=('train',),
+                                    subset=slice(2, 20), load_in_memory=True,
+                                    shared_memory=True) for _ in range(2)]
+            for dataset in datasets:
+                assert_equal(dataset.get_data(None, [7, 4, 6]),
+                             (self.features[2:20][[7, 4, 6]],
+                              self.targets[2:20][[7, 4, 6]]))
+            paths = [shared_array.path
+                     for shared_array in datasets[0].shared_arrays]
+            assert_equal(len(paths), 2)
+            assert_equal(paths, [
+                shared_array.path
+                for shared_array in datasets[1].shared_arrays])
+            other = H5PYDataset('shared.hdf5', which_sets=('train',),
+                                load_in_memory=True, shared_memory=True)
+            assert other.shared_arrays[0].path not in paths
+            del datasets, dataset, other
+            assert not any(os.path.exists(path) for path in paths)
+        finally:
+            os.remove('shared.hdf5')
+        assert_raises(ValueError, H5PYDataset, self.h5file, ('train',),
+                      load_in_memory=True, shared_memory=True)
+
     def test_out_of_memory_sorted_indices(self):
         dataset = H5PYDataset(
             self.h5file, which_sets=('train',), load_in_memory=False,
@@ -224,6 +282,135 @@ class TestH5PYDataset(object):
                      (self.features[request], self.targets[request]))
         dataset.close(handle)
 
+    def test_out_of_memory_coalesced_indices(self):
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), load_in_memory=False,
+            coalesce_gap=2)
+        handle = dataset.open()
+        request = [7, 4, 6, 2, 5, 15, 4]
+        assert_equal(dataset.get_data(handle, request),
+                     (self.features[request], self.targets[request]))
+        dataset.close(handle)
+
+    def test_example_chunk_size(self):
+        dataset = H5PYDataset(self.h5file, which_sets=('train',))
+        assert dataset.example_chunk_size is None
+        h5file = h5py.File(
+            'chunked.hdf5', mode='w', driver='core', backing_store=False)
+        h5file.create_dataset('features', data=self.features,
+                              chunks=(8, 36))
+        h5file.create_dataset('targets', data=self.targets, chunks=(4, 1))
+        h5file.attrs['split'] = H5PYDataset.create_split_array(
+            {'train': {'features': (0, 20), 'targets': (0, 20)}})
+        dataset = H5PYDataset(h5file, which_sets=('train',))
+        assert dataset.example_chunk_size == 8
+        h5file.close()
+
+    def test_out_of_memory_chunk_cache(self):
+        h5file = h5py.File(
+            'cached.hdf5', mode='w', driver='core', backing_store=False)
+        h5file.create_dataset('features', data=self.features,
+                              chunks=(8, 36))
+        h5file.create_dataset('targets', data=self.targets)
+        h5file.attrs['split'] = H5PYDataset.create_split_array(
+            {'train': {'features': (0, 20), 'targets': (0, 20)}})
+        dataset = H5PYDataset(h5file, which_sets=('train',),
+                              subset=slice(2, 20), cache_size=10 ** 6)
+        handle = dataset.open()
+        request = [7, 4, 6, 2, 5, 15]
+        assert_equal(dataset.get_data(handle, request),
+                     (self.features[2:20][request],
+                      self.targets[2:20][request]))
+        # The unchunked targets aren't cached
+        cache = dataset.chunk_cache
+        assert_equal((cache.hits, cache.misses), (0, 3))
+        assert_equal(dataset.get_data(handle, slice(3, 9))[0],
+                     self.features[5:11])
+        assert_equal(dataset.get_data(handle, 17)[0], self.features[19])
+        assert_equal((cache.hits, cache.misses), (3, 3))
+        # Caches are shared by datasets reading the same file
+        other = H5PYDataset(h5file, which_sets=('train',),
+                            sources=('features',), cache_size=10 ** 6)
+        assert other.chunk_cache is cache
+        dataset.close(handle)
+        h5file.close()
+
+    def test_out_of_memory_chunk_cache_across_epochs(self):
+        try:
+            h5file = h5py.File('cached.hdf5', mode='w')
+            h5file.create_dataset('features', data=self.features,
+                                  chunks=(8, 36))
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20)}})
+            h5file.close()
+            dataset = H5PYDataset('cached.hdf5', which_sets=('train',),
+                                  cache_size=10 ** 6)
+            stream = DataStream(dataset,
+                                iteration_scheme=SequentialScheme(20, 4))
+            cache = dataset.chunk_cache
+            for epoch in range(2):
+                assert_equal([features for features, in
+                              stream.get_epoch_iterator()],
+                             [self.features[i:i + 4]
+                              for i in range(0, 20, 4)])
+                # The file is closed between epochs, but the cache is kept
+                assert dataset.chunk_cache is cache
+                assert_equal((cache.hits, cache.misses),
+                             (2 + 5 * epoch, 3))
+            stream.close()
+        finally:
+            os.remove('cached.hdf5')
+
+    def test_out_of_memory_chunk_cache_eviction(self):
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), sources=('features',),
+            cache_size=2 * 4 * 36 * 2, cache_block_size=4)
+        handle = dataset.open()
+        for request in ([0, 1], [5, 9], [2, 3], [10]):
+            assert_equal(dataset.get_data(handle, request)[0],
+                         self.features[request])
+        cache = dataset.chunk_cache
+        assert_equal((cache.hits, cache.misses, cache.nbytes),
+                     (1, 4, 2 * 4 * 36 * 2))
+        dataset.close(handle)
+
+    def test_out_of_memory_memory_map(self):
+        try:
+            h5file = h5py.File('memmap.hdf5', mode='w')
+            h5file['features'] = self.features
+            h5file.create_dataset('targets', data=self.targets,
+                                  compression='gzip')
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20), 'targets': (0, 20)}})
+            h5file.close()
+            dataset = H5PYDataset('memmap.hdf5', which_sets=('train',),
+                                  subset=slice(2, 20))
+            handle = dataset.open()
+            for request in ([7, 4, 6, 2, 5], slice(3, 9), 17):
+                features, targets = dataset.get_data(handle, request)
+                assert_equal(features, self.features[2:20][request])
+                assert_equal(targets, self.targets[2:20][request])
+                assert type(features) is numpy.ndarray
+                assert features.flags.writeable
+            memory_maps = dataset.memory_maps
+            assert isinstance(memory_maps['/features'], numpy.memmap)
+            assert memory_maps['/targets'] is None
+            dataset.close(handle)
+            # The memory maps are reused in the next epoch
+            handle = dataset.open()
+            assert_equal(dataset.get_data(handle, [3])[0],
+                         self.features[[5]])
+            assert dataset.memory_maps['/features'] is memory_maps['/features']
+            dataset.close(handle)
+            dataset = H5PYDataset('memmap.hdf5', which_sets=('train',),
+                                  memory_map=False)
+            handle = dataset.open()
+            dataset.get_data(handle, [1, 2])
+            assert_equal(dataset.memory_maps, {})
+            dataset.close(handle)
+        finally:
+            os.remove('memmap.hdf5')
+
     def test_out_of_memory_unsorted_indices(self):
         dataset = H5PYDataset(
             self.h5file, which_sets=('train',), load_in_memory=False,
@@ -430,6 +617,187 @@ class TestH5PYDataset(object):
         assert_equal(next(iter_),
                      (self.vlen_features[1], self.vlen_targets[1]))
 
+    def test_vlen_partially_in_memory(self):
+        dataset = H5PYDataset(
+            self.vlen_h5file, which_sets=('train',), subset=slice(1, 4),
+            load_in_memory=['targets'])
+        assert dataset.data_sources[0] is None
+        assert_equal(dataset.source_shapes[0],
+                     [d.shape for d in self.vlen_features[1:4]])
+        handle = dataset.open()
+        features, targets = dataset.get_data(handle, [2, 0])
+        assert_equal(features[0], self.vlen_features[3])
+        assert_equal(features[1], self.vlen_features[1])
+        assert_equal(targets, self.vlen_targets[[3, 1]])
+        dataset.close(handle)
+
+    def test_vlen_padded(self):
+        for load_in_memory in (False, True):
+            dataset = H5PYDataset(
+                self.vlen_h5file, which_sets=('train',),
+                load_in_memory=load_in_memory, vlen_format='padded')
+            assert_equal(dataset.provides_sources,
+                         ('features', 'features_shapes', 'targets'))
+            assert_equal(dataset.axis_labels['features_shapes'],
+                         ('batch', 'axis'))
+            handle = dataset.open()
+            features, shapes, targets = dataset.get_data(handle, [2, 0])
+            assert_equal(features.shape, (2, 3, 5, 4))
+            assert_equal(features[0], self.vlen_features[2])
+            assert_equal(features[1, :, :2, :2], self.vlen_features[0])
+            assert not features[1, :, 2:].any()
+            assert not features[1, :, :, 2:].any()
+            assert_equal(shapes, [[3, 5, 4], [3, 2, 2]])
+            assert_equal(targets, self.vlen_targets[[2, 0]])
+            features, shapes, _ = dataset.get_data(handle, 1)
+            assert_equal(features, self.vlen_features[1])
+            assert_equal(shapes, [3, 4, 4])
+            dataset.close(handle)
+
+    def test_vlen_ragged(self):
+        dataset = H5PYDataset(
+            self.vlen_h5file, which_sets=('train',), vlen_format='ragged',
+            sources=('features_offsets', 'features'))
+        assert_equal(dataset.axis_labels['features'], ('value',))
+        assert_equal(dataset.axis_labels['features_offsets'], ('offset',))
+        handle = dataset.open()
+        offsets, values = dataset.get_data(handle, slice(1, 3))
+        assert_equal(offsets, [0, 48, 108])
+        assert_equal(values[:48], self.vlen_features[1].flatten())
+        assert_equal(values[48:], self.vlen_features[2].flatten())
+        dataset.close(handle)
+
+    def test_vlen_format_value_error(self):
+        assert_raises(ValueError, H5PYDataset, self.vlen_h5file, ('train',),
+                      vlen_format='flat')
+
+    def test_read_threads(self):
+        dataset = H5PYDataset(
+            self.vlen_h5file, which_sets=('train',), read_threads=2)
+        handle = dataset.open()
+        features, targets = dataset.get_data(handle, [3, 1])
+        assert_equal(features[0], self.vlen_features[3])
+        assert_equal(features[1], self.vlen_features[1])
+        assert_equal(targets, self.vlen_targets[[3, 1]])
+        dataset.close(handle)
+        assert_raises(ValueError, H5PYDataset, self.vlen_h5file, ('train',),
+                      read_threads=0)
+
+    def test_read_threads_multiprocessing(self):
+        try:
+            h5file = h5py.File('threads.hdf5', mode='w')
+            h5file['features'] = self.features
+            h5file['targets'] = self.targets
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20), 'targets': (0, 20)}})
+            h5file.close()
+            dataset = H5PYDataset('threads.hdf5', which_sets=('train',),
+                                  read_threads=2)
+            stream = DataStream(dataset,
+                                iteration_scheme=SequentialScheme(20, 5))
+            # The pool of the parent is created before forking
+            expected = list(stream.get_epoch_iterator())
+            assert dataset.thread_pools
+            stream = MultiProcessing(stream)
+            assert_equal(list(stream.get_epoch_iterator()), expected)
+            stream.close()
+            handle = dataset.open()
+            dataset.get_data(handle, slice(0, 5))
+            pool, _ = dataset.thread_pools['read']
+            dataset.close(handle)
+            assert_equal(dataset.thread_pools, {})
+            assert not any(thread.is_alive() for thread in pool._pool)
+        finally:
+            os.remove('threads.hdf5')
+
+    def test_readahead(self):
+        dataset = H5PYDataset(
+            self.h5file, which_sets=('train',), subset=slice(1, 20),
+            readahead=2)
+        handle = dataset.open()
+        for start in range(0, 19, 3):
+            request = slice(start, min(start + 3, 19))
+            assert_equal(dataset.get_data(handle, request),
+                         (self.features[1:20][request],
+                          self.targets[1:20][request]))
+            buffered = [buffer_[:2] for buffer_ in dataset.readahead_buffers]
+            if start == 0:
+                assert_equal(buffered, [(3, 9)])
+            elif start == 3:
+                assert_equal(buffered, [(3, 9), (9, 15)])
+        # Other requests are read directly
+        assert_equal(dataset.get_data(handle, slice(4, 6))[0],
+                     self.features[5:7])
+        assert_equal(dataset.readahead_buffers, [])
+        dataset.close(handle)
+        assert_raises(ValueError, H5PYDataset, self.h5file, ('train',),
+                      readahead=0)
+
+    def test_readahead_multiprocessing(self):
+        try:
+            h5file = h5py.File('readahead.hdf5', mode='w')
+            h5file['features'] = self.features
+            h5file['targets'] = self.targets
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20), 'targets': (0, 20)}})
+            h5file.close()
+            dataset = H5PYDataset('readahead.hdf5', which_sets=('train',),
+                                  readahead=2)
+            stream = DataStream(dataset,
+                                iteration_scheme=SequentialScheme(20, 5))
+            # Fork while batches are being read ahead
+            epoch = stream.get_epoch_iterator()
+            next(epoch)
+            assert dataset.readahead_buffers
+            pool, _ = dataset.thread_pools['readahead']
+            background = MultiProcessing(stream)
+            assert_equal(list(background.get_epoch_iterator()),
+                         [(self.features[i:i + 5], self.targets[i:i + 5])
+                          for i in range(0, 20, 5)])
+            background.close()
+            assert_equal(dataset.readahead_buffers, [])
+            assert not any(thread.is_alive() for thread in pool._pool)
+        finally:
+            os.remove('readahead.hdf5')
+
+    def test_readahead_read_threads(self):
+        try:
+            h5file = h5py.File('readahead.hdf5', mode='w')
+            h5file['features'] = self.features
+            h5file['targets'] = self.targets
+            h5file.attrs['split'] = H5PYDataset.create_split_array(
+                {'train': {'features': (0, 20), 'targets': (0, 20)}})
+            h5file.close()
+            dataset = H5PYDataset('readahead.hdf5', which_sets=('train',),
+                                  read_threads=2, readahead=2)
+            stream = DataStream(dataset,
+                                iteration_scheme=SequentialScheme(20, 2))
+            counts = []
+            for _ in range(5):
+                assert_equal(list(stream.get_epoch_iterator()),
+                             [(self.features[i:i + 2], self.targets[i:i + 2])
+                              for i in range(0, 20, 2)])
+                counts.append((len(dataset.thread_pools),
+                               threading.active_count()))
+            # No pool is created twice and left running
+            assert_equal(counts, [counts[0]] * 5)
+            assert_equal(counts[0][0], 2)
+            stream.close()
+        finally:
+            os.remove('readahead.hdf5')
+
+    def test_vlen_readahead(self):
+        dataset = H5PYDataset(
+            self.vlen_h5file, which_sets=('train',), readahead=1)
+        stream = DataStream(dataset,
+                            iteration_scheme=SequentialScheme(4, 2))
+        for _ in range(2):
+            batches = list(stream.get_epoch_iterator())
+            for i, (features, targets) in enumerate(batches):
+                assert_equal(features[0], self.vlen_features[2 * i])
+                assert_equal(features[1], self.vlen_features[2 * i + 1])
+                assert_equal(targets, self.vlen_targets[2 * i:2 * i + 2])
+
     def test_dataset_get_data_without_open(self):
         dataset = H5PYDataset(self.h5file, which_sets=('train',),
                               load_in_memory=False)
@@ -3,8 +3,8 @@ from numpy.testing import assert_raises
 
 from fuel.schemes import (ConstantScheme, SequentialExampleScheme,
                           SequentialScheme, ShuffledExampleScheme,
-                          ShuffledScheme, ConcatenatedScheme,
-                          cross_validation)
+                          ShuffledScheme, BlockShuffledScheme,
+                          ConcatenatedScheme, cross_validation)
 
 
 def iterator_requester(scheme):
@@ -84,6 +84,28 @@ def test_shuffled_scheme_requests_batches():
     assert not ShuffledScheme(3, 3).requests_examples
 
 
+def test_block_shuffled_scheme():
+    scheme = BlockShuffledScheme(96, 10, block_size=8, window_size=2,
+                                 rng=numpy.random.RandomState(1))
+    requests = list(scheme.get_request_iterator())
+    indices = sum(requests, [])
+    assert sorted(indices) == list(range(96))
+    assert indices != list(range(96))
+    # Consecutive windows of 16 examples come from two blocks each
+    for i in range(0, 96, 16):
+        assert len(set(index // 8 for index in indices[i:i + 16])) == 2
+    assert list(scheme.get_request_iterator()) != requests
+
+
+def test_block_shuffled_scheme_indices():
+    scheme = BlockShuffledScheme([3, 17, 4, 25, 16], 2, block_size=8,
+                                 window_size=1, sorted_indices=True)
+    requests = list(scheme.get_request_iterator())
+    assert sorted(sum(requests, [])) == [3, 4, 16, 17, 25]
+    assert all(request == sorted(request) for request in requests)
+    assert_raises(ValueError, BlockShuffledScheme, 10, 2, block_size=0)
+
+
 def test_shuffled_example_scheme():
     get_request_iterator = iterator_requester(ShuffledExampleScheme)
     indices = list(range(7))
@@ -112,6 +134,32 @@ def test_sequential_example_scheme_requests_examples():
     assert SequentialExampleScheme(3).requests_examples
 
 
+def test_resume_request_iterator():
+    schemes = [ConstantScheme(3, num_examples=10), ConstantScheme(3, times=4),
+               SequentialScheme(10, 3), SequentialScheme(list(range(10)), 3),
+               ShuffledScheme(10, 3, sorted_indices=True),
+               BlockShuffledScheme(10, 3, block_size=4),
+               SequentialExampleScheme(7), ShuffledExampleScheme(7),
+               ConcatenatedScheme([ShuffledExampleScheme(3),
+                                   SequentialExampleScheme(2)])]
+    for scheme in schemes:
+        for num_requests in [0, 2, 3, 4, 12]:
+            state = scheme.get_state()
+            expected = list(scheme.get_request_iterator())[num_requests:]
+            scheme.set_state(state)
+            assert list(scheme.resume_request_iterator(num_requests)) == \
+                expected
+
+
+def test_shuffled_scheme_state():
+    for scheme in [ShuffledScheme(10, 3), ShuffledExampleScheme(10)]:
+        state = scheme.get_state()
+        requests = list(scheme.get_request_iterator())
+        assert list(scheme.get_request_iterator()) != requests
+        scheme.set_state(state)
+        assert list(scheme.get_request_iterator()) == requests
+
+
 def test_concatenated_scheme():
     sch = ConcatenatedScheme(schemes=[ConstantScheme(batch_size=10, times=5),
                                       ConstantScheme(batch_size=20, times=3),
@@ -1,12 +1,12 @@
 import tempfile
 
 import numpy
-from numpy.testing import assert_raises
+from numpy.testing import assert_equal, assert_raises
 from six import BytesIO
 from six.moves import cPickle
 
 from fuel.datasets import TextFile, IterableDataset, IndexableDataset
-from fuel.schemes import SequentialScheme
+from fuel.schemes import SequentialExampleScheme, SequentialScheme
 from fuel.streams import DataStream
 from fuel.transformers.sequences import Window, NGrams
 
@@ -108,3 +108,68 @@ def test_ngram_stream_raises_error_on_request():
     stream = DataStream(IterableDataset(sentences))
     ngrams = NGrams(4, stream)
     assert_raises(ValueError, ngrams.get_data, [0, 1])
+
+
+def test_window_stream_produces_batches():
+    sentences = [list(numpy.random.randint(10, size=sentence_length))
+                 for sentence_length in [3, 5, 7]]
+    stream = DataStream(IterableDataset(sentences))
+    for args in [(0, 4, 4, True), (-2, 4, 4, False), (-2, 4, 4, True),
+                 (1, 3, 2, True), (0, 2, 1, False)]:
+        expected = list(Window(*(args + (stream,))).get_epoch_iterator())
+        windows = Window(*(args + (stream,)), produces_examples=False)
+        batches = list(windows.get_epoch_iterator())
+        sources = numpy.concatenate([source for source, _ in batches])
+        targets = numpy.concatenate([target for _, target in batches])
+        assert_equal(sources, [source for source, _ in expected])
+        assert_equal(targets, [target for _, target in expected])
+        # Sentences too short to produce any windows are skipped
+        assert all(len(source) for source, _ in batches)
+
+
+def test_window_stream_produces_batches_from_batches():
+    sentences = [numpy.random.randint(10, size=(sentence_length, 2))
+                 for sentence_length in [3, 5, 7, 6]]
+    expected = list(Window(1, 2, 2, True, DataStream(
+        IterableDataset(sentences))).get_epoch_iterator())
+    stream = DataStream(IndexableDataset(sentences),
+                        iteration_scheme=SequentialScheme(4, 2))
+    windows = Window(1, 2, 2, True, stream, produces_examples=False)
+    batches = list(windows.get_epoch_iterator())
+    assert len(batches) == 2
+    assert batches[0][0].shape == (4, 2, 2)
+    assert_equal(numpy.concatenate([source for source, _ in batches]),
+                 [source for source, _ in expected])
+    assert_equal(numpy.concatenate([target for _, target in batches]),
+                 [target for _, target in expected])
+
+
+def test_ngram_stream_produces_batches():
+    sentences = [list(numpy.random.randint(10, size=sentence_length))
+                 for sentence_length in [3, 5, 7]]
+    stream = DataStream(IterableDataset(sentences))
+    expected = list(NGrams(4, stream).get_epoch_iterator())
+    ngrams = NGrams(4, stream, produces_examples=False)
+    assert not ngrams.produces_examples
+    batches = list(ngrams.get_epoch_iterator())
+    assert [len(source) for source, _ in batches] == [1, 3]
+    assert_equal(numpy.concatenate([source for source, _ in batches]),
+                 [source for source, _ in expected])
+    assert_equal(numpy.concatenate([target for _, target in batches]),
+                 [target for _, target in expected])
+
+
+def test_window_stream_resumes_from_position():
+    sentences = [list(range(length)) for length in [3, 5, 7, 6]]
+    stream = DataStream(IndexableDataset(sentences),
+                        iteration_scheme=SequentialExampleScheme(4))
+    windows = Window(1, 2, 2, True, stream)
+    epoch = windows.get_epoch_iterator()
+    for _ in range(6):
+        next(epoch)
+    position = cPickle.loads(cPickle.dumps(epoch.get_position()))
+    assert position['stream_state']['index'] == 2
+    expected = list(epoch)
+    resumed = Window(1, 2, 2, True, stream).get_epoch_iterator(
+        position=position)
+    assert list(resumed) == expected
@@ -1,8 +1,10 @@
 import numpy
 from numpy.testing import assert_equal, assert_raises
+from six.moves import cPickle
 
 from fuel.datasets import IterableDataset, IndexableDataset
-from fuel.schemes import SequentialExampleScheme, SequentialScheme
+from fuel.schemes import (SequentialExampleScheme, SequentialScheme,
+                          ShuffledScheme)
 from fuel.streams import AbstractDataStream, DataStream
 
 
@@ -63,3 +65,36 @@ class TestDataStream(object):
         stream = DataStream(self.dataset,
                             iteration_scheme=SequentialExampleScheme(2))
         assert stream.produces_examples
+
+
+class TestEpochPosition(object):
+    def setUp(self):
+        self.dataset = IndexableDataset(numpy.arange(20))
+
+    def resume(self, stream, position):
+        stream = cPickle.loads(cPickle.dumps(stream))
+        position = cPickle.loads(cPickle.dumps(position))
+        return stream.get_epoch_iterator(position=position)
+
+    def test_shuffled_scheme(self):
+        stream = DataStream(self.dataset,
+                            iteration_scheme=ShuffledScheme(20, 3))
+        initial_stream = cPickle.dumps(stream)
+        list(stream.get_epoch_iterator())
+        epoch = stream.get_epoch_iterator()
+        for _ in range(4):
+            next(epoch)
+        position = epoch.get_position()
+        assert position['num_requests'] == 4
+        # The data stream doesn't need to be pickled mid-epoch
+        resumed = self.resume(cPickle.loads(initial_stream), position)
+        assert_equal(list(resumed), list(epoch))
+        assert resumed.num_requests == 7
+
+    def test_replays_streams_without_scheme(self):
+        stream = DataStream(IterableDataset(numpy.arange(20)))
+        epoch = stream.get_epoch_iterator()
+        for _ in range(5):
+            next(epoch)
+        resumed = self.resume(stream, epoch.get_position())
+        assert_equal(list(resumed), list(epoch))
@@ -10,9 +10,17 @@ from numpy.testing import assert_raises, assert_equal
 from six.moves import range, cPickle
 
 from fuel import config
+from fuel.datasets import IndexableDataset, IterableDataset
 from fuel.iterator import DataIterator
-from fuel.utils import do_not_pickle_attributes, find_in_data_path, Subset
+from fuel.schemes import SequentialScheme
+from fuel.streams import DataStream
+from fuel.transformers import Mapping, Merge
+from fuel.utils import (do_not_pickle_attributes, find_in_data_path, Subset,
+                        ragged_arrays, pad_ragged_arrays)
 from fuel.utils.parallel import producer_consumer
+from fuel.utils.profiling import (PipelineProfiler, benchmark_stream,
+                                  data_nbytes)
+from fuel.utils.shared import SharedArray, shared_array_name
 
 
 class TestSubset(object):
@@ -62,6 +70,19 @@ class TestSubset(object):
     def test_contiguous_lists_are_transformed_into_slices(self):
         assert_equal(Subset([1, 2, 3], 10).list_or_slice, slice(1, 4, None))
 
+    def test_lists_are_int64_arrays(self):
+        subset = Subset([5, 3, 1], 10)
+        assert_equal(subset.list_or_slice.dtype, numpy.int64)
+        assert isinstance(subset[[2, 0]], numpy.ndarray)
+        assert isinstance(Subset(slice(1, 5), 10)[[2, 0]], numpy.ndarray)
+        assert_equal(Subset([], 10).list_or_slice.dtype, numpy.int64)
+        assert_equal(Subset(numpy.array([4, 2]), 10).list_or_slice, [2, 4])
+
+    def test_get_list_representation(self):
+        assert_equal(Subset(slice(2, 5), 10).get_list_representation(),
+                     [2, 3, 4])
+        assert_equal(Subset([1, 4], 10).get_list_representation(), [1, 4])
+
     def test_none_slice_request(self):
         assert_equal(Subset([1, 3, 5, 7], 8)[slice(None)], [1, 3, 5, 7])
         assert_equal(Subset(slice(0, 8, 1), 8)[slice(None)], slice(0, 8, 1))
@@ -132,6 +153,36 @@ class TestSubset(object):
         assert_equal(Subset.sorted_fancy_indexing(indexable, [0, 5, 2]),
                      [0, 5, 2])
 
+    def test_coalesced_fancy_indexing(self):
+        indexable = numpy.arange(40).reshape((20, 2))
+        for request in [[3], [5, 6, 7], [7, 5, 6], [12, 0, 1, 3, 19, 12],
+                        [18, 2, 9, 4]]:
+            for coalesce_gap in [0, 1, 5, 20]:
+                assert_equal(Subset.coalesced_fancy_indexing(
+                    indexable, request, coalesce_gap), indexable[request])
+
+    def test_coalesced_fancy_indexing_reads(self):
+        class Indexable(object):
+            shape = (20,)
+            dtype = numpy.dtype('int64')
+
+            def __init__(self):
+                self.requests = []
+
+            def __getitem__(self, key):
+                self.requests.append(key)
+                return numpy.arange(20)[key]
+        indexable = Indexable()
+        assert_equal(Subset.coalesced_fancy_indexing(
+            indexable, [9, 2, 3, 4, 15, 11]), [9, 2, 3, 4, 15, 11])
+        assert_equal([key for key in indexable.requests
+                      if isinstance(key, slice)], [slice(2, 5)])
+        indexable.requests = []
+        assert_equal(Subset.coalesced_fancy_indexing(
+            indexable, [9, 2, 3, 4, 15, 11], coalesce_gap=4),
+            [9, 2, 3, 4, 15, 11])
+        assert_equal(indexable.requests, [slice(2, 16)])
+
     def test_list_request_sanity_check_raises_error_on_empty_list(self):
         assert_raises(ValueError, Subset([0], 8)._list_request_sanity_check,
                       [], 1)
@@ -214,6 +265,41 @@ class NonLoadingClass(object):
         pass
 
 
+class TestRaggedArrays(object):
+    def setUp(self):
+        self.arrays = [numpy.arange(6).reshape((2, 3)),
+                       numpy.arange(2).reshape((1, 2)),
+                       numpy.arange(3).reshape((3, 1))]
+
+    def test_ragged_arrays(self):
+        values, offsets = ragged_arrays(self.arrays)
+        assert_equal(values, [0, 1, 2, 3, 4, 5, 0, 1, 0, 1, 2])
+        assert_equal(offsets, [0, 6, 8, 11])
+
+    def test_pad_ragged_arrays(self):
+        values, offsets = ragged_arrays(self.arrays)
+        padded = pad_ragged_arrays(
+            values, offsets, [array.shape for array in self.arrays])
+        assert_equal(padded, [[[0, 1, 2], [3, 4, 5], [0, 0, 0]],
+                              [[0, 1, 0], [0, 0, 0], [0, 0, 0]],
+                              [[0, 0, 0], [1, 0, 0], [2, 0, 0]]])
+
+    def test_pad_large_ragged_arrays(self):
+        arrays = [numpy.arange(600).reshape((20, 30)),
+                  numpy.arange(300).reshape((30, 10))]
+        padded = pad_ragged_arrays(
+            *ragged_arrays(arrays), shapes=[(20, 30), (30, 10)])
+        assert_equal(padded.shape, (2, 30, 30))
+        assert_equal(padded[0, :20], arrays[0])
+        assert_equal(padded[1, :, :10], arrays[1])
+        assert not padded[0, 20:].any() and not padded[1, :, 10:].any()
+
+    def test_pad_ragged_arrays_equal_shapes(self):
+        values, offsets = ragged_arrays(self.arrays[:1] * 2)
+        assert_equal(pad_ragged_arrays(values, offsets, [(2, 3)] * 2),
+                     self.arrays[:1] * 2)
+
+
 class TestFindInDataPath(object):
     def setUp(self):
         self.tempdir = tempfile.mkdtemp()
@@ -286,3 +372,168 @@ def test_producer_consumer():
     assert (producer_consumer(partial(send_integers, n=2000),
                               receive_integers) ==
             sum(i ** 2 for i in range(2000)))
+
+
+def slow_mapping(data):
+    time.sleep(0.01)
+    return data
+
+
+class TestPipelineProfiler(object):
+    def setUp(self):
+        self.dataset = IndexableDataset(
+            numpy.arange(20, dtype='float64').reshape(10, 2))
+        self.stream = Mapping(
+            DataStream(self.dataset, iteration_scheme=SequentialScheme(10, 5)),
+            slow_mapping)
+
+    def test_stages(self):
+        profiler = PipelineProfiler(self.stream, report_on_epoch_end=False)
+        with profiler:
+            for _ in self.stream.get_epoch_iterator():
+                pass
+        mapping, data_stream = profiler.stages
+        assert mapping.data_stream is self.stream
+        assert_equal(mapping.depth, 0)
+        assert_equal(data_stream.depth, 1)
+        # The last call to the mapping raises StopIteration, which is
+        # raised by the request iterator before the data stream is called.
+        assert_equal([mapping.calls, data_stream.calls], [3, 2])
+        assert_equal([mapping.nbytes, data_stream.nbytes], [160, 160])
+        assert mapping.self_time >= 0.02
+        assert mapping.self_time + data_stream.self_time <= mapping.total_time
+        assert data_stream.self_time < mapping.self_time
+
+    def test_disable_restores_streams(self):
+        with PipelineProfiler(self.stream, report_on_epoch_end=False):
+            assert 'get_data' in vars(self.stream)
+        assert 'get_data' not in vars(self.stream)
+        assert 'get_data' not in vars(self.stream.data_stream)
+        cPickle.dumps(self.stream)
+
+    def test_merge(self):
+        streams = [DataStream(self.dataset,
+                              iteration_scheme=SequentialScheme(10, 5))
+                   for _ in range(2)]
+        merge = Merge(streams, ('a', 'b'))
+        with PipelineProfiler(merge, report_on_epoch_end=False) as profiler:
+            list(merge.get_epoch_iterator())
+        assert_equal([stage.name for stage in profiler.stages],
+                     ['Merge', '  DataStream', '  DataStream'])
+
+    def test_report_on_epoch_end(self):
+        report = tempfile.TemporaryFile(mode='w+')
+        with PipelineProfiler(self.stream, file=report) as profiler:
+            list(self.stream.get_epoch_iterator())
+            assert_equal(profiler.stages[0].calls, 0)
+        report.seek(0)
+        lines = report.read().splitlines()
+        assert lines[0].split()[:3] == ['stage', 'calls', 'total']
+        assert lines[2].split()[:2] == ['Mapping', '3']
+        assert lines[3].split()[:2] == ['DataStream', '2']
+
+    def test_data_nbytes(self):
+        assert_equal(data_nbytes((numpy.zeros(3, dtype='uint8'),
+                                  [numpy.zeros(2, dtype='int32'), b'abc'],
+                                  None)), 14)
+
+
+class TestBenchmarkStream(object):
+    def setUp(self):
+        self.stream = DataStream(
+            IndexableDataset(numpy.zeros((10, 2), dtype='float32')),
+            iteration_scheme=SequentialScheme(10, 4))
+
+    def test_epochs(self):
+        results = benchmark_stream(self.stream, num_epochs=2)
+        assert_equal(results['batches'], 6)
+        assert_equal(results['examples'], 20)
+        assert_equal(results['nbytes'], 160)
+        assert_equal(len(results['latencies']), 6)
+        assert results['time_to_first_batch'] == results['latencies'][0]
+        assert results['time'] >= results['latencies'].sum()
+
+    def test_batches_span_epochs(self):
+        results = benchmark_stream(self.stream, num_batches=4)
+        assert_equal(results['batches'], 4)
+        assert_equal(results['examples'], 14)
+
+    def test_example_stream(self):
+        stream = DataStream(IterableDataset(numpy.zeros((10, 2))))
+        results = benchmark_stream(stream)
+        assert_equal([results['batches'], results['examples']], [10, 10])
+
+
+def _fail_to_read():
+    raise AssertionError('the shared array should not be read again')
+
+
+def _attach_shared_array(name, directory, queue):
+    shared_array = SharedArray(name, (4, 3), 'float32', _fail_to_read,
+                               directory=directory)
+    queue.put(shared_array.array.sum())
+    shared_array.release()
+
+
+class TestSharedArray(object):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.name = shared_array_name('test', 1)
+        self.path = os.path.join(self.tempdir, self.name)
+        self.data = numpy.arange(12, dtype='float32').reshape((4, 3))
+        self.reads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self):
+        self.reads += 1
+        return self.data
+
+    def share(self, read=None):
+        return SharedArray(self.name, (4, 3), 'float32', read or self.read,
+                           directory=self.tempdir)
+
+    def test_names(self):
+        assert shared_array_name('test', 1) != shared_array_name('test', 2)
+
+    def test_reads_once(self):
+        first, second = self.share(), self.share()
+        assert_equal(first.array, self.data)
+        assert_equal(second.array, self.data)
+        assert_equal(self.reads, 1)
+        assert not first.array.flags.writeable
+
+    def test_release(self):
+        first, second = self.share(), self.share()
+        first.release()
+        assert os.path.exists(self.path)
+        second.release()
+        assert not os.path.exists(self.path)
+        self.share()
+        assert_equal(self.reads, 2)
+
+    def test_garbage_collection(self):
+        shared_array = self.share()
+        array = shared_array.array
+        del shared_array
+        assert not os.path.exists(self.path)
+        assert_equal(array, self.data)
+
+    def test_other_process(self):
+        from multiprocessing import Process, Queue
+        shared_array = self.share()
+        queue = Queue()
+        process = Process(target=_attach_shared_array,
+                          args=(self.name, self.tempdir, queue))
+        process.start()
+        assert_equal(queue.get(timeout=10), self.data.sum())
+        process.join()
+        assert os.path.exists(self.path)
+        shared_array.release()
+        assert not os.path.exists(self.path)
+
+    def test_value_errors(self):
+        assert_raises(ValueError, self.share, lambda: self.data[:2])
+        assert_raises(ValueError, SharedArray, self.name, (2,), object,
+                      lambda: numpy.empty(2, dtype=object))
@@ -4,14 +4,16 @@ import numpy
 from numpy.testing import assert_raises, assert_equal
 from PIL import Image
 from picklable_itertools.extras import partition_all
-from six.moves import zip
+from six.moves import cPickle, zip
 from fuel import config
 from fuel.datasets.base import IndexableDataset
 from fuel.schemes import ShuffledScheme, SequentialExampleScheme
 from fuel.streams import DataStream
 from fuel.transformers.image import (ImagesFromBytes,
                                      MinimumImageDimensions,
+                                     Resize,
                                      RandomFixedSizeCrop,
+                                     RandomCropFlipNormalize,
                                      Random2DRotation)
 
 
@@ -205,6 +207,81 @@ class TestMinimumDimensions(ImageTestingMixin):
                       MinimumImageDimensions, self.example_stream, (4, 5),
                       resample='notarealresamplingmode')
 
+    def test_num_threads(self):
+        assert_raises(ValueError, MinimumImageDimensions,
+                      self.batch_stream, (4, 5), num_threads=0)
+        stream = MinimumImageDimensions(self.batch_stream, (4, 5),
+                                        which_sources=('source3',))
+        threaded_stream = MinimumImageDimensions(
+            self.batch_stream, (4, 5), num_threads=2,
+            which_sources=('source3',))
+        batch = self.dataset.indexables[2]
+        expected = stream.transform_source_batch(batch, 'source3')
+        resized = threaded_stream.transform_source_batch(batch, 'source3')
+        for image, expected_image, original in zip(resized, expected, batch):
+            assert_equal(image, expected_image)
+            assert image.shape[1] >= 4 and image.shape[2] >= 5
+            # Images which are large enough are passed through as-is
+            if original.shape[1] >= 4 and original.shape[2] >= 5:
+                assert image is original
+        threaded_stream = cPickle.loads(cPickle.dumps(threaded_stream))
+        threaded_stream.transform_source_batch(batch, 'source3')
+        threaded_stream.close()
+
+
+class TestResize(ImageTestingMixin):
+    def setUp(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        self.shapes = [(5, 9), (4, 6), (4, 3), (6, 4), (2, 5), (4, 8)]
+        source1 = [rng.random_integers(0, 255, size=(3,) + shape)
+                   .astype('uint8') for shape in self.shapes]
+        source2 = [rng.normal(size=shape).astype('float32')
+                   for shape in self.shapes]
+        self.dataset = IndexableDataset(
+            OrderedDict([('source1', source1), ('source2', source2)]),
+            axis_labels={'source1': ('batch', 'channel', 'height', 'width'),
+                         'source2': ('batch', 'channel', 'height', 'width')})
+        self.common_setup()
+
+    def test_resize_batch_stream(self):
+        stream = Resize(self.batch_stream, (4, 6), resample='bilinear')
+        for source1, source2 in stream.get_epoch_iterator():
+            assert source1.shape[1:] == (3, 4, 6)
+            assert source1.dtype == 'uint8'
+            assert source2.shape[1:] == (4, 6)
+            assert source2.dtype == 'float32'
+
+    def test_resize_example_stream(self):
+        stream = Resize(self.example_stream, (4, 6))
+        for source1, source2 in stream.get_epoch_iterator():
+            assert source1.shape == (3, 4, 6)
+            assert source2.shape == (4, 6)
+
+    def test_resize_values(self):
+        batch = self.dataset.indexables[0]
+        resized = Resize(self.batch_stream, (4, 6)).transform_source_batch(
+            batch, 'source1')
+        # Images which already have the right size are copied as-is
+        assert_equal(resized[1], batch[1])
+        expected = numpy.array(Image.fromarray(
+            batch[0].transpose(1, 2, 0)).resize(
+                (6, 4), resample=Image.NEAREST)).transpose(2, 0, 1)
+        assert_equal(resized[0], expected)
+        threaded = Resize(self.batch_stream, (4, 6), num_threads=3)
+        assert_equal(threaded.transform_source_batch(batch, 'source1'),
+                     resized)
+
+    def test_resize_exceptions(self):
+        stream = Resize(self.batch_stream, (4, 6))
+        assert_raises(ValueError, stream.transform_source_batch,
+                      [numpy.zeros((3, 4, 4)), numpy.zeros((1, 4, 4))],
+                      'source1')
+        assert_raises(ValueError, stream.transform_source_batch,
+                      [numpy.zeros((3, 4, 4), dtype='uint8'),
+                       numpy.zeros((3, 4, 4), dtype='float32')], 'source1')
+        assert_raises(NotImplementedError, stream.transform_source_example,
+                      numpy.zeros(4), 'source1')
+
 
 class TestFixedSizeRandomCrop(ImageTestingMixin):
     def setUp(self):
@@ -260,6 +337,48 @@ class TestFixedSizeRandomCrop(ImageTestingMixin):
         else:
             assert False
 
+    def test_list_batch_source_windows(self):
+        stream = RandomFixedSizeCrop(self.batch_stream, (5, 4),
+                                     which_sources=('source2',))
+        rng = numpy.random.RandomState(1)
+        for dtype in ('uint8', 'float32', 'float64'):
+            images = [rng.uniform(size=(2, 5 + i, 9 - i)).astype(dtype)
+                      for i in range(5)]
+            windows = stream.transform_source_batch(images, 'source2')
+            assert isinstance(windows, list)
+            for image, window in zip(images, windows):
+                assert window.shape == (2, 5, 4)
+                assert window.dtype == dtype
+                # The window must appear at some offset within the image
+                assert any(
+                    numpy.array_equal(image[:, h:h + 5, w:w + 4], window)
+                    for h in range(image.shape[1] - 4)
+                    for w in range(image.shape[2] - 3))
+
+    def test_list_batch_source_read_only(self):
+        stream = RandomFixedSizeCrop(self.batch_stream, (5, 4),
+                                     which_sources=('source2',))
+        image = numpy.arange(2 * 6 * 7, dtype='uint8').reshape((2, 6, 7))
+        image.setflags(write=False)
+        # Broadcast views are read-only as well
+        images = [image, numpy.broadcast_to(image[:1], (2, 6, 7))]
+        windows = stream.transform_source_batch(images, 'source2')
+        for image, window in zip(images, windows):
+            assert any(
+                numpy.array_equal(image[:, h:h + 5, w:w + 4], window)
+                for h in range(2) for w in range(4))
+
+    def test_list_batch_source_mixed_formats(self):
+        stream = RandomFixedSizeCrop(self.batch_stream, (5, 4),
+                                     which_sources=('source2',))
+        images = [numpy.zeros((2, 6, 6), dtype='uint8'),
+                  numpy.zeros((3, 5, 4), dtype='uint8'),
+                  numpy.zeros((2, 7, 5), dtype='int64')]
+        windows = stream.transform_source_batch(images, 'source2')
+        assert [window.shape for window in windows] == [
+            (2, 5, 4), (3, 5, 4), (2, 5, 4)]
+        assert windows[2].dtype == 'int64'
+
     def test_format_exceptions(self):
         estream = RandomFixedSizeCrop(self.example_stream, (5, 4),
                                       which_sources=('source2',))
@@ -284,6 +403,110 @@ class TestFixedSizeRandomCrop(ImageTestingMixin):
 
         assert_raises(ValueError, bstream.transform_source_batch,
                       numpy.empty((5, 3, 4, 2)), 'source1')
+        assert_raises(ValueError, bstream.transform_source_batch,
+                      [numpy.empty((2, 6, 6), dtype='uint8'),
+                       numpy.empty((2, 4, 6), dtype='uint8')], 'source1')
+
+
+class TestRandomCropFlipNormalize(ImageTestingMixin):
+    def setUp(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        source1 = rng.random_integers(0, 255, size=(6, 3, 7, 5)).astype(
+            'uint8')
+        source2 = [rng.random_integers(0, 255, size=(2,) + shape)
+                   .astype('uint8')
+                   for shape in [(5, 9), (6, 8), (5, 6), (5, 5), (6, 4),
+                                 (7, 4)]]
+        axis_labels = {'source1': ('batch', 'channel', 'height', 'width'),
+                       'source2': ('batch', 'channel', 'height', 'width')}
+        self.dataset = IndexableDataset(OrderedDict([('source1', source1),
+                                                     ('source2', source2)]),
+                                        axis_labels=axis_labels)
+        self.common_setup()
+
+    def assert_normalized_window(self, image, window, mean, std):
+        # The window must be a normalized, possibly flipped, window of
+        # the image at some offset.
+        _, height, width = window.shape
+        mean = numpy.reshape(mean, (-1, 1, 1))
+        std = numpy.reshape(std, (-1, 1, 1))
+        candidates = [(image[:, h:h + height, w:w + width] - mean) / std
+                      for h in range(image.shape[1] - height + 1)
+                      for w in range(image.shape[2] - width + 1)]
+        assert any(numpy.allclose(window, candidate) or
+                   numpy.allclose(window, candidate[:, :, ::-1])
+                   for candidate in candidates)
+
+    def test_ndarray_batch_source(self):
+        mean, std = [10., 20., 30.], [2., 4., 8.]
+        stream = RandomCropFlipNormalize(self.batch_stream, (5, 4),
+                                         mean=mean, std=std,
+                                         dtype='float32',
+                                         which_sources=('source1',))
+        for source1, _ in stream.get_epoch_iterator():
+            assert source1.shape[1:] == (3, 5, 4)
+            assert source1.dtype == 'float32'
+        source1 = self.dataset.indexables[0]
+        windows = stream.transform_source_batch(source1, 'source1')
+        for image, window in zip(source1, windows):
+            self.assert_normalized_window(image, window, mean, std)
+
+    def test_read_only_batch_source(self):
+        stream = RandomCropFlipNormalize(self.batch_stream, (5, 4),
+                                         mean=10., std=2.,
+                                         which_sources=('source1',))
+        source1 = self.dataset.indexables[0].copy()
+        source1.setflags(write=False)
+        # Broadcast views are read-only as well
+        for batch in (source1, numpy.broadcast_to(source1[:1], (2, 3, 7, 5))):
+            windows = stream.transform_source_batch(batch, 'source1')
+            for image, window in zip(batch, windows):
+                self.assert_normalized_window(image, window, 10., 2.)
+
+    def test_list_batch_source(self):
+        stream = RandomCropFlipNormalize(self.batch_stream, (5, 4),
+                                         mean=128., std=[64., 32.],
+                                         dtype='float64',
+                                         which_sources=('source2',))
+        source2 = self.dataset.indexables[1]
+        windows = stream.transform_source_batch(source2, 'source2')
+        assert isinstance(windows, list)
+        for image, window in zip(source2, windows):
+            assert window.shape == (2, 5, 4)
+            assert window.dtype == 'float64'
+            self.assert_normalized_window(image, window, 128., [64., 32.])
+
+    def test_example_source(self):
+        stream = RandomCropFlipNormalize(self.example_stream, (5, 4),
+                                         flip_probability=0,
+                                         which_sources=('source2',))
+        image = numpy.arange(2 * 5 * 4).reshape((2, 5, 4))
+        window = stream.transform_source_example(image, 'source2')
+        assert_equal(window, image)
+        assert window.dtype == config.floatX
+
+    def test_flip_probability(self):
+        image = numpy.arange(3 * 5 * 4, dtype='uint8').reshape((1, 3, 5, 4))
+        stream = RandomCropFlipNormalize(self.batch_stream, (5, 4),
+                                         flip_probability=1,
+                                         which_sources=('source1',))
+        assert_equal(stream.transform_source_batch(image, 'source1'),
+                     image[:, :, :, ::-1])
+
+    def test_exceptions(self):
+        assert_raises(ValueError, RandomCropFlipNormalize,
+                      self.batch_stream, (5, 4), flip_probability=1.5)
+        assert_raises(ValueError, RandomCropFlipNormalize,
+                      self.batch_stream, (5, 4), dtype='int32')
+        stream = RandomCropFlipNormalize(self.batch_stream, (5, 4),
+                                         mean=[1., 2.],
+                                         which_sources=('source1',))
+        assert_raises(ValueError, stream.transform_source_batch,
+                      numpy.zeros((2, 3, 5, 4), dtype='uint8'), 'source1')
+        assert_raises(ValueError, stream.transform_source_batch,
+                      numpy.zeros((2, 2, 4, 4), dtype='uint8'), 'source1')
+        assert_raises(ValueError, stream.transform_source_example,
+                      numpy.zeros((5, 4)), 'source1')
 
 
 class TestRandom2DRotation(ImageTestingMixin):
@@ -445,3 +668,64 @@ class TestRandom2DRotation(ImageTestingMixin):
         out = bstream.transform_source_batch(self.source3, 'source3')
         assert_equal(out[0], expected[0])
         assert_equal(out[1], expected[1])
+
+    def test_random_2D_rotation_matches_pil(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        batch = rng.random_integers(0, 255, size=(8, 3, 13, 17)).astype(
+            'uint8')
+        for resample in ('nearest', 'bilinear'):
+            bstream = Random2DRotation(
+                self.batch_stream, resample=resample,
+                rng=numpy.random.RandomState(1),
+                which_sources=('source1',))
+            out = bstream.transform_source_batch(batch, 'source1')
+            angles = numpy.random.RandomState(1).uniform(
+                -180, 180, len(batch))
+            expected = numpy.array([
+                numpy.array(Image.fromarray(im.transpose(1, 2, 0)).rotate(
+                    angle, resample=bstream.resample)).transpose(2, 0, 1)
+                for im, angle in zip(batch, angles)])
+            difference = numpy.abs(out.astype('int64') - expected)
+            if resample == 'nearest':
+                assert_equal(out, expected)
+            else:
+                assert difference.max() <= 1
+
+    def test_random_2D_rotation_read_only_batch(self):
+        batch = self.source1.copy()
+        batch.setflags(write=False)
+        expected = Random2DRotation(
+            self.batch_stream, rng=numpy.random.RandomState(1),
+            which_sources=('source1',)).transform_source_batch(
+                self.source1, 'source1')
+        bstream = Random2DRotation(self.batch_stream,
+                                   rng=numpy.random.RandomState(1),
+                                   which_sources=('source1',))
+        assert_equal(bstream.transform_source_batch(batch, 'source1'),
+                     expected)
+
+    def test_random_2D_rotation_float_batch(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        batch = rng.uniform(size=(4, 2, 9, 8))
+        bstream = Random2DRotation(self.batch_stream,
+                                   rng=numpy.random.RandomState(1),
+                                   which_sources=('source1',))
+        out = bstream.transform_source_batch(batch, 'source1')
+        assert out.dtype == 'float64'
+        # Nearest pixels are copied without any loss of precision
+        assert numpy.in1d(out[out != 0], batch).all()
+
+    def test_random_2D_rotation_bilinear_rounding(self):
+        rng = numpy.random.RandomState(config.default_seed)
+        batch = rng.random_integers(0, 255, size=(4, 2, 9, 8)).astype(
+            'uint8')
+        outs = []
+        for dtype in ('uint8', 'float64'):
+            bstream = Random2DRotation(self.batch_stream,
+                                       resample='bilinear',
+                                       rng=numpy.random.RandomState(1),
+                                       which_sources=('source1',))
+            outs.append(bstream.transform_source_batch(batch.astype(dtype),
+                                                       'source1'))
+        # Interpolated integer values are rounded, not truncated
+        assert_equal(outs[0], numpy.floor(outs[1] + 0.5))
@@ -1,5 +1,7 @@
 import logging
 import operator
+import shutil
+import tempfile
 from collections import OrderedDict
 
 import numpy
@@ -9,12 +11,14 @@ from six.moves import zip, cPickle
 from fuel import config
 from fuel.datasets import IterableDataset, IndexableDataset
 from fuel.schemes import (ConstantScheme, SequentialScheme,
-                          SequentialExampleScheme)
+                          SequentialExampleScheme, ShuffledExampleScheme,
+                          ShuffledScheme)
 from fuel.streams import DataStream
 from fuel.transformers import (
     ExpectsAxisLabels, Transformer, Mapping, SortMapping, ForceFloatX, Filter,
-    Cache, Batch, Padding, MultiProcessing, Unpack, Merge,
-    SourcewiseTransformer, Flatten, ScaleAndShift, Cast, Rename, FilterSources)
+    Cache, DiskCache, Batch, Padding, MultiProcessing, ThreadedPrefetch,
+    Unpack, Merge, SourcewiseTransformer, Flatten, ScaleAndShift, Cast, Rename,
+    FilterSources)
 from fuel.transformers.defaults import ToBytes
 
 
@@ -123,6 +127,60 @@ class TestMapping(object):
         assert_equal(list(transformer.get_epoch_iterator()),
                      list(zip(self.data, [[2, 4, 6], [4, 6, 2], [6, 4, 2]])))
 
+    def test_cache_size_requires_iteration_scheme(self):
+        stream = DataStream(IterableDataset(self.data))
+        assert_raises(ValueError, Mapping, stream, lambda d: d,
+                      cache_size=100)
+
+    def get_memoizing_stream(self, iteration_scheme, cache_size):
+        self.num_mapped = 0
+
+        def mapping(data):
+            features, = data
+            self.num_mapped += len(features) if features.ndim > 1 else 1
+            return (2 * features,)
+        dataset = IndexableDataset(
+            numpy.arange(20, dtype='int64').reshape((10, 2)))
+        return Mapping(DataStream(dataset), mapping,
+                       iteration_scheme=iteration_scheme,
+                       cache_size=cache_size)
+
+    def test_memoizes_examples(self):
+        stream = self.get_memoizing_stream(ShuffledExampleScheme(10), 160)
+        for _ in range(3):
+            epoch = sorted(list(features)
+                           for features, in stream.get_epoch_iterator())
+            assert_equal(epoch, 4 * numpy.arange(10).reshape((10, 1)) +
+                         [[0, 2]])
+        assert self.num_mapped == 10
+        assert stream.cache_misses == 10
+        assert stream.cache_hits == 20
+
+    def test_memoizes_batches(self):
+        stream = self.get_memoizing_stream(ShuffledScheme(10, 4), 160)
+        for _ in range(2):
+            for features, in stream.get_epoch_iterator():
+                assert features.shape[1:] == (2,)
+                assert_equal(features[:, 1] - features[:, 0], 2)
+        assert self.num_mapped == 10
+        assert stream.cache_hits == 10
+
+    def test_memoizing_evicts_least_recently_used(self):
+        stream = self.get_memoizing_stream(SequentialExampleScheme(10), 48)
+        for request in [0, 1, 2, 0, 3, 0, 1]:
+            assert_equal(stream.get_data(request)[0],
+                         [4 * request, 4 * request + 2])
+        # Only 3 examples of 16 bytes fit: 1 is evicted by 3, then 2 by 1
+        assert stream.cache_hits == 2
+        assert self.num_mapped == 5
+        assert_equal(list(stream._cache), [3, 0, 1])
+
+    def test_memoizing_batch_with_evicted_examples(self):
+        stream = self.get_memoizing_stream(SequentialScheme(10, 4), 16)
+        features, = stream.get_data([0, 1, 2, 1])
+        assert_equal(features, [[0, 2], [4, 6], [8, 10], [4, 6]])
+        assert_equal(list(stream._cache), [2])
+
     def test_sort_mapping_trivial_key(self):
         stream = DataStream(IterableDataset(self.data))
         transformer = Mapping(stream, SortMapping(operator.itemgetter(0)))
@@ -165,6 +223,28 @@ class TestMapping(object):
         assert_equal(list(transformer.get_epoch_iterator()),
                      data_sorted)
 
+    def test_sort_mapping_batch_key(self):
+        data = OrderedDict([('x', numpy.array(self.data_x)),
+                            ('y', self.data_y)])
+        stream = DataStream(IterableDataset(data))
+        transformer = Mapping(
+            stream, mapping=SortMapping(operator.itemgetter(0),
+                                        batch_key=True))
+        assert_equal(list(transformer.get_epoch_iterator()),
+                     [(numpy.array([1, 2, 3]), [6, 5, 4]),
+                      (numpy.array([1, 2, 3]), [4, 6, 5]),
+                      (numpy.array([1, 2, 3]), [4, 5, 6])])
+
+    def test_sort_mapping_batch_key_is_stable(self):
+        batch = (numpy.array([2, 1, 2, 1]), ['a', 'b', 'c', 'd'])
+        for reverse in (False, True):
+            expected = SortMapping(operator.itemgetter(0),
+                                   reverse=reverse)(batch)
+            sorted_batch = SortMapping(operator.itemgetter(0),
+                                       reverse=reverse,
+                                       batch_key=True)(batch)
+            assert_equal(sorted_batch, expected)
+
     def test_value_error_on_request(self):
         stream = DataStream(IterableDataset(self.data))
         transformer = Mapping(stream, lambda d: ([2 * i for i in d[0]],))
@@ -333,6 +413,57 @@ class TestFilter(object):
         wrapper = Filter(stream, lambda d: d[0][0] % 3 == 0)
         assert_equal(wrapper.axis_labels, stream.axis_labels)
 
+    def test_filter_batches_with_mask(self):
+        stream = DataStream(
+            IndexableDataset(OrderedDict([('features', numpy.arange(10)),
+                                          ('targets', list(range(10)))])),
+            iteration_scheme=SequentialScheme(10, 4))
+        wrapper = Filter(stream, lambda d: d[0] % 3 != 0, mask=True)
+        batches = list(wrapper.get_epoch_iterator())
+        assert_equal(len(batches), 3)
+        assert_equal(batches[0][0], numpy.array([1, 2]))
+        assert_equal(batches[0][1], [1, 2])
+        assert_equal(batches[1][0], numpy.array([4, 5, 7]))
+        assert_equal(batches[2][0], numpy.array([8]))
+
+    def test_filter_batches_with_mask_skips_empty_batches(self):
+        stream = DataStream(IndexableDataset(numpy.arange(9)),
+                            iteration_scheme=SequentialScheme(9, 3))
+        wrapper = Filter(stream, lambda d: d[0] > 5, mask=True)
+        assert_equal(list(wrapper.get_epoch_iterator()),
+                     [(numpy.array([6, 7, 8]),)])
+
+    def test_filter_batches_with_mask_rebatches(self):
+        stream = DataStream(
+            IndexableDataset(OrderedDict([('features', numpy.arange(20)),
+                                          ('targets', list(range(20)))])),
+            iteration_scheme=SequentialScheme(20, 4))
+        wrapper = Filter(stream, lambda d: d[0] % 2 == 0, mask=True,
+                         batch_size=3)
+        for _ in range(2):
+            batches = list(wrapper.get_epoch_iterator())
+            assert_equal([len(batch[0]) for batch in batches], [3, 3, 3, 1])
+            assert_equal(numpy.concatenate([batch[0] for batch in batches]),
+                         numpy.arange(0, 20, 2))
+            assert_equal(sum([batch[1] for batch in batches], []),
+                         list(range(0, 20, 2)))
+
+    def test_mask_raises_value_error_on_example_stream(self):
+        stream = DataStream(IterableDataset([1, 2, 3]))
+        assert_raises(ValueError, Filter, stream, lambda d: d, mask=True)
+
+    def test_batch_size_raises_value_error_without_mask(self):
+        stream = DataStream(IndexableDataset([1, 2, 3]),
+                            iteration_scheme=SequentialScheme(3, 2))
+        assert_raises(ValueError, Filter, stream, lambda d: True,
+                      batch_size=2)
+
+    def test_mask_raises_value_error_on_wrong_shape(self):
+        stream = DataStream(IndexableDataset(numpy.arange(4)),
+                            iteration_scheme=SequentialScheme(4, 2))
+        wrapper = Filter(stream, lambda d: [True], mask=True)
+        assert_raises(ValueError, next, wrapper.get_epoch_iterator())
+
 
 class TestCache(object):
     def setUp(self):
@@ -370,6 +501,20 @@ class TestCache(object):
                 assert_equal(list(range(100))[i * 7:(i + 1) * 7], features)
             assert_equal(i, 2)
 
+    def test_resume_from_position(self):
+        cached_stream = Cache(self.stream, ConstantScheme(7))
+        epoch = cached_stream.get_epoch_iterator()
+        for _ in range(3):
+            next(epoch)
+        position = cPickle.loads(cPickle.dumps(epoch.get_position()))
+        assert_equal(len(position['stream_state']['cache'][0]), 1)
+        resumed = Cache(Batch(DataStream(IterableDataset(range(100))),
+                              ConstantScheme(11)),
+                        ConstantScheme(7)).get_epoch_iterator(
+                            position=position)
+        assert_equal(numpy.concatenate([features for features, in resumed]),
+                     range(21, 100))
+
     def test_value_error_on_non_batchsizescheme(self):
         assert_raises(ValueError, Cache, self.stream, SequentialScheme(4, 2))
 
@@ -384,6 +529,125 @@ class TestCache(object):
         assert_equal(cached_stream.axis_labels, self.stream.axis_labels)
 
 
+class TestDiskCache(object):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.features = numpy.arange(40, dtype='float32').reshape((10, 2, 2))
+        self.targets = numpy.arange(10)
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def count_calls(self, data):
+        self.calls += len(data[0]) if isinstance(data[0], list) else 1
+        return data
+
+    def get_stream(self, batch_size=None):
+        dataset = IndexableDataset(OrderedDict([('features', self.features),
+                                                ('targets', self.targets)]))
+        if batch_size:
+            scheme = SequentialScheme(10, batch_size)
+        else:
+            scheme = SequentialExampleScheme(10)
+        return Mapping(DataStream(dataset, iteration_scheme=scheme),
+                       self.count_calls)
+
+    def test_examples(self):
+        stream = DiskCache(self.get_stream(), ShuffledExampleScheme(10), 10,
+                           path=self.path)
+        for _ in range(3):
+            epoch = list(stream.get_epoch_iterator())
+            assert len(epoch) == 10
+            for features, targets in epoch:
+                assert_equal(features, self.features[targets])
+        assert self.calls == 10
+
+    def test_batches(self):
+        stream = DiskCache(self.get_stream(batch_size=3),
+                           ShuffledScheme(10, 4), 10, path=self.path)
+        for _ in range(2):
+            for features, targets in stream.get_epoch_iterator():
+                assert features.shape[1:] == (2, 2)
+                assert_equal(features, self.features[targets])
+        assert self.calls == 4
+
+    def test_reads_lazily(self):
+        stream = DiskCache(self.get_stream(), SequentialScheme(10, 3), 10,
+                           path=self.path)
+        epoch = stream.get_epoch_iterator()
+        next(epoch)
+        assert stream.num_cached == 3
+
+    def test_reuses_complete_cache(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        list(stream.get_epoch_iterator())
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        assert stream.num_cached == 10
+        epoch = list(stream.get_epoch_iterator())
+        assert_equal(epoch[3][0], self.features[3])
+        # Only the first example is read, to check the cache
+        assert self.calls == 11
+
+    def test_rebuilds_mismatching_cache(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        list(stream.get_epoch_iterator())
+        self.features = self.features.astype('float64').reshape((10, 4))
+        stream = DiskCache(self.get_stream(batch_size=3),
+                           SequentialScheme(10, 5), 10, path=self.path)
+        for features, targets in stream.get_epoch_iterator():
+            assert features.dtype == 'float64'
+            assert_equal(features, self.features[targets])
+        assert self.calls == 14
+        # Caches of other sources aren't used at all
+        stream = DiskCache(FilterSources(self.get_stream(), ('targets',)),
+                           SequentialExampleScheme(10), 10, path=self.path)
+        assert stream.num_cached == 0
+
+    def test_rebuilds_cache_of_changed_values(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        list(stream.get_epoch_iterator())
+        # Same dtypes and shapes, e.g. after changing a normalization
+        self.features = self.features * 2
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        for features, targets in stream.get_epoch_iterator():
+            assert_equal(features, self.features[targets])
+        assert self.calls == 20
+
+    def test_copies_data(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        features, _ = next(stream.get_epoch_iterator())
+        features[...] = -1
+        assert_equal(next(stream.get_epoch_iterator())[0], self.features[0])
+
+    def test_pickling(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 10,
+                           path=self.path)
+        epoch = stream.get_epoch_iterator()
+        for _ in range(4):
+            next(epoch)
+        epoch = cPickle.loads(cPickle.dumps(epoch))
+        assert_equal([targets for _, targets in epoch], list(range(4, 10)))
+
+    def test_value_errors(self):
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(11), 11,
+                           path=self.path)
+        assert_raises(ValueError, list, stream.get_epoch_iterator())
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(10), 9)
+        assert_raises(ValueError, list, stream.get_epoch_iterator())
+        shutil.rmtree(stream.path)
+        stream = DiskCache(self.get_stream(), SequentialExampleScheme(11), 10,
+                           path=self.path)
+        assert_raises(ValueError, list, stream.get_epoch_iterator())
+        assert_raises(ValueError, stream.get_data, None)
+
+
 class TestBatch(object):
     def test_strictness_0(self):
         stream = DataStream(IterableDataset([1, 2, 3, 4, 5]))
@@ -423,6 +687,40 @@ class TestBatch(object):
         transformer = Batch(stream, ConstantScheme(2), strictness=0)
         assert_equal(transformer.axis_labels, {'features': ('batch', 'index')})
 
+    def test_resume_skips_data(self):
+        requests = []
+
+        def record(data):
+            requests.append(data)
+            return data
+        stream = Batch(
+            Mapping(DataStream(IndexableDataset(numpy.arange(20))), record,
+                    iteration_scheme=ShuffledExampleScheme(20)),
+            ConstantScheme(3))
+        epoch = stream.get_epoch_iterator()
+        for _ in range(4):
+            next(epoch)
+        position = epoch.get_position()
+        assert position['stream_state']['child']['num_requests'] == 12
+        expected = list(epoch)
+        del requests[:]
+        resumed = list(stream.get_epoch_iterator(position=position))
+        assert_equal(resumed, expected)
+        assert len(requests) == 8
+
+    def test_resume_replays_filtered_stream(self):
+        stream = Batch(Filter(DataStream(IterableDataset(range(10))),
+                              lambda data: data[0] % 2 == 0),
+                       ConstantScheme(2))
+        epoch = stream.get_epoch_iterator()
+        for _ in range(2):
+            next(epoch)
+        position = epoch.get_position()
+        # The position of the filtered data stream is unknown
+        assert position['stream_state'] is None
+        assert_equal([batch.tolist() for batch, in
+                      stream.get_epoch_iterator(position=position)], [[8]])
+
     def test_value_error_on_batch_stream(self):
         stream = DataStream(IndexableDataset([1, 2, 3, 4]),
                             iteration_scheme=SequentialScheme(4, 2))
@@ -456,6 +754,16 @@ class TestUnpack(object):
         epoch = wrapper.get_epoch_iterator()
         cPickle.dumps(epoch)
 
+    def test_unpack_resumes_by_replaying(self):
+        wrapper = Unpack(self.stream_np)
+        epoch = wrapper.get_epoch_iterator()
+        for _ in range(3):
+            next(epoch)
+        position = epoch.get_position()
+        assert position['stream_state'] is None
+        assert_equal(list(wrapper.get_epoch_iterator(position=position)),
+                     [(i,) for i in range(3, 10)])
+
     def test_value_error_on_example_stream(self):
         stream = DataStream(
             IterableDataset(
@@ -602,6 +910,45 @@ class TestMerge(object):
         assert_equal(next(it), ('Hello world!', 'Bonjour le monde!'))
         assert_raises(StopIteration, next, it)
 
+    def test_threaded_merge(self):
+        transformer = Merge(self.batch_streams, ('english', 'french'),
+                            num_threads=2)
+        for _ in range(2):
+            it = transformer.get_epoch_iterator()
+            assert_equal(next(it),
+                         (('Hello world!', 'Hi!'),
+                          ('Bonjour le monde!', 'Salut!')))
+            assert_raises(StopIteration, next, it)
+        transformer.close()
+
+    def test_threaded_merge_pickling(self):
+        transformer = Merge(self.streams, ('english', 'french'),
+                            num_threads=2)
+        transformer.get_epoch_iterator()
+        transformer = cPickle.loads(cPickle.dumps(transformer))
+        it = transformer.get_epoch_iterator()
+        assert_equal(next(it), ('Hello world!', 'Bonjour le monde!'))
+        assert_raises(StopIteration, next, it)
+
+    def test_resume_from_position(self):
+        transformer = Merge(
+            (DataStream(IndexableDataset(numpy.arange(10)),
+                        iteration_scheme=SequentialExampleScheme(10)),
+             Unpack(Batch(DataStream(IterableDataset(numpy.arange(10, 20))),
+                          ConstantScheme(4)))),
+            ('low', 'high'))
+        it = transformer.get_epoch_iterator()
+        for _ in range(6):
+            next(it)
+        position = it.get_position()
+        assert position['stream_state']['children'][0]['num_requests'] == 6
+        assert_equal(list(transformer.get_epoch_iterator(position=position)),
+                     [(i, i + 10) for i in range(6, 10)])
+
+    def test_value_error_on_invalid_num_threads(self):
+        assert_raises(ValueError, Merge, self.streams, ('english', 'french'),
+                      num_threads=0)
+
     def test_as_dict(self):
         assert_equal(
             next(self.transformer.get_epoch_iterator(as_dict=True)),
@@ -661,6 +1008,81 @@ class TestMultiprocessing(object):
         assert_equal(background.axis_labels, self.transformer.axis_labels)
 
 
+def raise_on_third(data):
+    if data[0] == 2:
+        raise KeyError
+    return data
+
+
+class TestThreadedPrefetch(object):
+    def setUp(self):
+        stream = DataStream(IterableDataset(range(100)))
+        self.transformer = Mapping(stream, lambda x: (x[0] + 1,))
+
+    def test_threaded_prefetch(self):
+        prefetch = ThreadedPrefetch(self.transformer, max_store=3)
+        for _ in range(2):
+            assert_equal(list(prefetch.get_epoch_iterator()),
+                         list(zip(range(1, 101))))
+        prefetch.close()
+
+    def test_new_epoch_after_partial_epoch(self):
+        prefetch = ThreadedPrefetch(self.transformer, max_store=3)
+        it = prefetch.get_epoch_iterator()
+        assert_equal(next(it), (1,))
+        assert_equal(list(prefetch.get_epoch_iterator()),
+                     list(zip(range(1, 101))))
+
+    def test_stop_iteration_is_repeated(self):
+        prefetch = ThreadedPrefetch(
+            DataStream(IterableDataset([1])), max_store=3)
+        it = prefetch.get_epoch_iterator()
+        assert_equal(next(it), (1,))
+        assert_raises(StopIteration, next, it)
+        assert_raises(StopIteration, next, it)
+
+    def test_close_stops_thread(self):
+        prefetch = ThreadedPrefetch(self.transformer, max_store=1)
+        it = prefetch.get_epoch_iterator()
+        next(it)
+        thread = prefetch._thread
+        prefetch.close()
+        assert not thread.is_alive()
+
+    def test_exceptions_are_reraised(self):
+        stream = Mapping(DataStream(IterableDataset(range(5))),
+                         raise_on_third)
+        prefetch = ThreadedPrefetch(stream)
+        it = prefetch.get_epoch_iterator()
+        assert_equal([next(it), next(it)], [(0,), (1,)])
+        assert_raises(KeyError, next, it)
+
+    def test_pickling(self):
+        prefetch = ThreadedPrefetch(DataStream(IterableDataset(range(10))),
+                                    max_store=1)
+        it = prefetch.get_epoch_iterator()
+        assert_equal(next(it), (0,))
+        unpickled = cPickle.loads(cPickle.dumps(it))
+        assert_equal(list(unpickled), list(zip(range(1, 10))))
+        # The original iterator goes on as well
+        assert_equal(list(it), list(zip(range(1, 10))))
+        # Including once the epoch is over
+        it = cPickle.loads(cPickle.dumps(it))
+        assert_raises(StopIteration, next, it)
+
+    def test_value_error_on_request(self):
+        prefetch = ThreadedPrefetch(self.transformer)
+        assert_raises(ValueError, prefetch.get_data, [0, 1])
+
+    def test_value_error_on_invalid_max_store(self):
+        assert_raises(ValueError, ThreadedPrefetch, self.transformer, 0)
+
+    def test_axis_labels_passed_on_by_default(self):
+        self.transformer.axis_labels = {'features': ('batch', 'index')}
+        prefetch = ThreadedPrefetch(self.transformer)
+        assert_equal(prefetch.axis_labels, self.transformer.axis_labels)
+
+
 class TestRename(object):
     def setUp(self):
         self.stream = DataStream(